@@ -0,0 +1,124 @@
+""" benchmark the lookup indexes of the model
+
+    Builds a synthetic database for each requested number of quiz_activity rows, then times the
+    indexed queries with the indexes dropped and again with the indexes created.  The activity
+    chart reads the quiz_activity_minutes and quiz_activity_sessions rollups, so their indexes are
+    the ones timed by get_user_activity.
+
+    usage: python3 benchmarks/bench_indexes.py --rows 1000000 10000000
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from sqlalchemy import text
+import synthetic_data
+import model
+import model_migrations
+import model_stats
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+INDEX_NAMES = ['ix_users_auth', 'ix_user_props_user_id_key', 'ix_user_props_key_value', 'ix_quiz_owner_user_id',
+               'ix_quiz_stats_question', 'ix_quiz_stats_item', 'ix_quiz_stats_user_type_time',
+               'ix_item_schedules_item', 'ix_item_schedules_due',
+               'ix_quiz_activity_minutes_user_minute', 'ix_quiz_activity_minutes_minute',
+               'ix_quiz_activity_sessions_quiz_uid', 'ix_quiz_activity_sessions_user_end', 'ix_quiz_activity_sessions_end']
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def time_call(func, repeat):
+    """ time a function
+
+        Args:
+            func - function to time, called with no arguments
+            repeat - number of times to call the function
+
+        Returns:
+            median time of a call in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def question_history(quiz_id, user_id):
+    """ raw question history for a user / quiz, the query quiz_question_summary is rebuilt from """
+    session = model.Session()
+    return session.query(model_stats.QuizStat.item_id, model_stats.QuizStat.correct).filter(
+        model_stats.QuizStat.user_id == user_id, model_stats.QuizStat.quiz_id == quiz_id,
+        model_stats.QuizStat.stat_type == 'QUIZ_QUESTION', model_stats.QuizStat.quiz_flipped == False).all()
+
+
+def run(rows, db_dir, repeat):
+    """ run the benchmark for one database size
+
+        Args:
+            rows - number of quiz_activity rows, the quiz_stats table gets the same number of rows
+            db_dir - directory to create the database in
+            repeat - number of times to call each query
+
+        Returns:
+            dictionary of query name to (ms without indexes, ms with indexes)
+    """
+    engine = synthetic_data.create_database(os.path.join(db_dir, f'bench_indexes_{rows}.db'))
+    synthetic_data.populate(engine, users=2000, quizzes=1000, lines_per_quiz=50, activity_rows=rows, question_rows=rows)
+
+    # an explicit session bypasses the user id cache, so both timings read the users table
+    queries = {'get_user_id': lambda: model.get_user_id('user1000@example.com', 'DevAuth', session=model.Session()),
+               'question history': lambda: question_history(1, 1),
+               'get_due_items': lambda: model_stats.get_due_items(1, 1, False, 5),
+               'get_user_activity(user)': lambda: model_stats.get_user_activity(1),
+               'get_user_activity(all)': lambda: model_stats.get_user_activity(None)}
+
+    results = {}
+    with engine.begin() as conn:
+        for index_name in INDEX_NAMES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {index_name}'))
+    for name, func in queries.items():
+        results[name] = [time_call(func, repeat)]
+
+    with engine.begin() as conn:
+        model_migrations._create_indexes(conn, *INDEX_NAMES)
+    for name, func in queries.items():
+        results[name].append(time_call(func, repeat))
+
+    return results
+
+
+# --------------------------------------------------
+#    Main
+# --------------------------------------------------
+def main(args):
+    db_dir = args['db_dir'] or tempfile.mkdtemp()
+    for rows in args['rows']:
+        results = run(rows, db_dir, args['repeat'])
+        print(f'\n{rows:,} quiz_activity rows / {rows:,} quiz_stats rows')
+        print(f'{"query":<28}{"no index (ms)":>16}{"indexed (ms)":>16}{"speedup":>10}')
+        for name, (before, after) in results.items():
+            print(f'{name:<28}{before:>16.2f}{after:>16.2f}{before / max(after, 0.001):>9.0f}x')
+
+
+if __name__ == '__main__':
+    # parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', help='number of quiz_activity rows to benchmark with', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--db_dir', help='directory to create the benchmark databases in, defaults to a temporary directory')
+    parser.add_argument('--repeat', help='number of times to call each query', type=int, default=5)
+    args = parser.parse_args()
+    args = vars(args)
+
+    # run the main
+    main(args)
@@ -0,0 +1,228 @@
+""" benchmark the public read functions of model and model_stats at several data sizes
+
+    Builds a seeded synthetic database for each requested scale, then times each function with the
+    in-process caches cleared before every call (cold) and with the caches filled (warm).  The
+    arguments of the calls are drawn from the same seed, so two runs of the same scales on the same
+    machine are directly comparable.  The results are written as JSON, and a previous results file
+    can be given as a baseline to print the change of each timing.
+
+    usage: python3 benchmarks/bench_model.py --scales small medium --output results.json
+           python3 benchmarks/bench_model.py --scales small --baseline results.json
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import sqlalchemy
+import synthetic_data
+import model
+import model_stats
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# arguments of synthetic_data.populate for each scale
+SCALES = {
+    'tiny': {'users': 100, 'quizzes': 50, 'lines_per_quiz': 100, 'activity_rows': 100000, 'question_rows': 100000, 'score_rows': 10000},
+    'small': {'users': 1000, 'quizzes': 500, 'lines_per_quiz': 500, 'activity_rows': 1000000, 'question_rows': 1000000, 'score_rows': 100000},
+    'medium': {'users': 2000, 'quizzes': 1000, 'lines_per_quiz': 1000, 'activity_rows': 10000000, 'question_rows': 5000000, 'score_rows': 500000},
+    'large': {'users': 5000, 'quizzes': 2000, 'lines_per_quiz': 2000, 'activity_rows': 30000000, 'question_rows': 10000000, 'score_rows': 1000000},
+}
+# number of quizzes on a page of the quiz list
+QUIZ_PAGE_SIZE = 50
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def clear_caches():
+    """ empty the in-process caches of the model so the next call reads the database """
+    model._user_id_cache.clear()
+    model._parsed_quiz_cache.clear()
+    model_stats._quiz_score_cache.clear()
+    model.Session.remove()
+
+
+def summarize(times):
+    """ return the statistics of a list of call times
+
+        Args:
+            times - list of call times in milliseconds
+
+        Returns:
+            dictionary of calls, min, median, p95, max and mean in milliseconds
+    """
+    times = sorted(times)
+    p95 = statistics.quantiles(times, n=20)[18] if len(times) > 1 else times[0]
+    return {'calls': len(times), 'min_ms': times[0], 'median_ms': statistics.median(times), 'p95_ms': p95,
+            'max_ms': times[-1], 'mean_ms': statistics.fmean(times)}
+
+
+def time_calls(func, calls, cold):
+    """ time a function over a list of arguments
+
+        Args:
+            func - function to time
+            calls - list of argument tuples, the function is called once with each
+            cold - True to clear the caches before each call
+
+        Returns:
+            list of call times in milliseconds
+    """
+    times = []
+    for args in calls:
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        func(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def sample_question_stats(rng, question_rows, repeat):
+    """ return (quiz_id, user_id) pairs which have question stats, so the question stats calls are not empty
+
+        Args:
+            rng - random.Random to draw the rows with
+            question_rows - number of quiz_stats rows in the database
+            repeat - number of pairs to return
+    """
+    session = model.Session()
+    pairs = []
+    for quiz_stat_id in [rng.randint(1, question_rows) for _ in range(repeat)]:
+        r = session.query(model_stats.QuizStat.quiz_id, model_stats.QuizStat.user_id).filter(
+            model_stats.QuizStat.quiz_stat_id == quiz_stat_id).one()
+        pairs.append((r.quiz_id, r.user_id))
+    model.Session.remove()
+    return pairs
+
+
+def run(name, scale, db_dir, repeat, seed):
+    """ run the benchmark for one scale
+
+        Args:
+            name - name of the scale
+            scale - arguments of synthetic_data.populate
+            db_dir - directory to create the database in
+            repeat - number of times to call each function
+            seed - seed of the synthetic data and of the call arguments
+
+        Returns:
+            dictionary of the results of the scale
+    """
+    start = time.perf_counter()
+    engine = synthetic_data.create_database(os.path.join(db_dir, f'bench_model_{name}.db'))
+    synthetic_data.populate(engine, seed=seed, **scale)
+    model.Session.remove()
+    populate_seconds = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    user_ids = [rng.randint(1, scale['users']) for _ in range(repeat)]
+    quiz_ids = [rng.sample(range(1, scale['quizzes'] + 1), min(QUIZ_PAGE_SIZE, scale['quizzes'])) for _ in range(repeat)]
+    pairs = sample_question_stats(rng, scale['question_rows'], repeat) if scale['question_rows'] else []
+
+    benchmarks = {
+        'model.get_quizzes(page)': (model.get_quizzes, [(None, ['name', 'owner_user_id'], None, rng.randrange(scale['quizzes']), QUIZ_PAGE_SIZE)
+                                                        for _ in range(repeat)]),
+        'model.get_quizzes(ids)': (model.get_quizzes, [(x, ['name', 'owner_user_id', 'owner_user_name']) for x in quiz_ids]),
+        'model.get_quizzes(all)': (model.get_quizzes, [(None, ['name', 'owner_user_id', 'owner_user_name'])] * repeat),
+        'model.get_user_id': (model.get_user_id, [(f'user{x}@example.com', 'DevAuth') for x in user_ids]),
+        'model_stats.get_quiz_question_stats': (model_stats.get_quiz_question_stats, [(q, u, False) for q, u in pairs]),
+        'model_stats.get_quiz_scores': (model_stats.get_quiz_scores, [(x, ) for x in user_ids]),
+        'model_stats.get_user_activity(user)': (model_stats.get_user_activity, [(x, ) for x in user_ids]),
+        'model_stats.get_user_activity(all)': (model_stats.get_user_activity, [(None, )] * repeat),
+    }
+
+    functions = {}
+    for function_name, (func, calls) in benchmarks.items():
+        if not calls:
+            continue
+        cold = time_calls(func, calls, True)
+        time_calls(func, calls, False)
+        warm = time_calls(func, calls, False)
+        functions[function_name] = {'cold': summarize(cold), 'warm': summarize(warm)}
+    clear_caches()
+    engine.dispose()
+
+    return {'scale': name, 'params': scale, 'db_size_bytes': os.path.getsize(os.path.join(db_dir, f'bench_model_{name}.db')),
+            'populate_seconds': populate_seconds, 'functions': functions}
+
+
+def git_revision():
+    """ return the git commit of the code being benchmarked, None if it is not a git checkout """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(result, baseline):
+    """ print the results of one scale
+
+        Args:
+            result - dictionary returned by run
+            baseline - results of the same scale from a previous run, or None
+    """
+    params = result['params']
+    print(f'\n{result["scale"]}: {params["users"]:,} users, {params["quizzes"]:,} quizzes x {params["lines_per_quiz"]:,} lines, '
+          f'{params["activity_rows"]:,} quiz_activity rows, {params["question_rows"]:,} quiz_stats rows, {params["score_rows"]:,} quiz_scores rows '
+          f'(populated in {result["populate_seconds"]:.0f} s)')
+    print(f'{"function":<40}{"cold p50 (ms)":>15}{"cold p95 (ms)":>15}{"warm p50 (ms)":>15}{"vs baseline":>13}')
+    for name, r in result['functions'].items():
+        change = ''
+        if baseline is not None and name in baseline['functions']:
+            before = baseline['functions'][name]['cold']['median_ms']
+            change = f'{r["cold"]["median_ms"] / max(before, 0.001):.2f}x'
+        print(f'{name:<40}{r["cold"]["median_ms"]:>15.2f}{r["cold"]["p95_ms"]:>15.2f}{r["warm"]["median_ms"]:>15.2f}{change:>13}')
+
+
+# --------------------------------------------------
+#    Main
+# --------------------------------------------------
+def main(args):
+    baselines = {}
+    if args['baseline']:
+        with open(args['baseline']) as f:
+            baselines = {r['scale']: r for r in json.load(f)['results']}
+
+    db_dir = args['db_dir'] or tempfile.mkdtemp()
+    report = {'time_created': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'git_revision': git_revision(),
+              'python': platform.python_version(), 'sqlalchemy': sqlalchemy.__version__, 'platform': platform.platform(),
+              'seed': args['seed'], 'repeat': args['repeat'], 'results': []}
+    for name in args['scales']:
+        result = run(name, SCALES[name], db_dir, args['repeat'], args['seed'])
+        report['results'].append(result)
+        print_results(result, baselines.get(name, None))
+
+        # write after each scale so the smaller scales are kept if a larger one is interrupted
+        if args['output']:
+            with open(args['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    # parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', help='scales to benchmark', nargs='+', choices=list(SCALES), default=['small', 'medium'])
+    parser.add_argument('--output', help='path of the JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--db_dir', help='directory to create the benchmark databases in, defaults to a temporary directory')
+    parser.add_argument('--repeat', help='number of times to call each function', type=int, default=20)
+    parser.add_argument('--seed', help='seed of the synthetic data and of the call arguments', type=int, default=0)
+    args = parser.parse_args()
+    args = vars(args)
+
+    # run the main
+    main(args)
@@ -0,0 +1,160 @@
+""" seeded synthetic data for the benchmarks
+
+    The same seed and sizes always produce the same database, so timings taken before and after a
+    change are comparable.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import datetime
+import os
+import random
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import model
+import model_migrations
+import model_stats
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+CHUNK_SIZE = 50000
+ANSWERS_PER_SESSION = 25
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def create_database(db_path):
+    """ create an empty database and point the model at it
+
+        Args:
+            db_path - path of the sqlite database file to create, an existing file is deleted
+
+        Returns:
+            engine of the new database
+    """
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    engine = model.init_db(db_path)
+    model_migrations.run_migrations(engine)
+    return engine
+
+
+def _insert_chunked(conn, table, rows):
+    """ insert a generator of rows in chunks of CHUNK_SIZE
+
+        Args:
+            conn - connection to insert with
+            table - table to insert into
+            rows - iterable of dictionaries
+    """
+    chunk = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(table.insert(), chunk)
+
+
+def populate(engine, users, quizzes, lines_per_quiz, activity_rows, question_rows, score_rows=0, days=90, seed=0):
+    """ fill a database created by create_database with synthetic users, quizzes and stats
+
+        Activity is generated as quiz sessions of ANSWERS_PER_SESSION answers a few seconds apart,
+        spread uniformly over the last days days.
+
+        Args:
+            engine - engine returned by create_database
+            users - number of users to create
+            quizzes - number of quizzes to create
+            lines_per_quiz - number of question lines per quiz
+            activity_rows - number of quiz_activity rows to create
+            question_rows - number of QUIZ_QUESTION quiz_stats rows to create
+            score_rows - number of quiz_scores rows to create
+            days - number of days of history to spread the stats over
+            seed - random seed
+
+        Returns:
+            dictionary describing the generated data, i.e. {'user_ids': [...], 'quiz_ids': [...]}
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    history = datetime.timedelta(days=days).total_seconds()
+
+    user_ids = list(range(1, users + 1))
+    quiz_ids = list(range(1, quizzes + 1))
+
+    def gen_users():
+        for user_id in user_ids:
+            yield {'user_id': user_id, 'auth_username': f'user{user_id}@example.com', 'auth_method': 'DevAuth'}
+
+    def gen_user_props():
+        for user_id in user_ids:
+            yield {'user_id': user_id, 'key': 'display_name', 'value': f'User {user_id}'}
+
+    def gen_quizzes():
+        for quiz_id in quiz_ids:
+            data = '\n'.join(f'question {quiz_id}-{i}|answer {quiz_id}-{i}' for i in range(lines_per_quiz))
+            yield {'quiz_id': quiz_id, 'owner_user_id': rng.choice(user_ids), 'name': f'Quiz {quiz_id}', 'data': data, 'flags': 0, 'version': 0}
+
+    def item_id(quiz_id, line):
+        return (quiz_id - 1) * lines_per_quiz + line + 1
+
+    def gen_quiz_items():
+        for quiz_id in quiz_ids:
+            for i in range(lines_per_quiz):
+                yield {'quiz_item_id': item_id(quiz_id, i), 'quiz_id': quiz_id, 'position': i,
+                       'question': f'question {quiz_id}-{i}', 'answer': f'answer {quiz_id}-{i}', 'active': True}
+
+    def gen_sessions(rows):
+        # yields (user_id, quiz_id, quiz_uid, time, line) for each answer
+        quiz_uid = 0
+        while rows > 0:
+            quiz_uid = quiz_uid + 1
+            user_id = rng.choice(user_ids)
+            quiz_id = rng.choice(quiz_ids)
+            t = now - datetime.timedelta(seconds=rng.random() * history)
+            for _ in range(min(rows, ANSWERS_PER_SESSION)):
+                t = t + datetime.timedelta(seconds=rng.randint(2, 20))
+                yield user_id, quiz_id, quiz_uid, t, rng.randrange(lines_per_quiz)
+                rows = rows - 1
+
+    def gen_activity():
+        for user_id, quiz_id, quiz_uid, t, line in gen_sessions(activity_rows):
+            stat_type = rng.choice([model_stats.ActivityId.QUIZ_QUESTION_CORRECT.value, model_stats.ActivityId.QUIZ_QUESTION_INCORRECT.value])
+            yield {'quiz_id': quiz_id, 'user_id': user_id, 'quiz_uid': quiz_uid, 'quiz_flipped': False, 'time_created': t,
+                   'stat_type': stat_type, 'key': f'question {quiz_id}-{line}', 'value': '0', 'item_id': item_id(quiz_id, line)}
+
+    def gen_question_stats():
+        for user_id, quiz_id, quiz_uid, t, line in gen_sessions(question_rows):
+            yield {'quiz_id': quiz_id, 'user_id': user_id, 'quiz_flipped': False, 'time_created': t,
+                   'stat_type': 'QUIZ_QUESTION', 'key': f'question {quiz_id}-{line}', 'correct': rng.random() < 0.5,
+                   'item_id': item_id(quiz_id, line)}
+
+    def gen_scores():
+        for _ in range(score_rows):
+            quiz_type = rng.choice(['', 'Mini'])
+            total = lines_per_quiz if quiz_type == '' else min(lines_per_quiz, 10)
+            yield {'quiz_id': rng.choice(quiz_ids), 'user_id': rng.choice(user_ids), 'quiz_type': quiz_type, 'quiz_flipped': False,
+                   'correct': rng.randint(0, total), 'total': total, 'elapsed_time': rng.randint(10, 20 * total),
+                   'time_created': now - datetime.timedelta(seconds=rng.random() * history)}
+
+    with engine.begin() as conn:
+        _insert_chunked(conn, model.User.__table__, gen_users())
+        _insert_chunked(conn, model.UserProps.__table__, gen_user_props())
+        _insert_chunked(conn, model.Quiz.__table__, gen_quizzes())
+        _insert_chunked(conn, model.QuizItem.__table__, gen_quiz_items())
+        _insert_chunked(conn, model_stats.QuizActivity.__table__, gen_activity())
+        _insert_chunked(conn, model_stats.QuizStat.__table__, gen_question_stats())
+        _insert_chunked(conn, model_stats.QuizScore.__table__, gen_scores())
+    model_stats.rebuild_quiz_question_summaries()
+    model_stats.rebuild_item_schedules()
+    model_stats.rebuild_activity_rollups()
+    model.rebuild_quiz_search()
+
+    return {'user_ids': user_ids, 'quiz_ids': quiz_ids}
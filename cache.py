@@ -0,0 +1,103 @@
+""" small in-process caches shared by the model modules """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import threading
+from collections import OrderedDict
+
+
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+# functions called with (cache name, key) when an entry of a named cache is invalidated, see add_invalidation_listener
+_invalidation_listeners = []
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class LRUCache:
+    """ thread safe bounded least recently used cache with explicit invalidation """
+    MISSING = object()
+
+    def __init__(self, maxsize, name=None):
+        """ init
+
+            Args:
+                maxsize - maximum number of entries, the least recently used entry is evicted after that
+                name - name of the cache, the invalidations of named caches are passed to the invalidation listeners
+        """
+        self._maxsize = maxsize
+        self._name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """ return the cached value for a key
+
+            Args:
+                key - key to look up
+
+            Returns:
+                cached value, or LRUCache.MISSING if the key is not cached
+        """
+        with self._lock:
+            value = self._data.get(key, self.MISSING)
+            if value is not self.MISSING:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """ cache a value
+
+            Args:
+                key - key to cache the value under
+                value - value to cache, None is a valid value
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """ remove a key from the cache if it is cached
+
+            Args:
+                key - key to remove
+        """
+        with self._lock:
+            self._data.pop(key, None)
+        if self._name is not None:
+            for listener in _invalidation_listeners:
+                listener(self._name, key)
+
+    def clear(self):
+        """ remove all keys from the cache """
+        with self._lock:
+            self._data.clear()
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def add_invalidation_listener(listener):
+    """ call a function whenever an entry of a named cache is invalidated, i.e. to tell other processes
+
+        Args:
+            listener - function called with (cache name, key)
+    """
+    _invalidation_listeners.append(listener)
+
+
+def remove_invalidation_listener(listener):
+    """ stop calling a function added with add_invalidation_listener
+
+        Args:
+            listener - function to remove
+    """
+    _invalidation_listeners.remove(listener)
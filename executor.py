@@ -0,0 +1,247 @@
+""" bounded worker pool for the database work of the handlers, and per connection ordering of the handlers
+
+    pylinkjs runs each handler call on its own thread, and a handler which reads a value back from
+    the browser waits on that thread for the reply.  Only the database work of a handler is handed to
+    the pool, see run_db, so a slow or stalled browser only holds up its own handler, and a slow query
+    or a locked database only holds up the pool worker it runs on.  The database work never waits on
+    a browser, so the pool can not be filled by clients which stop responding.
+
+    The handlers of one connection run one at a time in the order they were called, see ordered, and
+    waiting for the turn does not take a pool worker either.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import metrics
+import model
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# number of database calls which can run at the same time, matches the default database pool size
+EXECUTOR_MAX_WORKERS = 8
+# new database calls are refused once this many calls are waiting or running
+EXECUTOR_MAX_PENDING = 1000
+# seconds a handler waits for a database call before giving up on it
+DB_WORK_TIMEOUT = 30
+
+
+# --------------------------------------------------
+#    Exceptions
+# --------------------------------------------------
+class ExecutorBusyException(Exception):
+    pass
+
+
+class DbWorkTimeoutException(Exception):
+    pass
+
+
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+# active is True on a pool worker while it runs a database call
+_worker = threading.local()
+
+# connections whose turn is held by this thread, see ConnectionOrder
+_turns_held = threading.local()
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class ConnectionOrder:
+    """ first come first served lock for each connection
+
+        The handlers of a connection take turns in the order they asked for a turn.  A thread which
+        already holds the turn of a connection, i.e. a handler called from a handler, gets it again
+        right away.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turns = {}
+
+    def __len__(self):
+        return len(self._turns)
+
+    @contextlib.contextmanager
+    def turn(self, key):
+        """ wait for the turn of a connection and hold it for the with block
+
+            Args:
+                key - connection to take the turn of
+        """
+        held = getattr(_turns_held, 'keys', None)
+        if held is None:
+            held = set()
+            _turns_held.keys = held
+        if key in held:
+            yield
+            return
+
+        with self._lock:
+            state = self._turns.get(key, None)
+            if state is None:
+                state = {'next_ticket': 0, 'serving': 0, 'cond': threading.Condition(self._lock)}
+                self._turns[key] = state
+            ticket = state['next_ticket']
+            state['next_ticket'] = ticket + 1
+            while state['serving'] != ticket:
+                state['cond'].wait()
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            with self._lock:
+                state['serving'] = state['serving'] + 1
+                if state['serving'] == state['next_ticket']:
+                    del self._turns[key]
+                else:
+                    state['cond'].notify_all()
+
+
+class DbExecutor:
+    """ fixed pool of threads for the database calls of the handlers
+
+        Each call runs with its own database session, which is released when the call returns, so
+        nothing is held open between the calls of a handler.
+    """
+    def __init__(self, max_workers, max_pending):
+        """ init
+
+            Args:
+                max_workers - number of worker threads
+                max_pending - maximum number of calls waiting or running, submit raises ExecutorBusyException after that
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        self._max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._pending
+
+    def submit(self, func, *args, **kwargs):
+        """ queue a database call
+
+            The SQL statements of the call are counted in the metrics of the handlers running on the
+            calling thread, see metrics.record_handler
+
+            Args:
+                func - function to call
+                args - arguments of the function
+                kwargs - keyword arguments of the function
+
+            Returns:
+                Future of the result of the call, cancelling it before it starts skips the call
+
+            Throws ExecutorBusyException if max_pending calls are already waiting or running
+        """
+        with self._lock:
+            if self._pending >= self._max_pending:
+                raise ExecutorBusyException(f'{self._pending} database calls are already waiting')
+            self._pending = self._pending + 1
+        try:
+            future = self._pool.submit(self._run, metrics.handler_counters(), func, args, kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending = self._pending - 1
+
+    def _run(self, counters, func, args, kwargs):
+        """ run a database call on this worker thread """
+        _worker.active = True
+        try:
+            with metrics.use_handler_counters(counters):
+                return func(*args, **kwargs)
+        finally:
+            _worker.active = False
+            model.Session.remove()
+
+    def shutdown(self, wait=True):
+        """ stop the worker threads
+
+            Args:
+                wait - True to wait for the queued calls to finish
+        """
+        self._pool.shutdown(wait=wait)
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def ordered(key):
+    """ run the with block in turn with the other handlers of a connection
+
+        Args:
+            key - connection of the handler
+    """
+    return connection_order.turn(key)
+
+
+def run_db(func, *args, **kwargs):
+    """ run database work on the pool and wait for the result
+
+        The function must not talk to the browser and should return plain values, the database
+        objects it loads are detached when it returns.  Database work started from database work
+        is called directly.
+
+        Args:
+            func - function to call
+            args - arguments of the function
+            kwargs - keyword arguments of the function
+
+        Returns:
+            return value of the function
+
+        Throws ExecutorBusyException if too many database calls are waiting, DbWorkTimeoutException
+        if the call did not finish within the database work timeout
+    """
+    if getattr(_worker, 'active', False):
+        return func(*args, **kwargs)
+
+    future = db_executor.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=db_work_timeout)
+    except TimeoutError:
+        # a call which has not started yet is skipped, a running one finishes on its own
+        future.cancel()
+        raise DbWorkTimeoutException(f'{getattr(func, "__name__", func)} did not finish within {db_work_timeout} seconds')
+
+
+def init_executor(max_workers=EXECUTOR_MAX_WORKERS, max_pending=EXECUTOR_MAX_PENDING, timeout=DB_WORK_TIMEOUT):
+    """ replace the database executor
+
+        Args:
+            max_workers - number of database calls which can run at the same time
+            max_pending - new database calls are refused once this many calls are waiting or running
+            timeout - seconds a handler waits for a database call before giving up on it
+
+        Returns:
+            the new DbExecutor
+    """
+    global db_executor, db_work_timeout
+    previous = globals().get('db_executor', None)
+    db_executor = DbExecutor(max_workers, max_pending)
+    db_work_timeout = timeout
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return db_executor
+
+
+# --------------------------------------------------
+#    Init
+# --------------------------------------------------
+connection_order = ConnectionOrder()
+init_executor()
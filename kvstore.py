@@ -0,0 +1,133 @@
+""" key value store shared by the worker processes, kept in a local SQLite file
+
+    A stand-in for a redis server when all the worker processes run on one machine.  Values are
+    stored as JSON with an optional time to live, and a small event log lets a process tell the
+    others about changes, i.e. the cache invalidations, see workers.CacheSync.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# milliseconds to wait for the store while another process is writing to it
+KV_BUSY_TIMEOUT = 5000
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class SqliteKVStore:
+    """ process and thread safe key value store with expiry and an event log
+
+        Each thread uses its own connection in autocommit mode, the file runs in WAL mode so
+        readers do not wait for the writers.
+    """
+    def __init__(self, path):
+        """ init, creates the store if it does not exist
+
+            Args:
+                path - path of the sqlite file of the store
+        """
+        self._path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS kv_events (event_id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+                     'message TEXT NOT NULL, time_created REAL NOT NULL)')
+
+    def _conn(self):
+        """ return the connection of this thread """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=KV_BUSY_TIMEOUT / 1000.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """ return the value of a key
+
+            Args:
+                key - key to look up
+
+            Returns:
+                value, or None if the key does not exist or has expired
+        """
+        r = self._conn().execute('SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)', (key, time.time())).fetchone()
+        return None if r is None else json.loads(r[0])
+
+    def set(self, key, value, ttl=None):
+        """ set the value of a key
+
+            Args:
+                key - key to set
+                value - json serializable value
+                ttl - seconds until the key expires, None to keep it until it is deleted
+        """
+        expires = None if ttl is None else time.time() + ttl
+        self._conn().execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)', (key, json.dumps(value), expires))
+
+    def delete(self, key):
+        """ delete a key if it exists
+
+            Args:
+                key - key to delete
+        """
+        self._conn().execute('DELETE FROM kv WHERE key = ?', (key, ))
+
+    def publish(self, channel, message):
+        """ add a message to the event log
+
+            Args:
+                channel - name of the channel
+                message - json serializable message
+        """
+        self._conn().execute('INSERT INTO kv_events (channel, message, time_created) VALUES (?, ?, ?)',
+                             (channel, json.dumps(message), time.time()))
+
+    def last_event_id(self):
+        """ return the id of the newest message in the event log, 0 if it is empty """
+        return self._conn().execute('SELECT COALESCE(MAX(event_id), 0) FROM kv_events').fetchone()[0]
+
+    def poll(self, channel, after_event_id):
+        """ return the messages added to a channel after an event id
+
+            Args:
+                channel - name of the channel
+                after_event_id - id of the last message already seen
+
+            Returns:
+                list of (event_id, message) in the order they were published
+        """
+        rows = self._conn().execute('SELECT event_id, message FROM kv_events WHERE event_id > ? AND channel = ? ORDER BY event_id',
+                                    (after_event_id, channel)).fetchall()
+        return [(event_id, json.loads(message)) for event_id, message in rows]
+
+    def purge(self, event_max_age):
+        """ delete the expired keys and the old messages of the event log
+
+            Args:
+                event_max_age - messages older than this many seconds are deleted
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute('DELETE FROM kv WHERE expires <= ?', (now, ))
+        conn.execute('DELETE FROM kv_events WHERE time_created < ?', (now - event_max_age, ))
+
+    def close(self):
+        """ close the connection of this thread """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,299 @@
+""" per handler latency, SQL and websocket message metrics
+
+    Each handler call is recorded into rolling histograms of its wall time, the number of SQL
+    statements it ran, the time spent in those statements and the number of messages it sent to the
+    browser.  The histograms only keep the last METRICS_WINDOW seconds, so they show how the app is
+    behaving now rather than since it started.  They are served as JSON by a small HTTP server on
+    localhost, see start_metrics_server.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import bisect
+import contextlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# default port of the metrics endpoint, next to the app on 8300
+METRICS_PORT = 8301
+# seconds of history kept by the rolling histograms
+METRICS_WINDOW = 300
+# number of slots the window is divided into, a slot is dropped as a whole when it ages out
+METRICS_SLOTS = 10
+# upper bounds of the buckets of the time histograms in milliseconds
+TIME_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+# upper bounds of the buckets of the count histograms
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+# histograms recorded for each handler and the buckets of each
+HANDLER_HISTOGRAMS = {'wall_ms': TIME_BUCKETS_MS, 'sql_statements': COUNT_BUCKETS, 'sql_ms': TIME_BUCKETS_MS,
+                      'ws_messages': COUNT_BUCKETS}
+
+
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+# counters of the handlers running on this thread, outermost first, see record_handler
+_active = threading.local()
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class RollingHistogram:
+    """ thread safe bucketed histogram of the values observed in the last window seconds
+
+        The window is divided into slots, each with its own bucket counts.  Observing a value adds
+        it to the current slot, and slots older than the window are cleared as time moves on, so
+        observing and reading are O(buckets) no matter how many values were observed.
+    """
+    def __init__(self, bounds, window=METRICS_WINDOW, slots=METRICS_SLOTS):
+        """ init
+
+            Args:
+                bounds - sorted upper bounds of the buckets, values above the last bound go in an overflow bucket
+                window - seconds of history to keep
+                slots - number of slots the window is divided into
+        """
+        self._bounds = tuple(bounds)
+        self._slot_seconds = window / slots
+        self._slots = [self._new_slot(None) for _ in range(slots)]
+        self._lock = threading.Lock()
+
+    def _new_slot(self, epoch):
+        """ return an empty slot for a slot epoch """
+        return {'epoch': epoch, 'counts': [0] * (len(self._bounds) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+
+    def _current_epoch(self):
+        return int(time.monotonic() // self._slot_seconds)
+
+    def observe(self, value):
+        """ add a value to the histogram
+
+            Args:
+                value - value to add
+        """
+        epoch = self._current_epoch()
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            slot = self._slots[epoch % len(self._slots)]
+            if slot['epoch'] != epoch:
+                slot = self._new_slot(epoch)
+                self._slots[epoch % len(self._slots)] = slot
+            slot['counts'][i] = slot['counts'][i] + 1
+            slot['count'] = slot['count'] + 1
+            slot['sum'] = slot['sum'] + value
+            slot['max'] = max(slot['max'], value)
+
+    def snapshot(self):
+        """ return the values observed in the window
+
+            The quantiles are the upper bound of the bucket the quantile falls in, capped at the
+            largest value observed
+
+            Returns:
+                dictionary of count, sum, mean, max, p50, p95, p99 and buckets, a list of [upper bound, count]
+                with None as the upper bound of the overflow bucket
+        """
+        oldest = self._current_epoch() - len(self._slots) + 1
+        counts = [0] * (len(self._bounds) + 1)
+        count = 0
+        total = 0.0
+        largest = 0.0
+        with self._lock:
+            for slot in self._slots:
+                if slot['epoch'] is None or slot['epoch'] < oldest:
+                    continue
+                counts = [a + b for a, b in zip(counts, slot['counts'])]
+                count = count + slot['count']
+                total = total + slot['sum']
+                largest = max(largest, slot['max'])
+
+        def quantile(q):
+            if count == 0:
+                return None
+            rank = q * count
+            seen = 0
+            for bound, c in zip(self._bounds, counts):
+                seen = seen + c
+                if seen >= rank:
+                    return min(bound, largest)
+            return largest
+
+        return {'count': count, 'sum': total, 'mean': total / count if count else None, 'max': largest if count else None,
+                'p50': quantile(0.5), 'p95': quantile(0.95), 'p99': quantile(0.99),
+                'buckets': [[b, c] for b, c in zip(list(self._bounds) + [None], counts)]}
+
+
+class HandlerMetrics:
+    """ thread safe registry of the rolling histograms of each handler """
+    def __init__(self):
+        self._handlers = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, values, failed):
+        """ record a handler call
+
+            Args:
+                name - name of the handler
+                values - dictionary of histogram name to value, see HANDLER_HISTOGRAMS
+                failed - True if the handler raised an exception
+        """
+        with self._lock:
+            histograms = self._handlers.get(name, None)
+            if histograms is None:
+                histograms = {k: RollingHistogram(v) for k, v in HANDLER_HISTOGRAMS.items()}
+                self._handlers[name] = histograms
+                self._errors[name] = 0
+            if failed:
+                self._errors[name] = self._errors[name] + 1
+        for k, v in values.items():
+            histograms[k].observe(v)
+
+    def snapshot(self):
+        """ return the histograms of every handler as a json serializable dictionary """
+        with self._lock:
+            handlers = dict(self._handlers)
+            errors = dict(self._errors)
+        return {'window_seconds': METRICS_WINDOW,
+                'handlers': {name: dict({k: v.snapshot() for k, v in histograms.items()}, errors=errors[name])
+                             for name, histograms in sorted(handlers.items())}}
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """ serves the handler metrics as JSON on /metrics """
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = json.dumps(handler_metrics.snapshot()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the endpoint is polled, do not log every request
+        pass
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+@contextlib.contextmanager
+def record_handler(name):
+    """ record the wall time, SQL statements and websocket messages of a handler into handler_metrics
+
+        Handlers called from a handler are recorded on their own and are also included in the
+        numbers of the handler which called them.
+
+        Args:
+            name - name of the handler
+    """
+    stack = getattr(_active, 'stack', None)
+    if stack is None:
+        stack = []
+        _active.stack = stack
+    counters = {'sql_statements': 0, 'sql_ms': 0.0, 'ws_messages': 0}
+    stack.append(counters)
+    failed = True
+    start = time.perf_counter()
+    try:
+        yield
+        failed = False
+    finally:
+        counters['wall_ms'] = (time.perf_counter() - start) * 1000
+        stack.pop()
+        handler_metrics.record(name, counters, failed)
+
+
+def handler_counters():
+    """ return the counters of the handlers running on this thread, to pass to use_handler_counters on another thread """
+    return list(getattr(_active, 'stack', ()))
+
+
+@contextlib.contextmanager
+def use_handler_counters(counters):
+    """ count the SQL statements of the with block in the counters of handlers running on another thread
+
+        The handlers must be waiting for the with block, i.e. for a database call run on a worker thread.
+
+        Args:
+            counters - list returned by handler_counters on the thread of the handlers
+    """
+    previous = getattr(_active, 'stack', None)
+    _active.stack = list(counters)
+    try:
+        yield
+    finally:
+        _active.stack = previous
+
+
+def count_ws_message():
+    """ count a message sent to the browser by the handlers running on this thread """
+    for counters in getattr(_active, 'stack', ()):
+        counters['ws_messages'] = counters['ws_messages'] + 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (time.perf_counter() - conn.info['metrics_start'].pop()) * 1000
+    for counters in getattr(_active, 'stack', ()):
+        counters['sql_statements'] = counters['sql_statements'] + 1
+        counters['sql_ms'] = counters['sql_ms'] + elapsed
+
+
+def _handle_error(exception_context):
+    # the statement failed, so after_cursor_execute is not called for it
+    if exception_context.connection is not None:
+        starts = exception_context.connection.info.get('metrics_start', None)
+        if starts:
+            starts.pop()
+
+
+def instrument_engine(engine):
+    """ count the SQL statements run on an engine and the time spent in them
+
+        Args:
+            engine - engine to instrument, i.e. model.engine after model.init_db
+    """
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def start_metrics_server(port=METRICS_PORT, host='127.0.0.1'):
+    """ serve the handler metrics as JSON on a background thread
+
+        Args:
+            port - port to listen on
+            host - address to listen on, only the local machine by default
+
+        Returns:
+            ThreadingHTTPServer, call shutdown() on it to stop serving
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f'metrics available on http://{host}:{port}/metrics')
+    return server
+
+
+# --------------------------------------------------
+#    Init
+# --------------------------------------------------
+handler_metrics = HandlerMetrics()
@@ -0,0 +1,319 @@
+""" versioned schema migrations
+
+    Base.metadata.create_all creates missing tables with their current schema, but it does not change
+    tables which already exist.  Each migration below brings an existing database up to date and is
+    written so it can also run against a freshly created database.
+
+    To change the schema of an existing table, add the column / index to the ORM class and append a
+    new migration with the next version number.
+
+    Migrations only use the columns which exist at their version.  Derived tables are filled by the
+    rebuild functions in REBUILDS, which always match the current ORM classes, so a migration lists
+    the rebuilds it needs and they run once after all pending migrations.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import logging
+from sqlalchemy import inspect, select, text, Column, Integer, String, func
+from sqlalchemy.exc import OperationalError
+import model
+import model_stats
+from model import Base, UtcDateTime
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# indexes created by released migrations which are no longer declared on the ORM classes, see _create_indexes
+RETIRED_INDEXES = {'ix_quiz_activity_user_time': 'CREATE INDEX IF NOT EXISTS ix_quiz_activity_user_time ON quiz_activity (user_id, time_created)',
+                   'ix_quiz_activity_time': 'CREATE INDEX IF NOT EXISTS ix_quiz_activity_time ON quiz_activity (time_created)'}
+
+
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+MIGRATIONS = []
+REBUILDS = {'question_summaries': model_stats.rebuild_quiz_question_summaries,
+            'activity_rollups': model_stats.rebuild_activity_rollups,
+            'item_schedules': model_stats.rebuild_item_schedules,
+            'quiz_search': model.rebuild_quiz_search}
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def migration(version, description, rebuilds=()):
+    """ decorator to register a migration
+
+        Args:
+            version - version number of the schema after this migration runs
+            description - short description of the migration
+            rebuilds - names of the REBUILDS to run after all pending migrations
+    """
+    def decorator(migrate):
+        MIGRATIONS.append((version, description, migrate, rebuilds))
+        MIGRATIONS.sort(key=lambda x: x[0])
+        return migrate
+    return decorator
+
+
+def _index_exists(conn, table_name, index_name):
+    """ return True if an index exists
+
+        SQLAlchemy does not reflect expression indexes on SQLite, so SQLite is asked directly
+
+        Args:
+            conn - connection to the database
+            table_name - table of the index
+            index_name - name of the index
+    """
+    if conn.dialect.name == 'sqlite':
+        return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {'name': index_name}).first() is not None
+    return index_name in [i['name'] for i in inspect(conn).get_indexes(table_name)]
+
+
+def _create_indexes(conn, *index_names):
+    """ create indexes declared on the ORM classes, or listed in RETIRED_INDEXES, if they do not exist yet
+
+        Args:
+            conn - connection to run the migration on
+            index_names - names of the indexes to create
+    """
+    indexes = {i.name: i for t in Base.metadata.sorted_tables for i in t.indexes}
+    for index_name in index_names:
+        if index_name in RETIRED_INDEXES:
+            # a later migration drops the index, it is still created so every database takes the same route
+            conn.execute(text(RETIRED_INDEXES[index_name]))
+        elif not _index_exists(conn, indexes[index_name].table.name, index_name):
+            indexes[index_name].create(bind=conn)
+
+
+def _drop_index_if_exists(conn, table_name, index_name):
+    """ drop an index which is no longer declared on the ORM classes
+
+        Args:
+            conn - connection to run the migration on
+            table_name - table of the index
+            index_name - name of the index to drop
+    """
+    if _index_exists(conn, table_name, index_name):
+        conn.execute(text(f'DROP INDEX {index_name}'))
+
+
+def _add_column_if_missing(conn, table_name, column_name, column_ddl):
+    """ add a column to an existing table
+
+        Args:
+            conn - connection to run the migration on
+            table_name - table to add the column to
+            column_name - name of the new column
+            column_ddl - column type and default, i.e. INTEGER DEFAULT 0
+    """
+    if column_name not in [c['name'] for c in inspect(conn).get_columns(table_name)]:
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_ddl}'))
+
+
+def get_schema_version(conn):
+    """ return the schema version of the database
+
+        Args:
+            conn - connection to the database
+
+        Returns:
+            schema version, 0 if no migrations have been run
+    """
+    version = conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar()
+    return 0 if version is None else version
+
+
+def run_migrations(engine=None):
+    """ create missing tables and run all pending migrations
+
+        Args:
+            engine - engine of the database to migrate, defaults to model.engine
+
+        Returns:
+            schema version of the database after migrating
+    """
+    if engine is None:
+        engine = model.engine
+
+    # create missing tables
+    Base.metadata.create_all(engine)
+
+    # run the pending migrations, each in its own transaction
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    rebuilds = []
+    for migration_version, description, migrate, migration_rebuilds in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        logging.info(f'Migrating database to version {migration_version}: {description}')
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(SchemaVersion.__table__.insert().values(version=migration_version, description=description))
+        rebuilds.extend(r for r in migration_rebuilds if r not in rebuilds)
+        version = migration_version
+
+    # rebuild the derived tables
+    for r in rebuilds:
+        logging.info(f'Rebuilding {r}')
+        REBUILDS[r]()
+
+    return version
+
+
+# --------------------------------------------------
+#    ORM Classes
+# --------------------------------------------------
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    time_applied = Column(UtcDateTime, server_default=func.now())
+
+    def __repr__(self):
+        return '<SchemaVersion(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['version', 'description', 'time_applied']]) + ')>'
+
+
+# --------------------------------------------------
+#    Migrations
+# --------------------------------------------------
+@migration(1, 'add flags to quiz')
+def _migration_1(conn):
+    _add_column_if_missing(conn, 'quiz', 'flags', 'INTEGER DEFAULT 0')
+
+
+@migration(2, 'add quiz_flipped to quiz_activity and quiz_stats')
+def _migration_2(conn):
+    _add_column_if_missing(conn, 'quiz_activity', 'quiz_flipped', 'BOOLEAN NOT NULL DEFAULT 0')
+    _add_column_if_missing(conn, 'quiz_stats', 'quiz_flipped', 'BOOLEAN NOT NULL DEFAULT 0')
+
+
+@migration(3, 'create lookup indexes on users, user_props, quiz, quiz_stats and quiz_activity')
+def _migration_3(conn):
+    _create_indexes(conn, 'ix_users_auth', 'ix_user_props_user_id_key', 'ix_user_props_key_value', 'ix_quiz_owner_user_id',
+                    'ix_quiz_stats_question', 'ix_quiz_stats_user_type_time', 'ix_quiz_activity_user_time', 'ix_quiz_activity_time')
+
+
+@migration(4, 'backfill quiz_question_summary', rebuilds=['question_summaries'])
+def _migration_4(conn):
+    pass
+
+
+@migration(5, 'backfill quiz_activity_minutes and quiz_activity_sessions', rebuilds=['activity_rollups'])
+def _migration_5(conn):
+    pass
+
+
+@migration(6, 'add version to quiz')
+def _migration_6(conn):
+    _add_column_if_missing(conn, 'quiz', 'version', 'INTEGER DEFAULT 0')
+
+
+@migration(7, 'create quiz_items from quiz data and add item_id to the stats', rebuilds=['question_summaries'])
+def _migration_7(conn):
+    _add_column_if_missing(conn, 'quiz_stats', 'item_id', 'INTEGER')
+    _add_column_if_missing(conn, 'quiz_activity', 'item_id', 'INTEGER')
+    _add_column_if_missing(conn, 'quiz_question_summary', 'item_id', 'INTEGER')
+    conn.execute(text('DROP INDEX IF EXISTS ix_quiz_question_summary_lookup'))
+    conn.execute(text('DELETE FROM quiz_question_summary'))
+    _create_indexes(conn, 'ix_quiz_stats_item', 'ix_quiz_question_summary_item')
+
+    # create the items of every quiz which does not have items yet
+    quiz_items = model.QuizItem.__table__
+    with_items = select(quiz_items.c.quiz_id)
+    for quiz in conn.execute(text('SELECT quiz_id, data FROM quiz')).fetchall():
+        if conn.execute(with_items.where(quiz_items.c.quiz_id == quiz.quiz_id).limit(1)).first() is not None:
+            continue
+        rows = [{'quiz_id': quiz.quiz_id, 'position': i, 'question': q, 'answer': a, 'active': True}
+                for i, (q, a) in enumerate(model.parse_quiz_data(quiz.data))]
+        if rows:
+            conn.execute(quiz_items.insert(), rows)
+
+    # point the stats at the items by question text, flipped stats are keyed by the answer text
+    for table_name in ('quiz_stats', 'quiz_activity'):
+        conn.execute(text(f'UPDATE {table_name} SET item_id = ('
+                          f'  SELECT i.quiz_item_id FROM quiz_items i WHERE i.quiz_id = {table_name}.quiz_id AND ('
+                          f'    ({table_name}.quiz_flipped = :false AND i.question = {table_name}.key) OR '
+                          f'    ({table_name}.quiz_flipped = :true AND i.answer = {table_name}.key))'
+                          f'  ORDER BY i.quiz_item_id LIMIT 1) '
+                          f"WHERE item_id IS NULL AND key != ''"), {'false': False, 'true': True})
+
+
+@migration(8, 'backfill item_schedules', rebuilds=['item_schedules'])
+def _migration_8(conn):
+    pass
+
+
+@migration(9, 'create name indexes on quiz')
+def _migration_9(conn):
+    _create_indexes(conn, 'ix_quiz_owner_name', 'ix_quiz_lower_name')
+
+
+@migration(10, 'create the quiz_fts full text search table', rebuilds=['quiz_search'])
+def _migration_10(conn):
+    # without FTS5 the quizzes are searched with the in-process index, see model.InvertedSearchIndex
+    if conn.dialect.name != 'sqlite':
+        return
+    try:
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS quiz_fts USING fts5(name, content, tokenize = 'unicode61 remove_diacritics 2')"))
+    except OperationalError:
+        logging.warning('SQLite was built without FTS5, quizzes will be searched with an in-process index')
+
+
+@migration(11, 'move the quiz scores from quiz_stats to quiz_scores')
+def _migration_11(conn):
+    # scores were stored in quiz_stats as key=quiz_type and value='correct/total elapsed_time'
+    # quiz_stats.value is dropped by migration 12, so a new database does not have it
+    if 'value' not in [c['name'] for c in inspect(conn).get_columns('quiz_stats')]:
+        return
+    quiz_scores = model_stats.QuizScore.__table__
+    rows = []
+    score_stats = text("SELECT quiz_id, user_id, key, value, quiz_flipped, time_created FROM quiz_stats WHERE stat_type = 'QUIZ_SCORE'")
+    for r in conn.execute(score_stats.columns(time_created=UtcDateTime)).fetchall():
+        score, _, elapsed_time = (r.value or '').partition(' ')
+        correct, _, total = score.partition('/')
+        try:
+            correct, total = int(correct), int(total)
+        except ValueError:
+            continue
+        rows.append({'quiz_id': r.quiz_id, 'user_id': r.user_id, 'quiz_type': r.key, 'quiz_flipped': bool(r.quiz_flipped), 'correct': correct,
+                     'total': total, 'elapsed_time': int(elapsed_time) if elapsed_time.strip().isdigit() else None, 'time_created': r.time_created})
+    if rows:
+        conn.execute(quiz_scores.insert(), rows)
+    conn.execute(text("DELETE FROM quiz_stats WHERE stat_type = 'QUIZ_SCORE'"))
+
+
+@migration(12, 'replace quiz_stats.value with the boolean quiz_stats.correct', rebuilds=['question_summaries'])
+def _migration_12(conn):
+    _add_column_if_missing(conn, 'quiz_stats', 'correct', 'BOOLEAN')
+    if 'value' not in [c['name'] for c in inspect(conn).get_columns('quiz_stats')]:
+        return
+    conn.execute(text("UPDATE quiz_stats SET correct = (value = '1') WHERE correct IS NULL"))
+    try:
+        conn.execute(text('ALTER TABLE quiz_stats DROP COLUMN value'))
+    except OperationalError:
+        # SQLite before 3.35 can not drop columns, the unused column is left in place
+        logging.warning('Could not drop quiz_stats.value, it is no longer used')
+
+
+@migration(13, 'drop the quiz_activity indexes, the activity chart reads the rollups')
+def _migration_13(conn):
+    _drop_index_if_exists(conn, 'quiz_activity', 'ix_quiz_activity_user_time')
+    _drop_index_if_exists(conn, 'quiz_activity', 'ix_quiz_activity_time')
+
+
+@migration(14, 'create the guest user which the stats of guests refer to')
+def _migration_14(conn):
+    users = model.User.__table__
+    if conn.execute(select(users.c.user_id).where(users.c.user_id == model.GUEST_USER_ID)).first() is None:
+        # the auth method can not match a login, guests have no auth_username
+        conn.execute(users.insert().values(user_id=model.GUEST_USER_ID, auth_username='', auth_method='Guest'))
+
+
+@migration(15, 'create the index the quiz catalog finds owners by display name prefix with')
+def _migration_15(conn):
+    _create_indexes(conn, 'ix_user_props_key_lower_value')
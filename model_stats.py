@@ -1,12 +1,54 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import atexit
 import datetime
+import logging
 import math
+import threading
+import time
 from enum import Enum
-import pandas as pd
-from model import engine, Base, Quiz, Session
-from sqlalchemy import func, Boolean, Column, DateTime, ForeignKey, Integer, String
+from types import SimpleNamespace
+import numpy as np
+import model
+from cache import LRUCache
+from model import Base, Quiz, QuizItem, Session, UtcDateTime
+from sqlalchemy import and_, case, exists, func, insert, BigInteger, Boolean, Column, Float, ForeignKey, Index, Integer, String
+
+
+# ==================================================
+#    Constants
+# ==================================================
+# the write-behind queue is flushed when this many rows are queued
+STATS_WRITER_MAX_ROWS = 100
+# or when the oldest queued row has waited this many seconds
+STATS_WRITER_MAX_DELAY = 1.0
+# rows waiting to be written before the thread queueing a row writes the queue itself
+STATS_WRITER_MAX_QUEUE = 10000
+# number of times a batch is written before its rows are written one at a time, the writer
+# waits max_delay seconds longer after each failure
+STATS_WRITER_MAX_ATTEMPTS = 5
+# number of most recent results per question kept in the QuizQuestionSummary ring
+RECENT_RESULTS_LEN = 5
+RECENT_RESULTS_MASK = (1 << RECENT_RESULTS_LEN) - 1
+# a pause longer than this ends the good part of a quiz session on the activity chart
+SESSION_GAP = datetime.timedelta(minutes=2)
+# hours of activity shown on the activity chart
+ACTIVITY_HOURS = 12
+# width of a bucket of the activity chart
+ONE_MINUTE = datetime.timedelta(minutes=1)
+# spaced repetition scheduling, SM-2 with pass / fail grades
+SCHEDULE_INITIAL_EASE = 2.5
+SCHEDULE_MIN_EASE = 1.3
+SCHEDULE_EASE_PENALTY = 0.2
+# review intervals after the first and second correct answer in a row, later intervals grow by the ease
+SCHEDULE_FIRST_INTERVALS = (datetime.timedelta(days=1), datetime.timedelta(days=6))
+# an incorrectly answered question is due again after this long
+SCHEDULE_RELEARN_INTERVAL = datetime.timedelta(minutes=10)
+# number of most recent scores shown on the choose quiz pane
+QUIZ_SCORE_FEED_LEN = 10
+# number of users whose score feed is cached
+QUIZ_SCORE_CACHE_SIZE = 10000
 
 
 # ==================================================
@@ -20,6 +62,452 @@ class ActivityId(Enum):
     QUIZ_QUESTION_INCORRECT = 'QUIZ_QUESTION_INCORRECT'
 
 
+# ==================================================
+#    Write-Behind Queue
+# ==================================================
+class StatsWriter:
+    """ write-behind queue for QuizStat, QuizActivity and QuizScore rows
+
+        Rows are buffered in memory and written with a single bulk insert by a background
+        thread once max_rows rows are queued or the oldest row has waited max_delay seconds.
+        Rows which are queued are visible through snapshot() so readers can merge them with
+        the rows already in the database.
+
+        The queue holds at most max_queue rows.  Once it is full, enqueue does not wait for the
+        writer thread, the thread queueing the row writes the queue itself with flush, which slows
+        down only the callers while the database falls behind.  The callers are the database
+        work of the handlers, see executor.run_db, so the browser is not held up.  If that write
+        fails the row is dropped, overflows counts the full queues and dropped the dropped rows.
+
+        A batch which fails max_attempts times in a row is written one row at a time, and the rows
+        which still fail are logged and dropped, so a bad row can not hold up the rows queued
+        behind it.
+    """
+    def __init__(self, max_rows, max_delay, max_queue=STATS_WRITER_MAX_QUEUE, max_attempts=STATS_WRITER_MAX_ATTEMPTS):
+        """ init
+
+            Args:
+                max_rows - flush once this many rows are queued
+                max_delay - flush once the oldest queued row has waited this many seconds
+                max_queue - maximum number of rows waiting to be written
+                max_attempts - number of times a batch is written before its rows are written one at a time
+        """
+        self._max_rows = max_rows
+        self._max_delay = max_delay
+        self._max_queue = max_queue
+        self._max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._oldest = None
+        self._generation = 0
+        self._failed_attempts = 0
+        self._dropped = 0
+        self._overflows = 0
+        self._stopping = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def dropped(self):
+        """ number of rows dropped because the queue was full and could not be written, or the row could not be written """
+        return self._dropped
+
+    @property
+    def overflows(self):
+        """ number of times a row found the queue full and the queue was written by the thread queueing it """
+        return self._overflows
+
+    def _append(self, orm_class, row):
+        """ add a row to the queue and wake up the writer thread if needed, the condition must be held """
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append((orm_class, row))
+        if len(self._pending) == 1 or len(self._pending) >= self._max_rows:
+            self._cond.notify_all()
+
+    def enqueue(self, orm_class, row):
+        """ queue a row to be inserted, writes the queue first if it is full
+
+            Args:
+                orm_class - ORM class of the row, i.e. QuizStat
+                row - dictionary of column values for the row
+
+            Returns:
+                True if the row was queued, False if it was dropped because the queue was full and could not be written
+        """
+        with self._cond:
+            if len(self._pending) < self._max_queue or self._stopping:
+                self._append(orm_class, row)
+                return True
+            self._overflows = self._overflows + 1
+
+        # the queue is full, write it here rather than wait for the writer thread
+        try:
+            self.flush()
+        except Exception:
+            logging.exception('Writing the full stats queue failed')
+
+        with self._cond:
+            if len(self._pending) >= self._max_queue:
+                self._dropped = self._dropped + 1
+                logging.error(f'Stats queue is full, dropping {orm_class.__name__} row {row}')
+                return False
+            self._append(orm_class, row)
+        return True
+
+    def flush(self):
+        """ synchronously write all queued rows to the database
+
+            Throws the database exception if the write fails, the rows stay queued in that case
+            unless the batch has failed max_attempts times, then the rows are written one at a time
+            and the rows which fail are dropped
+        """
+        with self._write_lock:
+            with self._cond:
+                batch = self._pending
+                if not batch:
+                    return
+                self._pending = []
+                self._oldest = None
+                # an odd generation marks the write in progress, see snapshot
+                self._generation = self._generation + 1
+                self._cond.notify_all()
+
+            try:
+                self._write(batch)
+            except Exception:
+                with self._cond:
+                    self._failed_attempts = self._failed_attempts + 1
+                    retry = self._failed_attempts < self._max_attempts
+                    if retry:
+                        self._pending = batch + self._pending
+                        self._oldest = time.monotonic()
+                        self._generation = self._generation + 1
+                        self._cond.notify_all()
+                if retry:
+                    raise
+                logging.exception(f'Writing {len(batch)} stats rows failed {self._max_attempts} times, writing them one at a time')
+                self._write_one_at_a_time(batch)
+
+            with self._cond:
+                self._failed_attempts = 0
+                self._generation = self._generation + 1
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        """ write a batch of rows and the summaries they update in one transaction
+
+            Args:
+                batch - list of (orm_class, row)
+        """
+        # flush runs on the writer thread and inside handlers, so it uses its own session
+        session = model.session_factory()
+        try:
+            for orm_class in (QuizStat, QuizActivity, QuizScore):
+                rows = [r for c, r in batch if c is orm_class]
+                if rows:
+                    session.bulk_insert_mappings(orm_class, rows)
+            _update_question_summaries(session, [r for c, r in batch if c is QuizStat and r['stat_type'] == 'QUIZ_QUESTION'])
+            _update_item_schedules(session, [r for c, r in batch if c is QuizStat and r['stat_type'] == 'QUIZ_QUESTION'])
+            _update_activity_rollups(session, [r for c, r in batch if c is QuizActivity])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _write_one_at_a_time(self, batch):
+        """ write the rows of a batch which failed one at a time, logging and dropping the rows which fail
+
+            Args:
+                batch - list of (orm_class, row)
+        """
+        for orm_class, row in batch:
+            try:
+                self._write([(orm_class, row)])
+            except Exception:
+                logging.exception(f'Dropping {orm_class.__name__} row {row}')
+                with self._cond:
+                    self._dropped = self._dropped + 1
+
+    def snapshot(self, orm_class):
+        """ return the rows which are not committed to the database yet
+
+            A reader should take the snapshot, query the database, and retry if the generation
+            has changed in the meantime, otherwise rows may be missed or counted twice.  The
+            generation works like a seqlock, it is odd while a batch is being written, so the
+            snapshot waits for a write in progress to finish first.
+
+            Args:
+                orm_class - only return rows for this ORM class
+
+            Returns:
+                tuple of (generation, list of rows as SimpleNamespace objects)
+        """
+        with self._cond:
+            while self._generation % 2:
+                self._cond.wait()
+            return self._generation, [SimpleNamespace(**r) for c, r in self._pending if c is orm_class]
+
+    @property
+    def generation(self):
+        """ counter which is incremented when a batch starts being written and again when it is written or requeued """
+        return self._generation
+
+    def start(self):
+        """ start the background writer thread """
+        self._thread = threading.Thread(target=self._run, name='StatsWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ stop the background writer thread and write any rows still queued """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        """ background writer thread """
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    remaining = self._oldest + self._max_delay - time.monotonic()
+                    if len(self._pending) >= self._max_rows or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('StatsWriter failed to write stats, will retry')
+                time.sleep(self._max_delay * self._failed_attempts)
+
+
+def _read_with_pending(orm_class, query_func):
+    """ run a query and merge in the rows still waiting in the write-behind queue
+
+        Args:
+            orm_class - ORM class of the queued rows to merge in
+            query_func - function which runs the database query and returns a list
+
+        Returns:
+            tuple of (query results, list of queued rows)
+    """
+    while True:
+        generation, pending = stats_writer.snapshot(orm_class)
+        results = query_func()
+        if stats_writer.generation == generation:
+            return results, pending
+
+
+def _apply_question_result(summary, correct, time_created):
+    """ apply a single question result to a QuizQuestionSummary
+
+        Args:
+            summary - QuizQuestionSummary or object with the same fields to update
+            correct - True if the question was answered correctly
+            time_created - time the question was answered
+    """
+    summary.recent_results = ((summary.recent_results << 1) | int(correct)) & RECENT_RESULTS_MASK
+    summary.recent_count = min(summary.recent_count + 1, RECENT_RESULTS_LEN)
+    summary.correct_count = summary.correct_count + int(correct)
+    summary.total_count = summary.total_count + 1
+    if summary.time_last_seen is None or time_created > summary.time_last_seen:
+        summary.time_last_seen = time_created
+
+
+def _new_question_summary(orm_class, user_id, quiz_id, quiz_flipped, item_id):
+    """ return an empty QuizQuestionSummary, or SimpleNamespace with the same fields """
+    return orm_class(user_id=user_id, quiz_id=quiz_id, quiz_flipped=quiz_flipped, item_id=item_id,
+                     recent_results=0, recent_count=0, correct_count=0, total_count=0, time_last_seen=None)
+
+
+def _update_question_summaries(session, rows):
+    """ update the QuizQuestionSummary table for newly inserted question results
+
+        Args:
+            session - session to perform the update in
+            rows - list of QUIZ_QUESTION QuizStat rows as dictionaries, in the order answered
+    """
+    # group the rows by user / quiz / flipped so each group is one lookup
+    groups = {}
+    for r in rows:
+        if r['item_id'] is not None:
+            groups.setdefault((r['user_id'], r['quiz_id'], bool(r['quiz_flipped'])), []).append(r)
+
+    for (user_id, quiz_id, quiz_flipped), group_rows in groups.items():
+        item_ids = {r['item_id'] for r in group_rows}
+        summaries = session.query(QuizQuestionSummary).filter(QuizQuestionSummary.user_id == user_id,
+                                                              QuizQuestionSummary.quiz_id == quiz_id,
+                                                              QuizQuestionSummary.quiz_flipped == quiz_flipped,
+                                                              QuizQuestionSummary.item_id.in_(item_ids))
+        summaries = {s.item_id: s for s in summaries}
+        for r in group_rows:
+            if r['item_id'] not in summaries:
+                summaries[r['item_id']] = _new_question_summary(QuizQuestionSummary, user_id, quiz_id, quiz_flipped, r['item_id'])
+                session.add(summaries[r['item_id']])
+            _apply_question_result(summaries[r['item_id']], r['correct'], r['time_created'])
+
+
+def _apply_schedule_result(schedule, correct, time_created):
+    """ apply a single question result to an ItemSchedule
+
+        A correct answer moves the question to the next review interval, an incorrect answer
+        lowers the ease and brings the question back after SCHEDULE_RELEARN_INTERVAL
+
+        Args:
+            schedule - ItemSchedule or object with the same fields to update
+            correct - True if the question was answered correctly
+            time_created - time the question was answered
+    """
+    if correct:
+        if schedule.repetitions < len(SCHEDULE_FIRST_INTERVALS):
+            schedule.interval_seconds = SCHEDULE_FIRST_INTERVALS[schedule.repetitions].total_seconds()
+        else:
+            schedule.interval_seconds = schedule.interval_seconds * schedule.ease
+        schedule.repetitions = schedule.repetitions + 1
+    else:
+        # only the first miss after a run of correct answers is a lapse
+        if schedule.repetitions > 0:
+            schedule.ease = max(SCHEDULE_MIN_EASE, schedule.ease - SCHEDULE_EASE_PENALTY)
+            schedule.lapses = schedule.lapses + 1
+        schedule.repetitions = 0
+        schedule.interval_seconds = SCHEDULE_RELEARN_INTERVAL.total_seconds()
+    schedule.time_last_seen = time_created
+    schedule.time_due = time_created + datetime.timedelta(seconds=schedule.interval_seconds)
+
+
+def _new_item_schedule(orm_class, user_id, quiz_id, quiz_flipped, item_id):
+    """ return an ItemSchedule for a question which has not been answered, or SimpleNamespace with the same fields """
+    return orm_class(user_id=user_id, quiz_id=quiz_id, quiz_flipped=quiz_flipped, item_id=item_id, ease=SCHEDULE_INITIAL_EASE,
+                     interval_seconds=0.0, repetitions=0, lapses=0, time_last_seen=None, time_due=None)
+
+
+def _update_item_schedules(session, rows):
+    """ update the ItemSchedule table for newly inserted question results
+
+        Args:
+            session - session to perform the update in
+            rows - list of QUIZ_QUESTION QuizStat rows as dictionaries, in the order answered
+    """
+    # group the rows by user / quiz / flipped so each group is one lookup
+    groups = {}
+    for r in rows:
+        if r['item_id'] is not None:
+            groups.setdefault((r['user_id'], r['quiz_id'], bool(r['quiz_flipped'])), []).append(r)
+
+    for (user_id, quiz_id, quiz_flipped), group_rows in groups.items():
+        item_ids = {r['item_id'] for r in group_rows}
+        schedules = session.query(ItemSchedule).filter(ItemSchedule.user_id == user_id,
+                                                       ItemSchedule.quiz_id == quiz_id,
+                                                       ItemSchedule.quiz_flipped == quiz_flipped,
+                                                       ItemSchedule.item_id.in_(item_ids))
+        schedules = {s.item_id: s for s in schedules}
+        for r in group_rows:
+            if r['item_id'] not in schedules:
+                schedules[r['item_id']] = _new_item_schedule(ItemSchedule, user_id, quiz_id, quiz_flipped, r['item_id'])
+                session.add(schedules[r['item_id']])
+            _apply_schedule_result(schedules[r['item_id']], r['correct'], r['time_created'])
+
+
+def _is_answer(stat_type):
+    """ return True if an activity stat_type is an answered question """
+    return stat_type in (ActivityId.QUIZ_QUESTION_CORRECT.value, ActivityId.QUIZ_QUESTION_INCORRECT.value)
+
+
+def _truncate_minute(t):
+    """ truncate a datetime to the minute """
+    return t.replace(second=0, microsecond=0)
+
+
+def _apply_session_activity(summary, minute, stat_type):
+    """ apply a single activity event to a QuizActivitySession
+
+        Args:
+            summary - QuizActivitySession or object with the same fields to update
+            minute - time of the event truncated to the minute
+            stat_type - stat_type of the event
+    """
+    if summary.time_start is None:
+        summary.time_start = minute
+        summary.time_end = minute
+        summary.is_mini = stat_type == ActivityId.QUIZ_START_MINI.value
+        return
+
+    if summary.time_gap is None and minute - summary.time_end > SESSION_GAP:
+        summary.time_gap = summary.time_end
+    summary.time_end = max(summary.time_end, minute)
+
+
+def _new_activity_session(orm_class, quiz_uid, user_id, quiz_id):
+    """ return an empty QuizActivitySession, or SimpleNamespace with the same fields """
+    return orm_class(quiz_uid=quiz_uid, user_id=user_id, quiz_id=quiz_id, is_mini=False, time_start=None, time_end=None, time_gap=None)
+
+
+def _update_activity_rollups(session, rows):
+    """ update the QuizActivityMinute and QuizActivitySession tables for newly inserted activity
+
+        Args:
+            session - session to perform the update in
+            rows - list of QuizActivity rows as dictionaries, in the order they happened
+    """
+    if not rows:
+        return
+
+    # answers per user per minute
+    answers = {}
+    for r in rows:
+        if _is_answer(r['stat_type']):
+            k = (r['user_id'], _truncate_minute(r['time_created']))
+            answers[k] = answers.get(k, 0) + 1
+    for user_id in {k[0] for k in answers}:
+        minutes = [k[1] for k in answers if k[0] == user_id]
+        existing = session.query(QuizActivityMinute).filter(QuizActivityMinute.user_id == user_id, QuizActivityMinute.minute.in_(minutes))
+        existing = {m.minute: m for m in existing}
+        for minute in minutes:
+            if minute in existing:
+                existing[minute].answers = existing[minute].answers + answers[(user_id, minute)]
+            else:
+                session.add(QuizActivityMinute(user_id=user_id, minute=minute, answers=answers[(user_id, minute)]))
+
+    # quiz sessions
+    summaries = session.query(QuizActivitySession).filter(QuizActivitySession.quiz_uid.in_({r['quiz_uid'] for r in rows}))
+    summaries = {(s.quiz_uid, s.user_id): s for s in summaries}
+    for r in rows:
+        k = (r['quiz_uid'], r['user_id'])
+        if k not in summaries:
+            summaries[k] = _new_activity_session(QuizActivitySession, r['quiz_uid'], r['user_id'], r['quiz_id'])
+            session.add(summaries[k])
+        _apply_session_activity(summaries[k], _truncate_minute(r['time_created']), r['stat_type'])
+
+
+def _flush_durable():
+    """ write the queued rows now so a score or the end of a quiz is not lost
+
+        A failed write is logged instead of raised, the rows stay queued and the writer thread
+        retries them
+    """
+    try:
+        stats_writer.flush()
+    except Exception:
+        logging.exception('Writing the stats failed, the rows stay queued')
+
+
+def _utcnow():
+    """ return the current time as a naive utc datetime, matching the server default of time_created """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
 # ==================================================
 #    Model
 # ==================================================
@@ -36,15 +524,15 @@ def add_quiz_score(quiz_id, user_id, quiz_type, correct, total, elapsed_time, qu
     """
     # special case for guest
     if user_id is None:
-        user_id = 0
+        user_id = model.GUEST_USER_ID
 
-    session = Session()
-    quiz_stat = QuizStat(quiz_id=quiz_id, user_id=user_id, stat_type='QUIZ_SCORE', key=quiz_type, value=f'{correct}/{total} {elapsed_time}', quiz_flipped=quiz_flipped)
-    session.add(quiz_stat)
-    session.commit()
+    # scores are written durably
+    stats_writer.enqueue(QuizScore, dict(quiz_id=quiz_id, user_id=user_id, quiz_type=quiz_type, quiz_flipped=quiz_flipped, correct=correct, total=total, elapsed_time=elapsed_time, time_created=_utcnow()))
+    _flush_durable()
+    invalidate_quiz_scores(user_id)
 
 
-def add_quiz_activity_stat(quiz_id, user_id, quiz_uid, question, activityId, quiz_flipped):
+def add_quiz_activity_stat(quiz_id, user_id, quiz_uid, question, activityId, quiz_flipped, item_id=None, time_created=None):
     """ add a new quiz question stat for the user
 
         Args:
@@ -54,19 +542,20 @@ def add_quiz_activity_stat(quiz_id, user_id, quiz_uid, question, activityId, qui
             question - question to save state for
             activityId - See ActivityId enum
             quiz_flipped - True if this is a flipped quiz, false otherwise
+            item_id - QuizItem id of the question, None if the activity is not for a question
+            time_created - time of the activity as a naive utc datetime, defaults to now
     """
     # special case for guest
     if user_id is None:
-        user_id = 0
+        user_id = model.GUEST_USER_ID
 
-    # add a new record
-    session = Session()
-    quiz_activity = QuizActivity(quiz_id=quiz_id, user_id=user_id, quiz_uid=quiz_uid, key=question, value=0, stat_type=activityId.value, quiz_flipped=quiz_flipped)
-    session.add(quiz_activity)
-    session.commit()
+    # queue a new record, the end of a quiz is written durably
+    stats_writer.enqueue(QuizActivity, dict(quiz_id=quiz_id, user_id=user_id, quiz_uid=quiz_uid, item_id=item_id, key=question, value=0, stat_type=activityId.value, quiz_flipped=quiz_flipped, time_created=time_created or _utcnow()))
+    if activityId == ActivityId.QUIZ_END:
+        _flush_durable()
 
 
-def add_quiz_question_stat(quiz_id, user_id, question, correct, quiz_flipped):
+def add_quiz_question_stat(quiz_id, user_id, question, correct, quiz_flipped, item_id, time_created=None):
     """ add a new quiz question stat for the user
 
         Args:
@@ -75,32 +564,94 @@ def add_quiz_question_stat(quiz_id, user_id, question, correct, quiz_flipped):
             question - question to save state for
             correct - True if correct, False if not
             quiz_flipped - True if this is a flipped quiz, false otherwise
+            item_id - QuizItem id of the question
+            time_created - time the question was answered as a naive utc datetime, defaults to now
     """
     # special case for guest
     if user_id is None:
-        user_id = 0
+        user_id = model.GUEST_USER_ID
 
-    # add a new record
-    session = Session()
-    quiz_stat = QuizStat(quiz_id=quiz_id, user_id=user_id, stat_type='QUIZ_QUESTION', key=question, value=f'{1 if correct else 0}', quiz_flipped=quiz_flipped)
-    session.add(quiz_stat)
-    session.commit()
+    # queue a new record
+    stats_writer.enqueue(QuizStat, dict(quiz_id=quiz_id, user_id=user_id, stat_type='QUIZ_QUESTION', item_id=item_id, key=question, correct=bool(correct), quiz_flipped=quiz_flipped, time_created=time_created or _utcnow()))
 
 
-def clearStatsForQuiz(quiz_id, user_id, quiz_flipped):
+def clearStatsForQuiz(quiz_id, user_id, quiz_flipped=None):
     """ handler for the Clear Stats For Quiz button.
 
         Remove stats for the given quiz / user
+
+        Args:
+            quiz_id - id of the quiz to clear stats for
+            user_id - id of the user to clear stats for
+            quiz_flipped - True or False to only clear the flipped or unflipped stats, None to clear both
     """
+    # special case for guest
+    if user_id is None:
+        user_id = model.GUEST_USER_ID
+
+    # write any queued results first so they are cleared as well
+    stats_writer.flush()
+
     session = Session()
-    quiz_stats = session.query(QuizStat).filter(QuizStat.user_id == user_id, QuizStat.quiz_id == quiz_id, QuizStat.stat_type=='QUIZ_QUESTION', quiz_flipped=quiz_flipped)
+    quiz_stats = session.query(QuizStat).filter(QuizStat.user_id == user_id, QuizStat.quiz_id == quiz_id, QuizStat.stat_type=='QUIZ_QUESTION')
+    summaries = session.query(QuizQuestionSummary).filter(QuizQuestionSummary.user_id == user_id, QuizQuestionSummary.quiz_id == quiz_id)
+    schedules = session.query(ItemSchedule).filter(ItemSchedule.user_id == user_id, ItemSchedule.quiz_id == quiz_id)
+    if quiz_flipped is not None:
+        quiz_stats = quiz_stats.filter(QuizStat.quiz_flipped == quiz_flipped)
+        summaries = summaries.filter(QuizQuestionSummary.quiz_flipped == quiz_flipped)
+        schedules = schedules.filter(ItemSchedule.quiz_flipped == quiz_flipped)
     quiz_stats.delete()
+    summaries.delete()
+    schedules.delete()
     session.commit()
 
 
+def _delete_quiz_stats(session, quiz_id):
+    """ delete quiz listener, deletes the stats of a quiz in the transaction which deletes the quiz
+
+        The answers of the quiz are also taken out of the activity chart, as the chart only ever
+        counted the activity of existing quizzes
+
+        Args:
+            session - session deleting the quiz
+            quiz_id - id of the quiz being deleted
+    """
+    # write any queued stats of the quiz first so they are deleted as well
+    stats_writer.flush()
+
+    for orm_class in (QuizStat, QuizScore, QuizQuestionSummary, ItemSchedule):
+        session.query(orm_class).filter(orm_class.quiz_id == quiz_id).delete(synchronize_session=False)
+
+    # take the answers out of the minute rollups, then delete the activity and its sessions
+    answers = {}
+    for r in session.query(QuizActivity.user_id, QuizActivity.stat_type, QuizActivity.time_created).filter(QuizActivity.quiz_id == quiz_id):
+        if _is_answer(r.stat_type):
+            k = (r.user_id, _truncate_minute(r.time_created))
+            answers[k] = answers.get(k, 0) + 1
+    for (user_id, minute), count in answers.items():
+        session.query(QuizActivityMinute).filter(QuizActivityMinute.user_id == user_id, QuizActivityMinute.minute == minute).update(
+            {'answers': QuizActivityMinute.answers - count}, synchronize_session=False)
+    if answers:
+        session.query(QuizActivityMinute).filter(QuizActivityMinute.answers <= 0).delete(synchronize_session=False)
+    session.query(QuizActivity).filter(QuizActivity.quiz_id == quiz_id).delete(synchronize_session=False)
+    session.query(QuizActivitySession).filter(QuizActivitySession.quiz_id == quiz_id).delete(synchronize_session=False)
+
+
+def _format_elapsed_time(elapsed_time):
+    """ return an elapsed time in seconds rounded up to minutes, i.e. 3 mins, '' if unknown """
+    if elapsed_time is None:
+        return ''
+    minutes = math.ceil(elapsed_time / 60)
+    return '1 min' if minutes == 1 else f'{minutes} mins'
+
+
 def get_quiz_scores(user_id):
     """ return scores for a quiz by a user
 
+        The score feed of each user is cached until invalidate_quiz_scores is called for the user,
+        the quiz names are looked up in the parsed quiz cache so renaming a quiz does not
+        invalidate the feed.
+
         Args:
             user_id - id of the user to retrieve scores for
 
@@ -109,42 +660,49 @@ def get_quiz_scores(user_id):
     """
     # special case for guest
     if user_id is None:
-        user_id = 0
+        user_id = model.GUEST_USER_ID
 
-    # query for records
-    session = Session()
-    quiz_scores = session.query(QuizStat, Quiz).join(QuizStat, Quiz.quiz_id == QuizStat.quiz_id).filter(QuizStat.user_id == user_id, QuizStat.stat_type=='QUIZ_SCORE').order_by(QuizStat.time_created.desc())
+    feed = _quiz_score_cache.get(user_id)
+    if feed is LRUCache.MISSING:
+        # a feed read before an invalidation is not cached
+        generation = quiz_score_cache_generation
+        session = Session()
+        quiz_scores = session.query(QuizScore.quiz_id, QuizScore.quiz_type, QuizScore.quiz_flipped, QuizScore.time_created, QuizScore.correct,
+                                    QuizScore.total, QuizScore.elapsed_time).join(Quiz, Quiz.quiz_id == QuizScore.quiz_id).filter(
+            QuizScore.user_id == user_id).order_by(QuizScore.time_created.desc()).limit(QUIZ_SCORE_FEED_LEN)
+        feed = tuple({'quiz_id': r.quiz_id,
+                      'quiz_type': r.quiz_type,
+                      'quiz_flipped': 'Flipped' if r.quiz_flipped else '',
+                      'time_created': r.time_created,
+                      'correct': r.correct,
+                      'total': r.total,
+                      'elapsed_time': _format_elapsed_time(r.elapsed_time),
+                      'percentage': round(r.correct / r.total * 100) if r.total else 0} for r in quiz_scores)
+        if generation == quiz_score_cache_generation:
+            _quiz_score_cache.put(user_id, feed)
 
-    # process results
+    # add the quiz names, skipping quizzes deleted since the feed was cached
     retval = []
-    for r in quiz_scores.limit(10).all():
-        elapsed_time = ''
-        try:
-            elapsed_time = int(r.QuizStat.value.partition(' ')[2])
-            elapsed_time = str(math.ceil(elapsed_time / 60)) + ' mins'
-            if elapsed_time == '1 mins':
-                elapsed_time = '1 min'
-        except:
-            elapsed_time = ''
-
-        d = {}
-        d = {'name': r.Quiz.name,
-             'quiz_type': r.QuizStat.key,
-             'quiz_flipped': 'Flipped' if r.QuizStat.quiz_flipped else '',
-             'time_created': r.QuizStat.time_created,
-             'correct': int(r.QuizStat.value.partition(' ')[0].partition('/')[0]),
-             'total': int(r.QuizStat.value.partition(' ')[0].partition('/')[2]),
-             'elapsed_time': elapsed_time
-             }
-        d['percentage'] = 0
+    for d in feed:
         try:
-            d['percentage'] = round(d['correct'] / d['total'] * 100)
-        except:
-            pass
-        retval.append(d)
+            name = model.get_parsed_quiz(d['quiz_id']).name
+        except model.QuizNotFoundException:
+            continue
+        retval.append({'name': name, **{k: v for k, v in d.items() if k != 'quiz_id'}})
     return retval
 
 
+def invalidate_quiz_scores(user_id):
+    """ drop the cached score feed of a user, call after the scores of the user change
+
+        Args:
+            user_id - id of the user
+    """
+    global quiz_score_cache_generation
+    _quiz_score_cache.invalidate(model.GUEST_USER_ID if user_id is None else user_id)
+    quiz_score_cache_generation = quiz_score_cache_generation + 1
+
+
 def get_quiz_question_stats(quiz_id, user_id, quiz_flipped):
     """ return scores for a quiz by a user
 
@@ -153,31 +711,43 @@ def get_quiz_question_stats(quiz_id, user_id, quiz_flipped):
             user_id - id of the user to retrieve scores for
 
         Returns:
-            list of dictionary of score results
+            list of dictionary of score results for the questions currently in the quiz
     """
     # special case for guest
     if user_id is None:
-        user_id = 0
+        user_id = model.GUEST_USER_ID
 
-    # query for records
-    session = Session()
-    quiz_stats = session.query(QuizStat).filter(QuizStat.user_id == user_id, QuizStat.quiz_id == quiz_id, QuizStat.stat_type=='QUIZ_QUESTION', QuizStat.quiz_flipped==quiz_flipped)
-    stats = {}
-    for r in quiz_stats.all():
-        if r.key not in stats:
-            stats[r.key] = []
-        stats[r.key].append(r)
+    # the question text of each item
+    try:
+        quiz = model.get_parsed_quiz(quiz_id)
+    except model.QuizNotFoundException:
+        return []
+    questions = dict(zip(quiz.item_ids, [x[0] for x in (quiz.flipped if quiz_flipped else quiz.questions)]))
 
-    for k in stats:
-        stats[k] = sorted(stats[k], key=lambda x: x.time_created)
+    # query the summaries, including results still in the write-behind queue
+    session = Session()
+    summaries = session.query(QuizQuestionSummary.item_id, QuizQuestionSummary.recent_results, QuizQuestionSummary.recent_count,
+                              QuizQuestionSummary.correct_count, QuizQuestionSummary.total_count, QuizQuestionSummary.time_last_seen).filter(
+        QuizQuestionSummary.user_id == user_id,
+        QuizQuestionSummary.quiz_id == quiz_id,
+        QuizQuestionSummary.quiz_flipped == quiz_flipped)
+    rows, pending = _read_with_pending(QuizStat, summaries.all)
+    stats = {r.item_id: SimpleNamespace(**r._asdict()) for r in rows}
+    for r in pending:
+        if r.user_id == user_id and r.quiz_id == quiz_id and r.stat_type == 'QUIZ_QUESTION' and bool(r.quiz_flipped) == bool(quiz_flipped) and r.item_id is not None:
+            if r.item_id not in stats:
+                stats[r.item_id] = _new_question_summary(SimpleNamespace, user_id, quiz_id, quiz_flipped, r.item_id)
+            _apply_question_result(stats[r.item_id], r.correct, r.time_created)
 
     # process results
     retval = []
-    for k in stats:
-        d = {}
-        d = {'question': k,
-             'correct': sum([1 if x.value == '1' else 0 for x in stats[k][-5:]]),
-             'total': len(stats[k][-5:])}
+    for k, v in stats.items():
+        if k not in questions:
+            continue
+        d = {'question': questions[k],
+             'item_id': k,
+             'correct': bin(v.recent_results).count('1'),
+             'total': v.recent_count}
         d['percentage'] = 0
         try:
             d['percentage'] = round(d['correct'] / d['total'] * 100)
@@ -190,64 +760,276 @@ def get_quiz_question_stats(quiz_id, user_id, quiz_flipped):
     return retval
 
 
+def rebuild_quiz_question_summaries(session=None):
+    """ rebuild the QuizQuestionSummary table from the raw QUIZ_QUESTION stats
+
+        Args:
+            session - use precreated session if provided, otherwise create a new session
+
+        Returns:
+            number of summaries written
+    """
+    # write any queued results first so they are included
+    stats_writer.flush()
+
+    if session is None:
+        session = Session()
+    session.query(QuizQuestionSummary).delete()
+
+    # number the results of each summary newest first, the newest RECENT_RESULTS_LEN go in the recent_results bitmask
+    key_columns = [QuizStat.user_id, QuizStat.quiz_id, QuizStat.quiz_flipped, QuizStat.item_id]
+    numbered = session.query(*key_columns, QuizStat.correct, QuizStat.time_created, func.row_number().over(
+        partition_by=key_columns, order_by=[QuizStat.time_created.desc(), QuizStat.quiz_stat_id.desc()]).label('rn')).filter(
+        QuizStat.stat_type == 'QUIZ_QUESTION', QuizStat.item_id != None).subquery()
+    recent_bit = case(*[(and_(numbered.c.correct == True, numbered.c.rn == i + 1), 1 << i) for i in range(RECENT_RESULTS_LEN)], else_=0)
+
+    # aggregate each summary in the database
+    summaries = session.query(numbered.c.user_id, numbered.c.quiz_id, numbered.c.quiz_flipped, numbered.c.item_id,
+                              func.sum(recent_bit),
+                              func.sum(case((numbered.c.rn <= RECENT_RESULTS_LEN, 1), else_=0)),
+                              func.sum(case((numbered.c.correct == True, 1), else_=0)),
+                              func.count(),
+                              func.max(numbered.c.time_created)).group_by(
+        numbered.c.user_id, numbered.c.quiz_id, numbered.c.quiz_flipped, numbered.c.item_id)
+    result = session.execute(insert(QuizQuestionSummary).from_select(
+        ['user_id', 'quiz_id', 'quiz_flipped', 'item_id', 'recent_results', 'recent_count', 'correct_count', 'total_count', 'time_last_seen'],
+        summaries))
+    session.commit()
+
+    return result.rowcount
+
+
+def get_due_items(quiz_id, user_id, quiz_flipped, count):
+    """ return the questions a user should review next
+
+        Questions which are due come first, most overdue first, then questions which have never
+        been answered in quiz order, then the questions which will be due soonest.  Each part
+        is a range query on the ItemSchedule due index limited to count rows.
+
+        Args:
+            quiz_id - id of the quiz to pick questions from
+            user_id - id of the user to pick questions for
+            quiz_flipped - True if this is a flipped quiz, false otherwise
+            count - maximum number of questions to return
+
+        Returns:
+            list of QuizItem ids
+    """
+    # special case for guest
+    if user_id is None:
+        user_id = model.GUEST_USER_ID
+
+    now = _utcnow()
+    session = Session()
+    scheduled = session.query(ItemSchedule.item_id, ItemSchedule.time_due).join(QuizItem, QuizItem.quiz_item_id == ItemSchedule.item_id).filter(
+        ItemSchedule.user_id == user_id,
+        ItemSchedule.quiz_id == quiz_id,
+        ItemSchedule.quiz_flipped == quiz_flipped,
+        QuizItem.active == True)
+    unseen = session.query(QuizItem.quiz_item_id).filter(QuizItem.quiz_id == quiz_id, QuizItem.active == True).filter(
+        ~exists().where(ItemSchedule.user_id == user_id,
+                        ItemSchedule.quiz_id == quiz_id,
+                        ItemSchedule.quiz_flipped == quiz_flipped,
+                        ItemSchedule.item_id == QuizItem.quiz_item_id))
+
+    # the limits depend on the results still in the write-behind queue, so this is _read_with_pending unrolled
+    while True:
+        generation, pending = stats_writer.snapshot(QuizStat)
+        pending = [r for r in pending if r.user_id == user_id and r.quiz_id == quiz_id and r.stat_type == 'QUIZ_QUESTION' and
+                   bool(r.quiz_flipped) == bool(quiz_flipped) and r.item_id is not None]
+        pending_item_ids = {r.item_id for r in pending}
+        limit = count + len(pending_item_ids)
+        due_rows = scheduled.filter(ItemSchedule.time_due <= now).order_by(ItemSchedule.time_due).limit(limit).all()
+        unseen_rows = unseen.order_by(QuizItem.position).limit(limit).all()
+        upcoming_rows = scheduled.filter(ItemSchedule.time_due > now).order_by(ItemSchedule.time_due).limit(limit).all()
+        pending_rows = []
+        active_pending_item_ids = set()
+        if pending_item_ids:
+            pending_rows = session.query(ItemSchedule.item_id, ItemSchedule.ease, ItemSchedule.interval_seconds, ItemSchedule.repetitions,
+                                         ItemSchedule.lapses, ItemSchedule.time_last_seen, ItemSchedule.time_due).filter(
+                ItemSchedule.user_id == user_id,
+                ItemSchedule.quiz_id == quiz_id,
+                ItemSchedule.quiz_flipped == quiz_flipped,
+                ItemSchedule.item_id.in_(pending_item_ids)).all()
+            active_pending_item_ids = {r.quiz_item_id for r in session.query(QuizItem.quiz_item_id).filter(
+                QuizItem.quiz_item_id.in_(pending_item_ids), QuizItem.active == True)}
+        if stats_writer.generation == generation:
+            break
+
+    # apply the queued results to the schedules of the questions they are for
+    schedules = {r.item_id: SimpleNamespace(**r._asdict()) for r in pending_rows}
+    for r in pending:
+        if r.item_id not in schedules:
+            schedules[r.item_id] = _new_item_schedule(SimpleNamespace, user_id, quiz_id, quiz_flipped, r.item_id)
+        _apply_schedule_result(schedules[r.item_id], r.correct, r.time_created)
+    time_due = {r.item_id: r.time_due for r in due_rows + upcoming_rows if r.item_id not in pending_item_ids}
+    time_due.update({k: v.time_due for k, v in schedules.items() if k in active_pending_item_ids})
+
+    # due, then never answered, then due soonest
+    ordered = sorted(time_due.items(), key=lambda x: (x[1], x[0]))
+    retval = [k for k, v in ordered if v <= now]
+    retval.extend(r.quiz_item_id for r in unseen_rows if r.quiz_item_id not in pending_item_ids)
+    retval.extend(k for k, v in ordered if v > now)
+    return retval[:count]
+
+
+def rebuild_item_schedules(session=None):
+    """ rebuild the ItemSchedule table from the raw QUIZ_QUESTION stats
+
+        Args:
+            session - use precreated session if provided, otherwise create a new session
+
+        Returns:
+            number of schedules written
+    """
+    # write any queued results first so they are included
+    stats_writer.flush()
+
+    if session is None:
+        session = Session()
+    session.query(ItemSchedule).delete()
+
+    # stream the results in the order answered, grouped by schedule
+    quiz_stats = session.query(QuizStat.user_id, QuizStat.quiz_id, QuizStat.quiz_flipped, QuizStat.item_id, QuizStat.correct, QuizStat.time_created).filter(
+        QuizStat.stat_type == 'QUIZ_QUESTION', QuizStat.item_id != None).order_by(
+        QuizStat.user_id, QuizStat.quiz_id, QuizStat.quiz_flipped, QuizStat.item_id, QuizStat.time_created, QuizStat.quiz_stat_id)
+
+    count = 0
+    schedule = None
+    for r in quiz_stats.yield_per(10000):
+        if schedule is None or (schedule.user_id, schedule.quiz_id, schedule.quiz_flipped, schedule.item_id) != (r.user_id, r.quiz_id, bool(r.quiz_flipped), r.item_id):
+            if schedule is not None:
+                session.add(schedule)
+                count = count + 1
+            schedule = _new_item_schedule(ItemSchedule, r.user_id, r.quiz_id, bool(r.quiz_flipped), r.item_id)
+        _apply_schedule_result(schedule, bool(r.correct), r.time_created)
+    if schedule is not None:
+        session.add(schedule)
+        count = count + 1
+    session.commit()
+
+    return count
+
+
 def bump_end_time(start_time, end_time):
     if start_time == end_time:
-        return end_time + pd.Timedelta(seconds=30)
+        return end_time + datetime.timedelta(seconds=30)
     else:
         return end_time
 
 
 def get_user_activity(user_id):
+    """ return the answers per minute and the quiz sessions for the activity chart
+
+        Reads the QuizActivityMinute and QuizActivitySession rollups for the last ACTIVITY_HOURS hours.
+        The answers per minute used to be returned as a pandas series indexed by minute, they are now
+        returned as the first minute of the chart and a numpy array, so the tuple has three items.
+
+        Args:
+            user_id - id of the user to return activity for, None for all users
+
+        Returns:
+            tuple of (first minute of the chart, numpy array of the answers in each minute from the first minute,
+                      list of [start, end, quiz name, 'GOOD' or 'BAD'])
+    """
     session = Session()
-    start_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=12)
+    start_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=ACTIVITY_HOURS)
     start_date = datetime.datetime(start_date.year, start_date.month, start_date.day, start_date.hour, start_date.minute, 0)
-    end_date = start_date + datetime.timedelta(hours=12)
-    if user_id is None:
-        quiz_activity = session.query(QuizActivity, Quiz).join(QuizActivity, Quiz.quiz_id == QuizActivity.quiz_id).filter(QuizActivity.time_created >= start_date)
-    else:
-        quiz_activity = session.query(QuizActivity, Quiz).join(QuizActivity, Quiz.quiz_id == QuizActivity.quiz_id).filter(QuizActivity.user_id == user_id, QuizActivity.time_created >= start_date)
-
-    data = []
-    for qs in quiz_activity.all():
-        d = datetime.datetime(qs.QuizActivity.time_created.year, qs.QuizActivity.time_created.month, qs.QuizActivity.time_created.day, qs.QuizActivity.time_created.hour, qs.QuizActivity.time_created.minute, 0)
-        data.append([d, qs.QuizActivity.stat_type, qs.QuizActivity.quiz_uid, qs.Quiz.name])
-        # time_created.append(d)
-        # quiz_stat_type.append(qs.stat_type)
-    df = pd.DataFrame(data, columns=['time_created', 'stat_type', 'quiz_uid', 'quiz_name'])
-    df['time_created']= pd.to_datetime(df['time_created'])
-
-    # compute the answers per minute
-    df['activity'] = 1
-    df_activity = df[df['stat_type'].isin(["QUIZ_QUESTION_CORRECT", "QUIZ_QUESTION_INCORRECT"])]
-    ser = df_activity.groupby('time_created')['activity'].sum(numeric_only=True)
-    ser = ser.sort_index()
-    all_minutes_index = pd.date_range(start_date, end_date, freq='min')
-    ser = ser.reindex(all_minutes_index, fill_value=0)
-
-    # compute the quiz start and end times
-    quiz_uids = df['quiz_uid'].unique()
-    quiz_info = []
-    for quid in quiz_uids:
-        df2 = df[df['quiz_uid'] == quid]
-        start = df2.iloc[0]
-        end = df2.iloc[-1]
+    end_date = start_date + datetime.timedelta(hours=ACTIVITY_HOURS)
+
+    minutes = session.query(QuizActivityMinute.minute, func.sum(QuizActivityMinute.answers)).filter(QuizActivityMinute.minute >= start_date)
+    sessions = session.query(QuizActivitySession.quiz_activity_session_id, QuizActivitySession.quiz_uid, QuizActivitySession.user_id,
+                             QuizActivitySession.quiz_id, QuizActivitySession.is_mini, QuizActivitySession.time_start,
+                             QuizActivitySession.time_end, QuizActivitySession.time_gap).filter(QuizActivitySession.time_end >= start_date)
+    if user_id is not None:
+        minutes = minutes.filter(QuizActivityMinute.user_id == user_id)
+        sessions = sessions.filter(QuizActivitySession.user_id == user_id)
+    minutes = minutes.group_by(QuizActivityMinute.minute)
+
+    # include records still in the write-behind queue
+    (minute_rows, session_rows), pending = _read_with_pending(QuizActivity, lambda: (minutes.all(), sessions.all()))
+    pending = [r for r in pending if (user_id is None or r.user_id == user_id) and r.time_created >= start_date]
 
-        quiz_name = start.quiz_name
-        if start.stat_type == ActivityId.QUIZ_START_MINI.value:
+    # answers per minute, counted into one bucket per minute of the chart from start_date to end_date
+    offsets = [(m - start_date) // ONE_MINUTE for m, _ in minute_rows]
+    weights = [int(c) for _, c in minute_rows]
+    for r in pending:
+        if _is_answer(r.stat_type):
+            offsets.append((_truncate_minute(r.time_created) - start_date) // ONE_MINUTE)
+            weights.append(1)
+    chart_minutes = (end_date - start_date) // ONE_MINUTE + 1
+    offsets = np.array(offsets, dtype=np.int64)
+    weights = np.array(weights, dtype=np.int64)
+    in_chart = offsets < chart_minutes
+    answers = np.bincount(offsets[in_chart], weights=weights[in_chart], minlength=chart_minutes).astype(np.int64)
+
+    # quiz sessions, in the order they started
+    summaries = {(r.quiz_uid, r.user_id): SimpleNamespace(**r._asdict()) for r in session_rows}
+    for r in pending:
+        k = (r.quiz_uid, r.user_id)
+        if k not in summaries:
+            summaries[k] = _new_activity_session(SimpleNamespace, r.quiz_uid, r.user_id, r.quiz_id)
+            summaries[k].quiz_activity_session_id = None
+        _apply_session_activity(summaries[k], _truncate_minute(r.time_created), r.stat_type)
+    summaries = sorted(summaries.values(), key=lambda x: (x.time_start, x.quiz_activity_session_id is None, x.quiz_activity_session_id or 0))
+    quiz_names = dict(session.query(Quiz.quiz_id, Quiz.name).filter(Quiz.quiz_id.in_({x.quiz_id for x in summaries}))) if summaries else {}
+
+    quiz_info = []
+    for x in summaries:
+        if x.quiz_id not in quiz_names:
+            continue
+        quiz_name = quiz_names[x.quiz_id]
+        if x.is_mini:
             quiz_name = quiz_name + ' (M)'
 
-        # scan for a break that is too long
-        bad_end = None
-        if ((df2['time_created'].shift(-1) - df2['time_created']) > pd.Timedelta(minutes=2)).any():
-            bad_end = df2[(df2['time_created'].shift(-1) - df2['time_created']) > pd.Timedelta(minutes=2)].iloc[0]
-            # append the good part of the quiz
-            quiz_info.append([start.time_created, bump_end_time(start.time_created, bad_end.time_created), quiz_name, 'GOOD'])
-            # append teh bad part of the quiz
-            quiz_info.append([bad_end.time_created, bump_end_time(bad_end.time_created, end.time_created), '', 'BAD'])
+        # sessions which started before the chart are clipped to the start of the chart
+        time_start = max(x.time_start, start_date)
+        if x.time_gap is not None and x.time_gap >= time_start:
+            # append the good part of the quiz, then the bad part after the long break
+            quiz_info.append([time_start, bump_end_time(time_start, x.time_gap), quiz_name, 'GOOD'])
+            quiz_info.append([x.time_gap, bump_end_time(x.time_gap, x.time_end), '', 'BAD'])
         else:
-            quiz_info.append([start.time_created, bump_end_time(start.time_created, end.time_created), quiz_name, 'GOOD'])
+            quiz_info.append([time_start, bump_end_time(time_start, x.time_end), quiz_name, 'GOOD'])
+
+    return start_date, answers, quiz_info
 
-    return ser, quiz_info
+
+def rebuild_activity_rollups(session=None):
+    """ rebuild the QuizActivityMinute and QuizActivitySession tables from the raw activity
+
+        Args:
+            session - use precreated session if provided, otherwise create a new session
+
+        Returns:
+            number of quiz sessions written
+    """
+    # write any queued activity first so it is included
+    stats_writer.flush()
+
+    if session is None:
+        session = Session()
+    session.query(QuizActivityMinute).delete()
+    session.query(QuizActivitySession).delete()
+
+    answers = {}
+    summaries = {}
+    # only the activity of existing quizzes is counted
+    quiz_activity = session.query(QuizActivity.quiz_uid, QuizActivity.user_id, QuizActivity.quiz_id, QuizActivity.stat_type,
+                                  QuizActivity.time_created).join(Quiz, Quiz.quiz_id == QuizActivity.quiz_id).order_by(QuizActivity.quiz_activity_id)
+    for r in quiz_activity.yield_per(10000):
+        minute = _truncate_minute(r.time_created)
+        if _is_answer(r.stat_type):
+            answers[(r.user_id, minute)] = answers.get((r.user_id, minute), 0) + 1
+        k = (r.quiz_uid, r.user_id)
+        if k not in summaries:
+            summaries[k] = _new_activity_session(QuizActivitySession, r.quiz_uid, r.user_id, r.quiz_id)
+        _apply_session_activity(summaries[k], minute, r.stat_type)
+
+    session.bulk_insert_mappings(QuizActivityMinute, [{'user_id': k[0], 'minute': k[1], 'answers': v} for k, v in answers.items()])
+    session.add_all(summaries.values())
+    session.commit()
+
+    return len(summaries)
 
 
 # --------------------------------------------------
@@ -259,14 +1041,35 @@ class QuizStat(Base):
     quiz_id = Column(Integer, ForeignKey("quiz.quiz_id"))
     user_id = Column(Integer, ForeignKey("users.user_id"))
     quiz_flipped = Column(Boolean)
-    time_created = Column(DateTime(timezone=True), server_default=func.now())
-    time_updated = Column(DateTime(timezone=True), onupdate=func.now())
+    item_id = Column(Integer, ForeignKey("quiz_items.quiz_item_id"))
+    time_created = Column(UtcDateTime, server_default=func.now())
+    time_updated = Column(UtcDateTime, onupdate=func.now())
     stat_type = Column(String)
     key = Column(String)
-    value = Column(String)
+    correct = Column(Boolean)
+    __table_args__ = (Index('ix_quiz_stats_question', 'user_id', 'quiz_id', 'stat_type', 'quiz_flipped', 'time_created'),
+                      Index('ix_quiz_stats_user_type_time', 'user_id', 'stat_type', 'time_created'),
+                      Index('ix_quiz_stats_item', 'item_id'))
 
     def __repr__(self):
-        return '<QuizStat(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_stat_id', 'quiz_id', 'user_id', 'stat_type', 'time_created', 'key', 'value']]) + ')>'
+        return '<QuizStat(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_stat_id', 'quiz_id', 'user_id', 'item_id', 'stat_type', 'time_created', 'key', 'correct']]) + ')>'
+
+
+class QuizScore(Base):
+    __tablename__ = "quiz_scores"
+    quiz_score_id = Column(Integer, primary_key=True)
+    quiz_id = Column(Integer, ForeignKey("quiz.quiz_id"))
+    user_id = Column(Integer, ForeignKey("users.user_id"))
+    quiz_type = Column(String)
+    quiz_flipped = Column(Boolean)
+    correct = Column(Integer)
+    total = Column(Integer)
+    elapsed_time = Column(Integer)
+    time_created = Column(UtcDateTime, server_default=func.now())
+    __table_args__ = (Index('ix_quiz_scores_user_time', 'user_id', 'time_created'),)
+
+    def __repr__(self):
+        return '<QuizScore(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_score_id', 'quiz_id', 'user_id', 'quiz_type', 'quiz_flipped', 'correct', 'total', 'elapsed_time', 'time_created']]) + ')>'
 
 
 class QuizActivity(Base):
@@ -274,23 +1077,118 @@ class QuizActivity(Base):
     quiz_activity_id = Column(Integer, primary_key=True)
     quiz_id = Column(Integer, ForeignKey("quiz.quiz_id"))
     user_id = Column(Integer, ForeignKey("users.user_id"))
-    quiz_uid = Column(Integer)
+    quiz_uid = Column(BigInteger)
     quiz_flipped = Column(Boolean)
-    time_created = Column(DateTime(timezone=True), server_default=func.now())
-    time_updated = Column(DateTime(timezone=True), onupdate=func.now())
+    item_id = Column(Integer, ForeignKey("quiz_items.quiz_item_id"))
+    time_created = Column(UtcDateTime, server_default=func.now())
+    time_updated = Column(UtcDateTime, onupdate=func.now())
     stat_type = Column(String)
     key = Column(String)
     value = Column(String)
 
     def __repr__(self):
-        return '<QuizActivity(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_activity_id', 'quiz_id', 'user_id', 'quiz_uid', 'stat_type', 'time_created', 'key', 'value']]) + ')>'
+        return '<QuizActivity(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_activity_id', 'quiz_id', 'user_id', 'quiz_uid', 'item_id', 'stat_type', 'time_created', 'key', 'value']]) + ')>'
+
+
+class QuizQuestionSummary(Base):
+    """ rolling aggregate of the QUIZ_QUESTION stats for each user / quiz / flipped / QuizItem
+
+        recent_results is a bitmask of the last RECENT_RESULTS_LEN results, newest in bit 0
+    """
+    __tablename__ = "quiz_question_summary"
+    quiz_question_summary_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"))
+    quiz_id = Column(Integer, ForeignKey("quiz.quiz_id"))
+    quiz_flipped = Column(Boolean)
+    item_id = Column(Integer, ForeignKey("quiz_items.quiz_item_id"))
+    recent_results = Column(Integer)
+    recent_count = Column(Integer)
+    correct_count = Column(Integer)
+    total_count = Column(Integer)
+    time_last_seen = Column(UtcDateTime)
+    __table_args__ = (Index('ix_quiz_question_summary_item', 'user_id', 'quiz_id', 'quiz_flipped', 'item_id', unique=True),)
+
+    def __repr__(self):
+        return '<QuizQuestionSummary(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_question_summary_id', 'user_id', 'quiz_id', 'quiz_flipped', 'item_id', 'recent_results', 'recent_count']]) + ')>'
+
+
+class ItemSchedule(Base):
+    """ spaced repetition state of each user / quiz / flipped / QuizItem
+
+        interval_seconds is the current review interval, time_due is when the question should be
+        reviewed next.  ix_item_schedules_due makes the next due questions a range query.
+    """
+    __tablename__ = "item_schedules"
+    item_schedule_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"))
+    quiz_id = Column(Integer, ForeignKey("quiz.quiz_id"))
+    quiz_flipped = Column(Boolean)
+    item_id = Column(Integer, ForeignKey("quiz_items.quiz_item_id"))
+    ease = Column(Float)
+    interval_seconds = Column(Float)
+    repetitions = Column(Integer)
+    lapses = Column(Integer)
+    time_last_seen = Column(UtcDateTime)
+    time_due = Column(UtcDateTime)
+    __table_args__ = (Index('ix_item_schedules_item', 'user_id', 'quiz_id', 'quiz_flipped', 'item_id', unique=True),
+                      Index('ix_item_schedules_due', 'user_id', 'quiz_id', 'quiz_flipped', 'time_due'))
+
+    def __repr__(self):
+        return '<ItemSchedule(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['item_schedule_id', 'user_id', 'quiz_id', 'quiz_flipped', 'item_id', 'ease', 'interval_seconds', 'repetitions', 'time_due']]) + ')>'
+
+
+class QuizActivityMinute(Base):
+    """ number of questions answered by a user in each minute """
+    __tablename__ = "quiz_activity_minutes"
+    quiz_activity_minute_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"))
+    minute = Column(UtcDateTime)
+    answers = Column(Integer)
+    __table_args__ = (Index('ix_quiz_activity_minutes_user_minute', 'user_id', 'minute', unique=True),
+                      Index('ix_quiz_activity_minutes_minute', 'minute'))
+
+    def __repr__(self):
+        return '<QuizActivityMinute(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_activity_minute_id', 'user_id', 'minute', 'answers']]) + ')>'
+
+
+class QuizActivitySession(Base):
+    """ start, end and first long break of each quiz taken, times are truncated to the minute
+
+        time_gap is the time of the last activity before the first break longer than SESSION_GAP
+    """
+    __tablename__ = "quiz_activity_sessions"
+    quiz_activity_session_id = Column(Integer, primary_key=True)
+    quiz_uid = Column(BigInteger)
+    user_id = Column(Integer, ForeignKey("users.user_id"))
+    quiz_id = Column(Integer, ForeignKey("quiz.quiz_id"))
+    is_mini = Column(Boolean)
+    time_start = Column(UtcDateTime)
+    time_end = Column(UtcDateTime)
+    time_gap = Column(UtcDateTime)
+    __table_args__ = (Index('ix_quiz_activity_sessions_quiz_uid', 'quiz_uid'),
+                      Index('ix_quiz_activity_sessions_user_end', 'user_id', 'time_end'),
+                      Index('ix_quiz_activity_sessions_end', 'time_end'))
+
+    def __repr__(self):
+        return '<QuizActivitySession(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_activity_session_id', 'quiz_uid', 'user_id', 'quiz_id', 'time_start', 'time_end', 'time_gap']]) + ')>'
+
+
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+# score feed by user_id, the generation is bumped on every invalidation so a feed read before
+# an invalidation is not cached
+_quiz_score_cache = LRUCache(QUIZ_SCORE_CACHE_SIZE, 'quiz_scores')
+quiz_score_cache_generation = 0
 
 
 # --------------------------------------------------
 #    Init
 # --------------------------------------------------
-# create tables
-Base.metadata.create_all(engine)
+# start the write-behind queue, queued rows are written on shutdown
+stats_writer = StatsWriter(STATS_WRITER_MAX_ROWS, STATS_WRITER_MAX_DELAY)
+stats_writer.start()
+atexit.register(stats_writer.stop)
 
-# ALTER TABLE quiz_activity ADD COLUMN quiz_flipped BOOLEAN NOT NULL DEFAULT 0;
-# ALTER TABLE quiz_stats ADD COLUMN quiz_flipped BOOLEAN NOT NULL DEFAULT 0;
+# the stats of a quiz are deleted with the quiz
+model.add_delete_quiz_listener(_delete_quiz_stats)
@@ -6,16 +6,86 @@
 #    Imports
 # --------------------------------------------------
 import datetime
+import executor
 import functools
+import html
 import json
 import model
 import model_stats
-from utils import inject_quiz_id_user_id, refresh_activity_chart
+from utils import get_quiz_flipped, inject_quiz_id_user_id, refresh_activity_chart, set_selected_quiz_id
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# number of quizzes loaded into the quiz list box at a time
+CATALOG_PAGE_SIZE = 50
+# number of quizzes shown for a search of the quiz contents
+SEARCH_RESULTS_LIMIT = 50
 
 
 # --------------------------------------------------
 #    Functions
 # --------------------------------------------------
+def _catalog_option(quiz_id, name, owner_user_name):
+    """ return the html of a quiz in the quiz list box """
+    return f"""<option value={quiz_id}>{html.escape(name or '')} ({html.escape(owner_user_name or '')})</option>"""
+
+
+def _show_catalog_page(jsc, user_id, search, cursor):
+    """ add a page of the quiz catalog to the quiz list box
+
+        Args:
+            jsc - connection of the user
+            user_id - id of the user browsing the catalog, None for a guest
+            search - start of the quiz names and owners to search for, '' for all quizzes
+            cursor - cursor of the page to add, None to clear the list box and show the first page
+
+        Returns:
+            list of the quizzes on the page, see model.get_quiz_catalog
+    """
+    quizzes, next_cursor = executor.run_db(model.get_quiz_catalog, user_id, search, cursor, CATALOG_PAGE_SIZE)
+    jsc.tag['CATALOG'] = (search, next_cursor)
+    _append_catalog_options(jsc, user_id, quizzes, cursor is None)
+    jsc['#btn_Catalog_More'].css.display = 'none' if next_cursor is None else ''
+    return quizzes
+
+
+def _show_search_results(jsc, user_id, search):
+    """ show the quizzes found by a full text search of the quiz contents in the quiz list box, best match first
+
+        Args:
+            jsc - connection of the user
+            user_id - id of the user searching
+            search - words to search the quiz names, questions and answers for
+
+        Returns:
+            list of the quizzes found, see model.search_quizzes
+    """
+    quizzes = executor.run_db(model.search_quizzes, search, SEARCH_RESULTS_LIMIT)
+    jsc.tag['CATALOG'] = (search, None)
+    _append_catalog_options(jsc, user_id, quizzes, True)
+    jsc['#btn_Catalog_More'].css.display = 'none'
+    return quizzes
+
+
+def _append_catalog_options(jsc, user_id, quizzes, reset):
+    """ add quizzes to the quiz list box
+
+        Args:
+            jsc - connection of the user
+            user_id - id of the user, the quizzes owned by the user are shown in their own group
+            quizzes - list of dictionaries with quiz_id, name, owner_user_id and owner_user_name
+            reset - True to clear the list box first
+    """
+    # the browser skips quizzes which are already in the list box
+    options = {True: [], False: []}
+    for q in quizzes:
+        options[q['owner_user_id'] == user_id].append(_catalog_option(q['quiz_id'], q['name'], q['owner_user_name']))
+    json_data = json.dumps([''.join(options[True]), ''.join(options[False])])
+    jsc.eval_js_code(f"""catalog_append({json_data}, {'true' if reset else 'false'})""")
+
+
 def _validate_quiz_name(user_id, quiz_name):
     """ validate the quiz name
 
@@ -29,11 +99,8 @@ def _validate_quiz_name(user_id, quiz_name):
     if quiz_name == '':
         return "Quiz name can not be empty!"
 
-    quiz_ids = model.get_quiz_ids(user_id)
-    quizzes = model.get_quizzes(quiz_ids, ['name', 'owner_user_id'])
-    for q in quizzes.values():
-        if (q['name'] == quiz_name) and q['owner_user_id'] == user_id:
-            return f'A quiz you own with name of "{quiz_name}" already exists.  Edit the existing quiz instead.'
+    if executor.run_db(model.is_quiz_name_in_use, user_id, quiz_name):
+        return f'A quiz you own with name of "{quiz_name}" already exists.  Edit the existing quiz instead.'
 
     return None
 
@@ -48,33 +115,20 @@ def init_pane(jsc, quiz_id, user_id):
     # init the activity chart
     refresh_activity_chart(jsc, 'activitychart_choose', user_id)
 
-    # get quiz info
-    quiz_ids = model.get_quiz_ids(None)
-    quizzes = model.get_quizzes(quiz_ids, ['name', 'owner_user_name', 'owner_user_id'])
-
-    # manually build the optgroups
-    preferred_option_value = None
-    html = '<optgroup label="Your quizzes">\n'
-    for k, v in quizzes.items():
-        if v['owner_user_id'] == user_id:
-            html += f"""<option value={k}>{v['name']} ({v['owner_user_name']})</option>"""
-            if preferred_option_value is None:
-                preferred_option_value = k
-    html += '<optgroup label="Other Quizzes">\n'
-    for k, v in quizzes.items():
-        if v['owner_user_id'] != user_id:
-            html += f"""<option value={k}>{v['name']} ({v['owner_user_name']})</option>"""
-            if preferred_option_value is None:
-                preferred_option_value = k
-
-    # set the option groups
-    jsc['#select_quizzes_available'].html = html
-
-    # select the appropriate item
-    if jsc.tag.get('preferred_selected_quiz', None) in quizzes:
-        preferred_option_value = jsc.tag['preferred_selected_quiz']
-    if preferred_option_value:
-        jsc.select_set_selected_options('#select_quizzes_available', preferred_option_value)
+    # show the first page of the catalog
+    jsc['#catalog_search'].val = ''
+    quizzes = _show_catalog_page(jsc, user_id, '', None)
+    preferred_option_value = quizzes[0]['quiz_id'] if quizzes else None
+
+    # select the appropriate item, adding it to the list box if it is not on the first page
+    preferred_selected_quiz = jsc.tag.get('preferred_selected_quiz', None)
+    if preferred_selected_quiz is not None:
+        preferred = executor.run_db(model.get_quizzes, [preferred_selected_quiz], ['name', 'owner_user_name', 'owner_user_id'])
+        if preferred_selected_quiz in preferred:
+            if preferred_selected_quiz not in [x['quiz_id'] for x in quizzes]:
+                _append_catalog_options(jsc, user_id, [dict(quiz_id=preferred_selected_quiz, **preferred[preferred_selected_quiz])], False)
+            preferred_option_value = preferred_selected_quiz
+    set_selected_quiz_id(jsc, preferred_option_value)
 
     # refresh the button states
     selectionChanged(jsc)
@@ -89,7 +143,7 @@ def init_pane(jsc, quiz_id, user_id):
         jsc['#btn_Clear_Stats_For_Quiz'].prop.disabled = 'true'
 
     # update the stats
-    data = model_stats.get_quiz_scores(user_id)
+    data = executor.run_db(model_stats.get_quiz_scores, user_id)
     date_handler = lambda obj: (
         obj.isoformat()
         if isinstance(obj, (datetime.datetime, datetime.date))
@@ -99,7 +153,7 @@ def init_pane(jsc, quiz_id, user_id):
     if user_id is None:
         display_name = 'Guest'
     else:
-        display_name = model.get_user_props(user_id)['display_name']
+        display_name = executor.run_db(model.get_user_props, user_id)['display_name']
     jsc['#quiz_scores_label'].html = 'Quiz Scores for ' + display_name
     jsc.eval_js_code(f"""populate_quiz_scores('{json_data}')""")
 
@@ -118,13 +172,13 @@ def clearStatsForQuiz(jsc, quiz_id, user_id):
     # show a modal confirming that the user really wants to delete the quiz
     jsc.modal_confirm(title="Clear Stats Confirmation",
                       body="Are you sure you want to clear the stats for this quiz? This can not be undone!",
-                      callback="""onclick="call_py('paneChooseQuiz.clearStatsForQuizConfirmed')" """)
+                      callback="""onclick="call_py('paneChooseQuiz.clearStatsForQuizConfirmed', ui_ctx())" """)
 
 
 @inject_quiz_id_user_id
 def clearStatsForQuizConfirmed(jsc, quiz_id, user_id):
     """ handler for after OK of clear stats for quiz has been clicked """
-    model_stats.clearStatsForQuiz(quiz_id, user_id)
+    executor.run_db(model_stats.clearStatsForQuiz, quiz_id, user_id)
     jsc.show_pane('paneChooseQuiz')
 
 
@@ -132,7 +186,7 @@ def clearStatsForQuizConfirmed(jsc, quiz_id, user_id):
 def deleteQuiz(jsc, quiz_id, user_id):
     """ handler for Delete Quiz Button """
     # show an error message if the user is not the owner of the quiz
-    if not model.is_quiz_owner(quiz_id, user_id):
+    if not executor.run_db(model.is_quiz_owner, quiz_id, user_id):
         jsc.modal_alert(title='Action not allowed',
                         body='You can not delete this quiz because you are not the owner')
         return
@@ -140,18 +194,18 @@ def deleteQuiz(jsc, quiz_id, user_id):
     # show a modal confirming that the user really wants to delete the quiz
     jsc.modal_confirm(title="Delete Quiz Confirmation",
                       body="Are you sure you want to delete this quiz? This can not be undone!",
-                      callback="""onclick="call_py('paneChooseQuiz.deleteQuizConfirmed')" """)
+                      callback="""onclick="call_py('paneChooseQuiz.deleteQuizConfirmed', ui_ctx())" """)
 
 
 @inject_quiz_id_user_id
 def deleteQuizConfirmed(jsc, quiz_id, user_id):
     """ handler for Delete Quiz OK Button """
-    quiz = model.get_quiz(quiz_id)
+    quiz = executor.run_db(model.get_quiz, quiz_id)
     if quiz['owner_user_id'] != user_id:
         jsc.modal_alert(title='Action not allowed',
                         body='You can not delete this quiz because you are not the owner')
         return
-    model.delete_quiz(quiz_id)
+    executor.run_db(model.delete_quiz, quiz_id)
     jsc.show_pane('paneChooseQuiz')
 
 
@@ -168,7 +222,7 @@ def newQuiz(jsc, quiz_id, user_id):
     # Show the modal to ask for a new quiz name
     jsc.modal_input(title='Type in the name of the new quiz below',
                     hint='New Quiz Name',
-                    callback="""onclick="call_py('paneChooseQuiz.newQuizSave');" """)
+                    callback="""onclick="call_py('paneChooseQuiz.newQuizSave', ui_ctx());" """)
 
 
 @inject_quiz_id_user_id
@@ -184,20 +238,46 @@ def newQuizSave(jsc, quiz_id, user_id):
                         body=quiz_name_problems)
     else:
         # create the new quiz
-        new_quiz_id = model.set_quiz(None, user_id, new_quiz_name, '', 0)
+        new_quiz_id = executor.run_db(model.set_quiz, None, user_id, new_quiz_name, '', 0)
 
         # show the quizzes available pane to repopulate the quiz selection box
         jsc.show_pane('paneChooseQuiz')
 
         # clear the selections and select the new quiz
-        jsc.eval_js_code("""$("#select_quizzes_available").val([]);""")
-        jsc.select_set_selected_options('#select_quizzes_available', new_quiz_id)
+        set_selected_quiz_id(jsc, new_quiz_id)
         jsc.tag['preferred_selected_quiz'] = new_quiz_id
 
         # finally, show the editing pane
         jsc.show_pane('paneEditViewQuiz')
 
 
+@inject_quiz_id_user_id
+def loadMoreCatalog(jsc, quiz_id, user_id):
+    """ handler for the Load More Quizzes button """
+    search, cursor = jsc.tag.get('CATALOG', ('', None))
+    if cursor is not None:
+        _show_catalog_page(jsc, user_id, search, cursor)
+
+
+@inject_quiz_id_user_id
+def searchCatalog(jsc, quiz_id, user_id, search, search_contents=False):
+    """ handler for when the text in the quiz search box changes
+
+        Args:
+            search - text in the search box
+            search_contents - True to search the questions and answers of the quizzes as well
+    """
+    if search_contents and search.strip() != '':
+        quizzes = _show_search_results(jsc, user_id, search)
+    else:
+        quizzes = _show_catalog_page(jsc, user_id, search, None)
+
+    # keep the selected quiz if it was found, otherwise select the first quiz found
+    quiz_ids = [q['quiz_id'] for q in quizzes]
+    set_selected_quiz_id(jsc, quiz_id if quiz_id in quiz_ids else (quiz_ids[0] if quiz_ids else None))
+    selectionChanged(jsc)
+
+
 @inject_quiz_id_user_id
 def selectionChanged(jsc, quiz_id, user_id):
     """ handler for when the selection changes in the quiz list box """
@@ -208,7 +288,7 @@ def selectionChanged(jsc, quiz_id, user_id):
     jsc['#btn_New_Quiz'].prop.disabled = {True: 'true', False: ''}[user_id is None]
 
     # if the user owns the selected quiz we can enable the edit and the delete
-    if model.is_quiz_owner(quiz_id, user_id):
+    if executor.run_db(model.is_quiz_owner, quiz_id, user_id):
         jsc['#btn_Edit_Quiz'].html = 'Edit Quiz'
         jsc['#btn_Delete_Quiz'].prop.disabled = ''
     else:
@@ -216,10 +296,10 @@ def selectionChanged(jsc, quiz_id, user_id):
         jsc['#btn_Delete_Quiz'].prop.disabled = 'true'
 
     # is the quiz flipped
-    quiz_flipped = jsc['#chkFlipQuiz'].prop.checked
+    quiz_flipped = get_quiz_flipped(jsc)
 
     # update the stats
-    data = model_stats.get_quiz_question_stats(quiz_id, user_id, quiz_flipped)
+    data = executor.run_db(model_stats.get_quiz_question_stats, quiz_id, user_id, quiz_flipped)
     date_handler = lambda obj: (
         obj.isoformat()
         if isinstance(obj, (datetime.datetime, datetime.date))
@@ -230,10 +310,10 @@ def selectionChanged(jsc, quiz_id, user_id):
     if user_id is None:
         display_name = 'Guest'
     else:
-        display_name = model.get_user_props(user_id)['display_name']
+        display_name = executor.run_db(model.get_user_props, user_id)['display_name']
 
     if quiz_id is not None:
-        jsc['#quiz_stats_label'].html = 'Quiz Stats for ' + model.get_quiz(quiz_id)['name']
+        jsc['#quiz_stats_label'].html = 'Quiz Stats for ' + executor.run_db(model.get_quiz, quiz_id)['name']
     json_data = json_data.replace("\\", "\\\\")
     json_data = json_data.replace("'", "\\'")
     jsc.eval_js_code(f"""populate_quiz_stats('{json_data}')""")
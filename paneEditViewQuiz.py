@@ -5,6 +5,7 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import executor
 import model
 from utils import inject_quiz_id_user_id
 
@@ -24,11 +25,10 @@ def _validate_quiz_data(quiz_data):
     if len(quiz_data.strip()) == 0:
         return "Quiz can not be empty"
 
-    for i, x in enumerate(quiz_data.split('\n')):
-        if x.strip() == '':
-            continue
-        if len(x.strip().split('|')) != 2:
-            return f'Data on Row {i + 1} did not contain a pipe (|)<br><br><pre><code>{x.strip()}</code></pre>'
+    try:
+        model.parse_quiz_data(quiz_data, strict=True)
+    except model.InvalidQuizDataException as e:
+        return f'Data on Row {e.row} did not contain a pipe (|)<br><br><pre><code>{e.line}</code></pre>'
     return None
 
 
@@ -39,7 +39,7 @@ def _validate_quiz_data(quiz_data):
 def init_pane(jsc, quiz_id, user_id):
     """ initialize the Edit / View Quiz Pane """
     # get the selected quiz
-    quiz = model.get_quiz(quiz_id)
+    quiz = executor.run_db(model.get_quiz, quiz_id)
 
     # change the title to be editing or vieweing
     if quiz['owner_user_id'] == user_id:
@@ -53,7 +53,7 @@ def init_pane(jsc, quiz_id, user_id):
 
 
     # disable the Save button if needed
-    jsc['#paneEditViewQuiz button:contains("Save")'].prop.disabled = not model.is_quiz_owner(quiz_id, user_id)
+    jsc['#paneEditViewQuiz button:contains("Save")'].prop.disabled = not executor.run_db(model.is_quiz_owner, quiz_id, user_id)
 
 
 # --------------------------------------------------
@@ -79,6 +79,6 @@ def saveEdit(jsc, quiz_id, user_id):
         jsc.modal_alert(title='Quiz Data is not Valid',
                         body=quiz_problems)
     else:
-        quiz = model.get_quiz(quiz_id)
-        model.set_quiz(quiz_id, user_id, quiz['name'], new_quiz_data, flags=flags)
+        quiz = executor.run_db(model.get_quiz, quiz_id)
+        executor.run_db(model.set_quiz, quiz_id, user_id, quiz['name'], new_quiz_data, flags=flags)
         jsc.show_pane('paneChooseQuiz')
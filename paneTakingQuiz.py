@@ -5,18 +5,152 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import datetime
+import executor
+import json
 import logging
-import random
-import sys
 import time
 import model
 import model_stats
-from utils import inject_quiz_id_user_id, refresh_activity_chart
+from quiz_session import quiz_sessions, QuizSessionNotFoundException
+from utils import get_answer, get_client_grading, get_quiz_flipped, inject_quiz_id_user_id, refresh_activity_chart
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+MINI_QUIZ_QUESTIONS = 5
 
 
 # --------------------------------------------------
 #    Functions
 # --------------------------------------------------
+def _get_quiz_session(jsc):
+    """ return the quiz session being taken on a connection
+
+        Args:
+            jsc - connection of the user
+
+        Returns:
+            QuizSession, or None if the quiz session has expired
+    """
+    try:
+        return quiz_sessions.get(jsc.tag.get('QUIZ_UID', None))
+    except QuizSessionNotFoundException:
+        jsc.show_pane('paneChooseQuiz')
+        return None
+
+
+def _record_answer(quiz_session, user_id, question, item_id, correct, first_time, time_created=None):
+    """ record the stats for an answer
+
+        Args:
+            quiz_session - QuizSession the answer is for
+            user_id - id of the user who answered
+            question - question which was answered
+            item_id - QuizItem id of the question
+            correct - True if the answer was correct
+            first_time - True if the question had not been answered incorrectly before
+            time_created - time of the answer as a naive utc datetime, defaults to now
+    """
+    quiz_id = quiz_session.quiz_id
+    quiz_flipped = quiz_session.quiz_flipped
+    if correct:
+        # check if this is the first time we have seen this question
+        if first_time:
+            logging.info('Correct the first time')
+
+            # update the stats
+            model_stats.add_quiz_question_stat(quiz_id, user_id, question, correct=True, quiz_flipped=quiz_flipped, item_id=item_id, time_created=time_created)
+
+        # update activity stats
+        model_stats.add_quiz_activity_stat(quiz_id, user_id, quiz_session.quiz_uid, question, model_stats.ActivityId.QUIZ_QUESTION_CORRECT, quiz_flipped=quiz_flipped, item_id=item_id, time_created=time_created)
+    else:
+        # update the stats
+        model_stats.add_quiz_question_stat(quiz_id, user_id, question, correct=False, quiz_flipped=quiz_flipped, item_id=item_id, time_created=time_created)
+
+        # update activity stats
+        model_stats.add_quiz_activity_stat(quiz_id, user_id, quiz_session.quiz_uid, question, model_stats.ActivityId.QUIZ_QUESTION_INCORRECT, quiz_flipped=quiz_flipped, item_id=item_id, time_created=time_created)
+
+
+def _finish_quiz(jsc, quiz_session, user_id):
+    """ show the final score, record it and end the quiz session
+
+        Args:
+            jsc - connection of the user
+            quiz_session - finished QuizSession
+            user_id - id of the user who took the quiz
+    """
+    running_total = quiz_session.correct + quiz_session.wrong
+    jsc['#QuestionAndAnswer'].css.display = 'none'
+    jsc['#QuestionsFinished'].css.display = 'block'
+    jsc['#Finished_Stats'].html = f"<center>Quiz Finished!<br><br>Final Score: {int((quiz_session.correct * 100.0 / running_total))}%"
+
+    # update the stats
+    elapsed_time = int(time.time() - quiz_session.start_time)
+    executor.run_db(model_stats.add_quiz_score, quiz_session.quiz_id, user_id, quiz_session.quiz_type, quiz_session.correct, running_total, elapsed_time, quiz_flipped=quiz_session.quiz_flipped)
+    executor.run_db(model_stats.add_quiz_activity_stat, quiz_session.quiz_id, user_id, quiz_session.quiz_uid, '', model_stats.ActivityId.QUIZ_END, quiz_flipped=quiz_session.quiz_flipped)
+    quiz_sessions.end(quiz_session.quiz_uid)
+
+
+def _is_int(x):
+    """ return True if a value sent by the browser is an integer """
+    return isinstance(x, int) and not isinstance(x, bool)
+
+
+def _is_valid_event(e):
+    """ return True if an answer sent by the browser has the fields record_answers needs
+
+        Args:
+            e - answer as sent by the browser, see record_answers
+    """
+    if not isinstance(e, dict) or not _is_int(e.get('seq', None)) or not _is_int(e.get('index', None)):
+        return False
+    return e.get('skip', False) is True or isinstance(e.get('answer', None), str)
+
+
+def _answer_time(quiz_session, now, age_ms):
+    """ return when an answer graded in the browser was made
+
+        The age is clamped to the time since the quiz started, so the browser can not date an
+        answer before the quiz or after now
+
+        Args:
+            quiz_session - QuizSession the answer belongs to
+            now - naive UTC datetime the answers were received
+            age_ms - milliseconds since the answer was made, as sent by the browser
+
+        Returns:
+            naive UTC datetime, or None if age_ms is not an integer
+    """
+    if not _is_int(age_ms):
+        return None
+    max_age_ms = max(0, int((time.time() - quiz_session.start_time) * 1000))
+    return now - datetime.timedelta(milliseconds=min(max(0, age_ms), max_age_ms))
+
+
+def _start_client_quiz(jsc, quiz_session):
+    """ send the remaining questions and the score to the browser so it can grade the answers
+
+        Also used to resynchronize the browser with the server, answers the browser has not
+        sent yet are dropped
+
+        Args:
+            jsc - connection of the user
+            quiz_session - QuizSession being taken
+    """
+    deck = [[i, *quiz_session.question(i)[:2]] for i in quiz_session.remaining]
+    state = {'deck': deck,
+             'incorrect': sorted({i for i in quiz_session.remaining if quiz_session.incorrect & (1 << i)}),
+             'case_sensitive': bool(quiz_session.flags & model.FLAG_CASE_SENSITIVE),
+             'correct': quiz_session.correct,
+             'wrong': quiz_session.wrong,
+             'remedial': quiz_session.remedial,
+             'skips_left': quiz_session.skips_left,
+             'seq': quiz_session.client_seq}
+    jsc.eval_js_code(f"""start_client_quiz({json.dumps(state)});""")
+
+
 @inject_quiz_id_user_id
 def check_answer(jsc, quiz_id, user_id):
     """
@@ -39,95 +173,51 @@ def check_answer(jsc, quiz_id, user_id):
             * add to previously wrong set
             @ REMEDIAL++
     """
+    quiz_session = _get_quiz_session(jsc)
+    if quiz_session is None:
+        return
+
     # get the answer
-    user_answer =jsc['#answer'].val
+    user_answer = get_answer(jsc)
 
     # check if the answer is correct
-    question = jsc.tag["QUESTIONS_REMAINING"][0][0]
-    answer = jsc.tag["QUESTIONS_REMAINING"][0][1]
+    question, answer, item_id = quiz_session.current()
     jsc['#alert'].html = answer
 
     # check for correctness based on flags
-    correct = False
-    if jsc.tag["QUIZ_FLAGS"] & model.FLAG_CASE_SENSITIVE:
-        correct = user_answer.strip() == jsc.tag["QUESTIONS_REMAINING"][0][1].strip()
-    else:
-        correct = user_answer.strip().lower() == jsc.tag["QUESTIONS_REMAINING"][0][1].strip().lower()
-
-    # is the quiz flipped
-    quiz_flipped = jsc['#chkFlipQuiz'].prop.checked
+    correct = quiz_session.is_correct(user_answer)
 
     # handle correct or incorrect
+    first_time = quiz_session.answer(correct)
     if correct:
         # answer is correct, so hide the alert
         jsc['#alert'].css.visibility = 'hidden'
-
-        # delete the question from the QUESTIONS_REMAINING
-        jsc.tag["QUESTIONS_REMAINING"].pop(0)
-
-        # check if this is the first time we have seen this question
-        if question not in jsc.tag["QUESTIONS_ANSWERED_INCORRECTLY"]:
-            logging.info('Correct the first time')
-            jsc.tag["CORRECT"] = jsc.tag["CORRECT"] + 1
-
-            # update the stats
-            model_stats.add_quiz_question_stat(quiz_id, user_id, question, correct=True, quiz_flipped=quiz_flipped)
-        else:
-            jsc.tag["REMEDIAL"] = jsc.tag["REMEDIAL"] - 1
-
-        # update activity stats
-        model_stats.add_quiz_activity_stat(quiz_id, user_id, jsc.tag['QUIZ_UID'], question, model_stats.ActivityId.QUIZ_QUESTION_CORRECT, quiz_flipped=quiz_flipped)
     else:
         # answer is wrong, so show the alert
         jsc['#alert'].css.visibility = ''
         jsc['#alert'].html = f'Incorrect!  {answer}<br>Your Answer: {user_answer}'
-
-        # add another copy of this question to the end of the stack
-        jsc.tag['QUESTIONS_REMAINING'].append([question, answer])
-
-        # check if we have answered this question wrong before
-        if question not in jsc.tag["QUESTIONS_ANSWERED_INCORRECTLY"]:
-            # first time we have seen this wrong question, so we can increment the total
-            jsc.tag["WRONG"] = jsc.tag["WRONG"] + 1
-            jsc.tag["REMEDIAL"] = jsc.tag["REMEDIAL"] + 1
-
-        # update the stats
-        model_stats.add_quiz_question_stat(quiz_id, user_id, question, correct=False, quiz_flipped=quiz_flipped)
-
-        # add this question to the set of questions answered incorrectly
-        jsc.tag["QUESTIONS_ANSWERED_INCORRECTLY"].add(question)
-        jsc.tag["REMEDIAL"] = jsc.tag["REMEDIAL"] + 1
-
-        # update activity stats
-        model_stats.add_quiz_activity_stat(quiz_id, user_id, jsc.tag['QUIZ_UID'], question, model_stats.ActivityId.QUIZ_QUESTION_INCORRECT, quiz_flipped=quiz_flipped)
+    executor.run_db(_record_answer, quiz_session, user_id, question, item_id, correct, first_time)
+    quiz_sessions.save(quiz_session)
 
     # refresh the progress bar
-    refresh_progress_bar(jsc)
+    refresh_progress_bar(jsc, quiz_session)
 
     # check if we are done
-    if len(jsc.tag["QUESTIONS_REMAINING"]) != 0:
-        next_question(jsc)
+    if not quiz_session.finished:
+        next_question(jsc, quiz_session)
     else:
-        running_total = jsc.tag["CORRECT"] + jsc.tag["WRONG"]
-        jsc['#QuestionAndAnswer'].css.display = 'none'
-        jsc['#QuestionsFinished'].css.display = 'block'
-        jsc['#Finished_Stats'].html = f"<center>Quiz Finished!<br><br>Final Score: {int((jsc.tag['CORRECT'] * 100.0 / running_total))}%"
-
-        # update the stats
-        elapsed_time = int(time.time() - jsc.tag["START_TIME"])
-        model_stats.add_quiz_score(quiz_id, user_id, jsc.tag['QUIZ_TYPE'], jsc.tag['CORRECT'], jsc.tag['CORRECT'] + jsc.tag['WRONG'], elapsed_time, quiz_flipped=quiz_flipped)
-        model_stats.add_quiz_activity_stat(quiz_id, user_id, jsc.tag['QUIZ_UID'], '', model_stats.ActivityId.QUIZ_END, quiz_flipped=quiz_flipped)
+        _finish_quiz(jsc, quiz_session, user_id)
 
     # refresh the activity chart
     refresh_activity_chart(jsc, 'activitychart_taking', user_id)
 
 
-def next_question(jsc):
+def next_question(jsc, quiz_session):
     """ setup the UI to show the next question """
-    jsc['#question'].html = jsc.tag["QUESTIONS_REMAINING"][0][0]
+    jsc['#question'].html = quiz_session.current()[0]
     jsc['#answer'].val= ''
-    jsc['#btn_skip'].html = f'Skip ({jsc.tag["SKIPS_LEFT"]})'
-    if jsc.tag["SKIPS_LEFT"] > 0:
+    jsc['#btn_skip'].html = f'Skip ({quiz_session.skips_left})'
+    if quiz_session.skips_left > 0:
         jsc['#btn_skip'].prop.disabled = ''
     else:
         jsc['#btn_skip'].prop.disabled = 'true'
@@ -136,30 +226,31 @@ def next_question(jsc):
     jsc.eval_js_code(f"""MathJax.typeset();""")
 
     # refresh the progress bar!
-    refresh_progress_bar(jsc)
+    refresh_progress_bar(jsc, quiz_session)
 
 
-def refresh_progress_bar(jsc):
+def refresh_progress_bar(jsc, quiz_session):
     """ refresh the progress bar to show the current metrics """
-    pbar_total = jsc.tag["CORRECT"] + jsc.tag["WRONG"] + len(jsc.tag['QUESTIONS_REMAINING'])
-    jsc['#pbar_correct'].css.width = f'{int(jsc.tag["CORRECT"] * 100 / pbar_total)}%'
-    jsc['#pbar_correct'].html = jsc.tag["CORRECT"]
-    jsc['#pbar_remaining'].css.width = f'{int(len(jsc.tag["QUESTIONS_REMAINING"]) * 100 / pbar_total)}%'
-    jsc['#pbar_remaining'].html = len(jsc.tag["QUESTIONS_REMAINING"])
-    jsc['#pbar_remedial'].css.width = f'{int(jsc.tag["REMEDIAL"] * 100 / pbar_total)}%'
-    jsc['#pbar_remedial'].html = jsc.tag["REMEDIAL"]
-
-    running_total = jsc.tag["CORRECT"] + jsc.tag["WRONG"]
+    remaining = len(quiz_session.remaining)
+    pbar_total = quiz_session.correct + quiz_session.wrong + remaining
+    jsc['#pbar_correct'].css.width = f'{int(quiz_session.correct * 100 / pbar_total)}%'
+    jsc['#pbar_correct'].html = quiz_session.correct
+    jsc['#pbar_remaining'].css.width = f'{int(remaining * 100 / pbar_total)}%'
+    jsc['#pbar_remaining'].html = remaining
+    jsc['#pbar_remedial'].css.width = f'{int(quiz_session.remedial * 100 / pbar_total)}%'
+    jsc['#pbar_remedial'].html = quiz_session.remedial
+
+    running_total = quiz_session.correct + quiz_session.wrong
     if running_total == 0:
         percentage = '0%'
     else:
-        percentage = f'{int((jsc.tag["CORRECT"] * 100.0 / running_total))}%'
-    jsc['#progress_text'].html = f'<h3>{percentage}</h3>Progress ({len(jsc.tag["QUESTIONS_REMAINING"])} left, {jsc.tag["CORRECT"]} correct, {jsc.tag["WRONG"]} wrong, {jsc.tag["REMEDIAL"]} remedial)'
+        percentage = f'{int((quiz_session.correct * 100.0 / running_total))}%'
+    jsc['#progress_text'].html = f'<h3>{percentage}</h3>Progress ({remaining} left, {quiz_session.correct} correct, {quiz_session.wrong} wrong, {quiz_session.remedial} remedial)'
 
     # special case if we are done
-    if len(jsc.tag['QUESTIONS_REMAINING']) == 0:
-        jsc['#pbar_remedial'].css.width = f'{int(jsc.tag["WRONG"] * 100 / pbar_total)}%'
-        jsc['#pbar_remedial'].html = jsc.tag["WRONG"]
+    if remaining == 0:
+        jsc['#pbar_remedial'].css.width = f'{int(quiz_session.wrong * 100 / pbar_total)}%'
+        jsc['#pbar_remedial'].html = quiz_session.wrong
 
 
 # --------------------------------------------------
@@ -170,8 +261,8 @@ def init_pane(jsc, quiz_id, user_id, **kwargs):
     # init the activity chart
     refresh_activity_chart(jsc, 'activitychart_taking', user_id)
 
-    # init a quiz_uid
-    jsc.tag['QUIZ_UID'] = random.randint(0, sys.maxsize)
+    # end the previous quiz taken on this connection
+    quiz_sessions.end(jsc.tag.get('QUIZ_UID', None))
 
     # show the questions and answer card
     jsc['#QuestionAndAnswer'].css.display = 'block'
@@ -179,83 +270,44 @@ def init_pane(jsc, quiz_id, user_id, **kwargs):
     jsc['#alert'].css.visibility = 'hidden'
 
     # is the quiz flipped
-    quiz_flipped = jsc['#chkFlipQuiz'].prop.checked
+    quiz_flipped = get_quiz_flipped(jsc)
 
-    # get the selected quiz and the selected quiz data
-    quiz = model.get_quiz(quiz_id)
-    jsc['#paneTakingQuiz h5'].html = 'Taking Quiz ' + quiz['name']
-    quiz_data = quiz['data']
-
-    # parse the quiz data
-    lines = quiz_data.split('\n')
-    if quiz_flipped:
-        lines = [f'{x.split("|")[1]}|{x.split("|")[0]}' for x in lines if x.strip() != '']
+    # get the selected quiz and its parsed questions
+    quiz = executor.run_db(model.get_parsed_quiz, quiz_id)
+    jsc['#paneTakingQuiz h5'].html = 'Taking Quiz ' + quiz.name
 
     # chop for mini quiz
-    jsc.tag['QUIZ_TYPE'] = ''
+    quiz_type = ''
+    item_ids = None
     if kwargs.get('mini_quiz', False):
-        jsc.tag['QUIZ_TYPE'] = 'Mini'
-        data = {}
-        for x in lines:
-            if not x.strip() == '':
-                data[x.split('|')[0].strip()] = x
-
-        quiz_stats = model_stats.get_quiz_question_stats(quiz_id, user_id, quiz_flipped)
-
-        # find questions we have no stats for
-        data_no_stats = dict(data)
-        for stat in quiz_stats:
-            if stat['question'] in data_no_stats:
-                del data_no_stats[stat['question']]
-
-        # load questions with no stats first
-        mini_quiz_lines = {}
-        for k, v in data_no_stats.items():
-            if len(mini_quiz_lines) >= 5:
-                break
-            if k not in mini_quiz_lines:
-                print('Adding question because no stats', k)
-                mini_quiz_lines[k] = v
+        quiz_type = 'Mini'
 
-        # then load questions with bad stats
-        for stat in quiz_stats:
-            if len(mini_quiz_lines) >= 5:
-                break
-            if stat['question'] in data:
-                print('Adding question because bad stat', stat['question'])
-                mini_quiz_lines[stat['question']] = data[stat['question']]
-        lines = list(mini_quiz_lines.values())
+        # ask the questions which are due for review
+        item_ids = executor.run_db(model_stats.get_due_items, quiz_id, user_id, quiz_flipped, MINI_QUIZ_QUESTIONS)
+
+    # start the quiz session with the questions shuffled
+    # skips_left = max(1, int(number of questions / 25))
+    quiz_session = quiz_sessions.start(quiz, user_id, quiz_flipped, quiz_type, item_ids, skips_left=1)
+    jsc.tag['QUIZ_UID'] = quiz_session.quiz_uid
 
     # error if there are no questions
-    if len(lines) == 0:
+    if quiz_session.finished:
+        quiz_sessions.end(quiz_session.quiz_uid)
         jsc.show_pane('paneChooseQuiz')
         raise Exception('Error!  There are no questions for this quiz')
 
-    # shuffle the lines
-    random.shuffle(lines)
-
-    jsc.tag['QUESTIONS_REMAINING'] = []
-    for x in lines:
-        if not x.strip() == '':
-            f = [xx.strip() for xx in x.split('|')]
-            jsc.tag['QUESTIONS_REMAINING'].append(list(f))
-    jsc.tag["QUESTIONS_ANSWERED_INCORRECTLY"] = set()
-    jsc.tag["CORRECT"] = 0
-    jsc.tag["WRONG"] = 0
-    jsc.tag["REMEDIAL"] = 0
-    jsc.tag["QUIZ_FLAGS"] = quiz['flags']
-    # jsc.tag["SKIPS_LEFT"] = max(1, int(len(jsc.tag['QUESTIONS_REMAINING']) / 25))
-    jsc.tag["SKIPS_LEFT"] = 1
-    jsc.tag["START_TIME"] = time.time()
-
     # start the quiz stat
-    if jsc.tag['QUIZ_TYPE'] == 'Mini':
-        model_stats.add_quiz_activity_stat(quiz_id, user_id, jsc.tag['QUIZ_UID'], '', model_stats.ActivityId.QUIZ_START_MINI, quiz_flipped)
+    if quiz_type == 'Mini':
+        executor.run_db(model_stats.add_quiz_activity_stat, quiz_id, user_id, quiz_session.quiz_uid, '', model_stats.ActivityId.QUIZ_START_MINI, quiz_flipped)
     else:
-        model_stats.add_quiz_activity_stat(quiz_id, user_id, jsc.tag['QUIZ_UID'], '', model_stats.ActivityId.QUIZ_START, quiz_flipped)
+        executor.run_db(model_stats.add_quiz_activity_stat, quiz_id, user_id, quiz_session.quiz_uid, '', model_stats.ActivityId.QUIZ_START, quiz_flipped)
 
-    # call next question to show the first question
-    next_question(jsc)
+    # grade the answers in the browser if requested, otherwise call next question to show the first question
+    if get_client_grading(jsc):
+        _start_client_quiz(jsc, quiz_session)
+    else:
+        jsc.eval_js_code("""stop_client_quiz();""")
+        next_question(jsc, quiz_session)
 
 
 @inject_quiz_id_user_id
@@ -264,9 +316,81 @@ def finished(jsc, quiz_id, user_id):
     jsc.show_pane('paneChooseQuiz')
 
 
+@inject_quiz_id_user_id
+def record_answers(jsc, quiz_id, user_id, events):
+    """ handler for the answers graded in the browser
+
+        The answers are replayed on the quiz session and graded again.  If an answer does not
+        match the question the server expects or the server grades it differently, the
+        browser is resynchronized with the state of the server.
+
+        Args:
+            events - list of answers in the order they were made, each a dictionary of
+                     seq - sequence number of the answer, answers already applied are ignored
+                     index - index of the question answered or skipped
+                     answer - answer typed by the user
+                     correct - True if the browser graded the answer as correct
+                     skip - True if the question was skipped instead of answered
+                     age_ms - milliseconds since the answer was made
+                     an answer without an integer seq, index and age_ms, or without an answer
+                     when it is not a skip, is treated as out of sync
+    """
+    # the quiz may already be finished if the browser resends answers
+    try:
+        quiz_session = quiz_sessions.get(jsc.tag.get('QUIZ_UID', None))
+    except QuizSessionNotFoundException:
+        return
+
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    in_sync = isinstance(events, list)
+    for e in events if in_sync else []:
+        if not _is_valid_event(e):
+            in_sync = False
+            break
+        if e['seq'] <= quiz_session.client_seq:
+            continue
+        if quiz_session.finished or e['index'] != quiz_session.remaining[0]:
+            in_sync = False
+            break
+        if e.get('skip', False) is True:
+            if quiz_session.skips_left <= 0:
+                in_sync = False
+                break
+            quiz_session.skip()
+        else:
+            time_created = _answer_time(quiz_session, now, e.get('age_ms', None))
+            if time_created is None:
+                in_sync = False
+                break
+            question, answer, item_id = quiz_session.current()
+            correct = quiz_session.is_correct(e['answer'])
+            first_time = quiz_session.answer(correct)
+            executor.run_db(_record_answer, quiz_session, user_id, question, item_id, correct, first_time, time_created=time_created)
+            in_sync = correct == e.get('correct', None)
+        quiz_session.client_seq = e['seq']
+        if not in_sync:
+            break
+    quiz_sessions.save(quiz_session)
+
+    # acknowledge the answers, or replace the state of the browser if it went out of sync
+    if in_sync:
+        jsc.eval_js_code(f"""client_quiz_ack({quiz_session.client_seq});""")
+    else:
+        logging.warning(f'Browser graded quiz {quiz_session.quiz_uid} out of sync at answer {quiz_session.client_seq}, resynchronizing')
+        _start_client_quiz(jsc, quiz_session)
+
+    if quiz_session.finished:
+        _finish_quiz(jsc, quiz_session, user_id)
+
+    # refresh the activity chart
+    refresh_activity_chart(jsc, 'activitychart_taking', user_id)
+
+
 @inject_quiz_id_user_id
 def skip(jsc, quiz_id, user_id, **kwargs):
-    jsc.tag["SKIPS_LEFT"] = jsc.tag["SKIPS_LEFT"] - 1
-    q = jsc.tag['QUESTIONS_REMAINING'].pop(0)
-    jsc.tag['QUESTIONS_REMAINING'].append(q)
-    next_question(jsc)
+    quiz_session = _get_quiz_session(jsc)
+    if quiz_session is None:
+        return
+    quiz_session.skip()
+    quiz_sessions.save(quiz_session)
+    next_question(jsc, quiz_session)
@@ -0,0 +1,337 @@
+""" state of the quizzes being taken
+
+    A QuizSession only holds indexes into the cached ParsedQuiz, so the question text is shared by
+    every session taking the same quiz and each answer is O(1) regardless of the quiz size.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import random
+import sys
+import threading
+import time
+from collections import deque
+import model
+
+
+# ==================================================
+#    Constants
+# ==================================================
+# quiz sessions which have not been used for this many seconds are dropped
+QUIZ_SESSION_IDLE_TIMEOUT = 6 * 60 * 60
+# prefix of the keys of the quiz session checkpoints in the shared store
+QUIZ_SESSION_KEY_PREFIX = 'quiz_session:'
+
+
+# ==================================================
+#    Exceptions
+# ==================================================
+class QuizSessionNotFoundException(Exception):
+    pass
+
+
+class QuizSessionStaleException(Exception):
+    pass
+
+
+# ==================================================
+#    Classes
+# ==================================================
+class QuizSession:
+    """ questions remaining and score of a quiz being taken
+
+        remaining is a deque of indexes into the questions of the parsed quiz, the current
+        question is remaining[0].  incorrect is a bitset of the indexes answered incorrectly.
+        client_seq is the sequence number of the last answer graded in the browser which has
+        been applied to the session.
+    """
+    __slots__ = ('quiz_uid', 'quiz_id', 'user_id', 'quiz_flipped', 'quiz_type', 'quiz', 'remaining', 'incorrect',
+                 'correct', 'wrong', 'remedial', 'skips_left', 'start_time', 'last_access', 'client_seq')
+
+    def __init__(self, quiz_uid, quiz, user_id, quiz_flipped, quiz_type, indexes, skips_left):
+        """ init
+
+            Args:
+                quiz_uid - uid of the quiz being taken
+                quiz - ParsedQuiz being taken
+                user_id - id of the user taking the quiz
+                quiz_flipped - True if this is a flipped quiz, false otherwise
+                quiz_type - '' for a full quiz, 'Mini' for a mini quiz
+                indexes - indexes of the questions to ask, in the order to ask them
+                skips_left - number of times the user can skip a question
+        """
+        self.quiz_uid = quiz_uid
+        self.quiz_id = quiz.quiz_id
+        self.user_id = user_id
+        self.quiz_flipped = quiz_flipped
+        self.quiz_type = quiz_type
+        self.quiz = quiz
+        self.remaining = deque(indexes)
+        self.incorrect = 0
+        self.correct = 0
+        self.wrong = 0
+        self.remedial = 0
+        self.skips_left = skips_left
+        self.start_time = time.time()
+        self.last_access = time.monotonic()
+        self.client_seq = 0
+
+    def __repr__(self):
+        return '<QuizSession(' + ','.join([f"""{x}={getattr(self, x)}""" for x in ['quiz_uid', 'quiz_id', 'user_id', 'quiz_flipped', 'quiz_type', 'correct', 'wrong', 'remedial']]) + f',remaining={len(self.remaining)})>'
+
+    @property
+    def flags(self):
+        """ flags of the quiz being taken """
+        return self.quiz.flags
+
+    @property
+    def finished(self):
+        """ True if there are no questions remaining """
+        return not self.remaining
+
+    def question(self, i):
+        """ return a question of the quiz
+
+            Args:
+                i - index of the question in the parsed quiz
+
+            Returns:
+                tuple of (question, answer, item_id)
+        """
+        question, answer = self.quiz.flipped[i] if self.quiz_flipped else self.quiz.questions[i]
+        return question, answer, self.quiz.item_ids[i]
+
+    def current(self):
+        """ return the current question
+
+            Returns:
+                tuple of (question, answer, item_id)
+        """
+        return self.question(self.remaining[0])
+
+    def is_correct(self, user_answer):
+        """ return True if an answer to the current question is correct, honoring the quiz flags
+
+            Args:
+                user_answer - answer typed by the user
+        """
+        answer = self.current()[1]
+        if self.flags & model.FLAG_CASE_SENSITIVE:
+            return user_answer.strip() == answer.strip()
+        return user_answer.strip().lower() == answer.strip().lower()
+
+    def answer(self, correct):
+        """ record the answer to the current question
+
+            A correct answer removes the question, an incorrect answer moves it to the end of the
+            remaining questions
+
+            Args:
+                correct - True if the question was answered correctly
+
+            Returns:
+                True if the question had not been answered incorrectly before this answer
+        """
+        i = self.remaining.popleft()
+        bit = 1 << i
+        first_time = not (self.incorrect & bit)
+        if correct:
+            if first_time:
+                self.correct = self.correct + 1
+            else:
+                self.remedial = self.remedial - 1
+        else:
+            self.remaining.append(i)
+            if first_time:
+                self.wrong = self.wrong + 1
+                self.remedial = self.remedial + 1
+            self.incorrect = self.incorrect | bit
+            self.remedial = self.remedial + 1
+        return first_time
+
+    def skip(self):
+        """ move the current question to the end of the remaining questions """
+        self.skips_left = self.skips_left - 1
+        self.remaining.rotate(-1)
+
+    def checkpoint(self):
+        """ return the state of the session as a json serializable dictionary """
+        return {'quiz_uid': self.quiz_uid, 'quiz_id': self.quiz_id, 'version': self.quiz.version, 'user_id': self.user_id,
+                'quiz_flipped': self.quiz_flipped, 'quiz_type': self.quiz_type, 'remaining': list(self.remaining),
+                'incorrect': self.incorrect, 'correct': self.correct, 'wrong': self.wrong, 'remedial': self.remedial,
+                'skips_left': self.skips_left, 'start_time': self.start_time, 'client_seq': self.client_seq}
+
+    @classmethod
+    def restore(cls, checkpoint):
+        """ recreate a session from a checkpoint
+
+            Args:
+                checkpoint - dictionary returned by checkpoint()
+
+            Returns:
+                QuizSession
+
+            Throws QuizSessionStaleException if the quiz has been changed since the checkpoint
+        """
+        quiz = model.get_parsed_quiz(checkpoint['quiz_id'])
+        if quiz.version != checkpoint['version']:
+            raise QuizSessionStaleException(f'Quiz {checkpoint["quiz_id"]} has changed since the checkpoint')
+        session = cls(checkpoint['quiz_uid'], quiz, checkpoint['user_id'], checkpoint['quiz_flipped'], checkpoint['quiz_type'],
+                      checkpoint['remaining'], checkpoint['skips_left'])
+        session.incorrect = checkpoint['incorrect']
+        session.correct = checkpoint['correct']
+        session.wrong = checkpoint['wrong']
+        session.remedial = checkpoint['remedial']
+        session.start_time = checkpoint['start_time']
+        session.client_seq = checkpoint.get('client_seq', 0)
+        return session
+
+
+class QuizSessionManager:
+    """ thread safe registry of the quiz sessions being taken, keyed by quiz_uid
+
+        If a shared store is set, see set_store, a checkpoint of each session is written to the
+        store whenever it changes, so a session which is not in this process, i.e. because it was
+        started by another worker process, is restored from the store.  Sessions are still served
+        from memory when they are here, the balancer keeps a browser on the same worker.
+    """
+    def __init__(self, idle_timeout):
+        """ init
+
+            Args:
+                idle_timeout - sessions which have not been used for this many seconds are dropped
+        """
+        self._idle_timeout = idle_timeout
+        self._sessions = {}
+        self._store = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def start(self, quiz, user_id, quiz_flipped, quiz_type, item_ids, skips_left):
+        """ start a new quiz session with the questions in random order
+
+            Args:
+                quiz - ParsedQuiz to take
+                user_id - id of the user taking the quiz
+                quiz_flipped - True if this is a flipped quiz, false otherwise
+                quiz_type - '' for a full quiz, 'Mini' for a mini quiz
+                item_ids - QuizItem ids of the questions to ask, None to ask all questions
+                skips_left - number of times the user can skip a question
+
+            Returns:
+                QuizSession
+        """
+        if item_ids is None:
+            indexes = list(range(len(quiz.item_ids)))
+        else:
+            positions = {item_id: i for i, item_id in enumerate(quiz.item_ids)}
+            indexes = [positions[x] for x in item_ids if x in positions]
+        random.shuffle(indexes)
+
+        with self._lock:
+            self._expire()
+            quiz_uid = random.randint(0, sys.maxsize)
+            while quiz_uid in self._sessions:
+                quiz_uid = random.randint(0, sys.maxsize)
+            session = QuizSession(quiz_uid, quiz, user_id, quiz_flipped, quiz_type, indexes, skips_left)
+            self._sessions[quiz_uid] = session
+        self.save(session)
+        return session
+
+    def get(self, quiz_uid):
+        """ return a quiz session
+
+            Args:
+                quiz_uid - uid of the quiz session
+
+            Returns:
+                QuizSession
+
+            Throws QuizSessionNotFoundException if the session does not exist or has expired
+        """
+        with self._lock:
+            session = self._sessions.get(quiz_uid, None)
+            if session is not None:
+                session.last_access = time.monotonic()
+                return session
+
+        # the session may have been started by another process
+        checkpoint = None if (self._store is None or quiz_uid is None) else self._store.get(QUIZ_SESSION_KEY_PREFIX + str(quiz_uid))
+        if checkpoint is None:
+            raise QuizSessionNotFoundException(f'Quiz session {quiz_uid} not found')
+        try:
+            session = QuizSession.restore(checkpoint)
+        except (model.QuizNotFoundException, QuizSessionStaleException):
+            raise QuizSessionNotFoundException(f'Quiz session {quiz_uid} can not be restored')
+        with self._lock:
+            session = self._sessions.setdefault(quiz_uid, session)
+            session.last_access = time.monotonic()
+            return session
+
+    def end(self, quiz_uid):
+        """ remove a quiz session if it exists
+
+            Args:
+                quiz_uid - uid of the quiz session
+        """
+        with self._lock:
+            self._sessions.pop(quiz_uid, None)
+        if self._store is not None and quiz_uid is not None:
+            self._store.delete(QUIZ_SESSION_KEY_PREFIX + str(quiz_uid))
+
+    def save(self, session):
+        """ write a checkpoint of a session to the shared store, call after the session changes
+
+            Args:
+                session - QuizSession which changed
+        """
+        if self._store is not None:
+            self._store.set(QUIZ_SESSION_KEY_PREFIX + str(session.quiz_uid), session.checkpoint(), ttl=self._idle_timeout)
+
+    def set_store(self, store):
+        """ share the quiz sessions with other processes through a store
+
+            Args:
+                store - kvstore.SqliteKVStore, None to keep the sessions in this process only
+        """
+        self._store = store
+
+    def checkpoint(self):
+        """ return the state of all quiz sessions as a json serializable list """
+        with self._lock:
+            return [s.checkpoint() for s in self._sessions.values()]
+
+    def restore(self, checkpoints):
+        """ add the quiz sessions from checkpoints, sessions of quizzes which have changed are skipped
+
+            Args:
+                checkpoints - list returned by checkpoint()
+
+            Returns:
+                number of sessions restored
+        """
+        count = 0
+        for c in checkpoints:
+            try:
+                session = QuizSession.restore(c)
+            except (model.QuizNotFoundException, QuizSessionStaleException):
+                continue
+            with self._lock:
+                self._sessions[session.quiz_uid] = session
+            count = count + 1
+        return count
+
+    def _expire(self):
+        """ drop the sessions which have been idle for longer than idle_timeout, the lock must be held """
+        cutoff = time.monotonic() - self._idle_timeout
+        for quiz_uid in [k for k, v in self._sessions.items() if v.last_access < cutoff]:
+            del self._sessions[quiz_uid]
+
+
+# --------------------------------------------------
+#    Init
+# --------------------------------------------------
+quiz_sessions = QuizSessionManager(QUIZ_SESSION_IDLE_TIMEOUT)
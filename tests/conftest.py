@@ -0,0 +1,63 @@
+""" fixtures shared by the tests """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import pytest
+from sqlalchemy import event
+import model
+import model_migrations
+import model_stats
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class FakeJsc:
+    """ stand-in for a pylinkjs connection, records the javascript sent to the browser """
+    def __init__(self, user_auth_username='user@example.com', user_auth_method='DevAuth'):
+        self.user_auth_username = user_auth_username
+        self.user_auth_method = user_auth_method
+        self.tag = {}
+        self.js = []
+
+    def eval_js_code(self, js_code):
+        self.js.append(js_code)
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def clear_caches():
+    """ empty the in-process caches of the model """
+    model._user_id_cache.clear()
+    model._parsed_quiz_cache.clear()
+    model_stats._quiz_score_cache.clear()
+
+
+def enforce_foreign_keys(dbapi_connection, connection_record):
+    """ connect listener which makes SQLite enforce the foreign keys, as server databases do """
+    dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def db(tmp_path):
+    """ empty database with the current schema, which enforces the foreign keys """
+    clear_caches()
+    engine = model.init_db(path=str(tmp_path / 'test.db'))
+    event.listen(engine, 'connect', enforce_foreign_keys)
+    model_migrations.run_migrations()
+    yield engine
+    model_stats.stats_writer.flush()
+    model.Session.remove()
+    clear_caches()
+    engine.dispose()
+
+
+@pytest.fixture
+def jsc():
+    """ connection of user@example.com """
+    return FakeJsc()
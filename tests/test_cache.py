@@ -0,0 +1,92 @@
+""" tests of the in-process caches, see cache.LRUCache """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import pytest
+import cache
+from cache import LRUCache
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def invalidations():
+    """ list of the (cache name, key) invalidations made during the test """
+    calls = []
+    listener = lambda name, key: calls.append((name, key))
+    cache.add_invalidation_listener(listener)
+    yield calls
+    cache.remove_invalidation_listener(listener)
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_get_returns_missing_for_unknown_keys_and_caches_none():
+    c = LRUCache(2)
+    assert c.get('a') is LRUCache.MISSING
+
+    c.put('a', None)
+    assert c.get('a') is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    c = LRUCache(2)
+    c.put('a', 1)
+    c.put('b', 2)
+    c.get('a')
+    c.put('c', 3)
+
+    assert len(c) == 2
+    assert c.get('b') is LRUCache.MISSING
+    assert (c.get('a'), c.get('c')) == (1, 3)
+
+
+def test_put_replaces_and_refreshes_an_entry():
+    c = LRUCache(2)
+    c.put('a', 1)
+    c.put('b', 2)
+    c.put('a', 10)
+    c.put('c', 3)
+
+    assert c.get('a') == 10
+    assert c.get('b') is LRUCache.MISSING
+
+
+def test_invalidate_and_clear():
+    c = LRUCache(3)
+    c.put('a', 1)
+    c.put('b', 2)
+
+    c.invalidate('a')
+    c.invalidate('unknown')
+    assert c.get('a') is LRUCache.MISSING
+    assert c.get('b') == 2
+
+    c.clear()
+    assert len(c) == 0
+
+
+def test_named_cache_invalidations_are_passed_to_the_listeners(invalidations):
+    named = LRUCache(2, 'users')
+    named.put(('a', 'DevAuth'), 1)
+
+    named.invalidate(('a', 'DevAuth'))
+    named.invalidate('never cached')
+    LRUCache(2).invalidate('anonymous')
+
+    assert invalidations == [('users', ('a', 'DevAuth')), ('users', 'never cached')]
+
+
+def test_removed_listener_is_not_called(invalidations):
+    calls = []
+    listener = lambda name, key: calls.append(key)
+    cache.add_invalidation_listener(listener)
+    cache.remove_invalidation_listener(listener)
+
+    LRUCache(2, 'users').invalidate('a')
+
+    assert calls == []
+    assert invalidations == [('users', 'a')]
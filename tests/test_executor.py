@@ -0,0 +1,139 @@
+""" tests of the per connection ordering and the database executor, see executor """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import threading
+import time
+import pytest
+import executor
+import metrics
+import model
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def small_executor():
+    """ database executor of one worker, one pending call and a short timeout, a default one replaces it after the test """
+    yield executor.init_executor(max_workers=1, max_pending=1, timeout=0.2)
+    executor.init_executor()
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_handlers_of_a_connection_run_one_at_a_time_in_order():
+    order = executor.ConnectionOrder()
+    connection = object()
+    running = []
+    done = []
+
+    def handler(i):
+        with order.turn(connection):
+            running.append(i)
+            assert len(running) == 1
+            time.sleep(0.01)
+            done.append(i)
+            running.remove(i)
+
+    threads = []
+    for i in range(5):
+        threads.append(threading.Thread(target=handler, args=(i, )))
+        threads[-1].start()
+        # give the thread time to take its ticket, so the order of the calls is known
+        time.sleep(0.005)
+    for t in threads:
+        t.join()
+
+    assert done == [0, 1, 2, 3, 4]
+    assert len(order) == 0
+
+
+def test_handler_called_from_a_handler_keeps_the_turn():
+    order = executor.ConnectionOrder()
+    connection = object()
+    with order.turn(connection):
+        with order.turn(connection):
+            pass
+        assert len(order) == 1
+    assert len(order) == 0
+
+
+def test_connections_do_not_wait_for_each_other():
+    order = executor.ConnectionOrder()
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        with order.turn('slow'):
+            entered.set()
+            release.wait()
+
+    t = threading.Thread(target=slow)
+    t.start()
+    entered.wait()
+    start = time.monotonic()
+    with order.turn('fast'):
+        pass
+    assert time.monotonic() - start < 1
+    release.set()
+    t.join()
+
+
+def test_run_db_returns_the_result_with_a_session_of_its_own(db, small_executor):
+    user_id = model.create_user('User', 'user@example.com', 'DevAuth')
+    handler_session = model.Session()
+
+    assert executor.run_db(model.get_user_props, user_id)['display_name'] == 'User'
+    assert executor.run_db(lambda: model.Session() is not handler_session)
+    model.Session.remove()
+
+
+def test_run_db_counts_the_sql_in_the_calling_handler(db, small_executor):
+    metrics.instrument_engine(db)
+    user_id = model.create_user('User', 'user@example.com', 'DevAuth')
+
+    with metrics.record_handler('tests.run_db'):
+        executor.run_db(model.get_user_props, user_id)
+
+    assert metrics.handler_metrics.snapshot()['handlers']['tests.run_db']['sql_statements']['max'] >= 1
+
+
+def test_run_db_raises_the_exception_of_the_call(small_executor):
+    with pytest.raises(ZeroDivisionError):
+        executor.run_db(lambda: 1 / 0)
+
+
+def test_run_db_from_database_work_runs_directly(small_executor):
+    # with one worker, a nested call queued on the pool would wait for itself
+    assert executor.run_db(lambda: executor.run_db(lambda: threading.current_thread().name)).startswith('db')
+
+
+def test_run_db_times_out_and_skips_calls_which_have_not_started(small_executor):
+    release = threading.Event()
+    executor.init_executor(max_workers=1, max_pending=2, timeout=0.1)
+    blocker = executor.db_executor.submit(release.wait)
+    skipped = []
+
+    with pytest.raises(executor.DbWorkTimeoutException):
+        executor.run_db(skipped.append, 1)
+    release.set()
+    blocker.result()
+    executor.db_executor.shutdown(wait=True)
+
+    assert skipped == []
+    assert len(executor.db_executor) == 0
+
+
+def test_full_executor_refuses_new_calls(small_executor):
+    release = threading.Event()
+    blocker = executor.db_executor.submit(release.wait)
+
+    with pytest.raises(executor.ExecutorBusyException):
+        executor.run_db(lambda: None)
+
+    release.set()
+    blocker.result()
+    assert executor.run_db(lambda: 42) == 42
@@ -0,0 +1,91 @@
+""" tests of the store shared by the worker processes, see kvstore.SqliteKVStore """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import threading
+import time
+import pytest
+import kvstore
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def store(tmp_path):
+    s = kvstore.SqliteKVStore(str(tmp_path / 'kv.db'))
+    yield s
+    s.close()
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_set_get_delete(store):
+    assert store.get('a') is None
+
+    store.set('a', {'x': [1, 2]})
+    assert store.get('a') == {'x': [1, 2]}
+
+    store.set('a', 3)
+    assert store.get('a') == 3
+
+    store.delete('a')
+    store.delete('a')
+    assert store.get('a') is None
+
+
+def test_keys_expire_after_their_ttl(store, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(kvstore.time, 'time', lambda: now)
+    store.set('short', 1, ttl=10)
+    store.set('forever', 2)
+
+    monkeypatch.setattr(kvstore.time, 'time', lambda: now + 11)
+    assert store.get('short') is None
+    assert store.get('forever') == 2
+
+    store.purge(60)
+    monkeypatch.setattr(kvstore.time, 'time', lambda: now)
+    assert store.get('short') is None
+
+
+def test_poll_returns_the_messages_of_a_channel_after_an_event_id(store):
+    assert store.last_event_id() == 0
+    store.publish('a', {'n': 1})
+    store.publish('b', {'n': 2})
+    store.publish('a', {'n': 3})
+
+    events = store.poll('a', 0)
+    assert [m for _, m in events] == [{'n': 1}, {'n': 3}]
+    assert store.poll('a', events[0][0]) == events[1:]
+    assert store.poll('a', events[1][0]) == []
+    assert store.last_event_id() == events[1][0]
+
+
+def test_purge_drops_the_old_messages(store, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(kvstore.time, 'time', lambda: now - 100)
+    store.publish('a', 'old')
+    monkeypatch.setattr(kvstore.time, 'time', lambda: now)
+    store.publish('a', 'new')
+
+    store.purge(60)
+
+    assert [m for _, m in store.poll('a', 0)] == ['new']
+
+
+def test_other_connections_see_the_changes(store, tmp_path):
+    other = kvstore.SqliteKVStore(str(tmp_path / 'kv.db'))
+    store.set('a', 1)
+    store.publish('a', 'hello')
+
+    seen = {}
+    t = threading.Thread(target=lambda: seen.update(value=store.get('a'), events=store.poll('a', 0)))
+    t.start()
+    t.join()
+
+    assert seen['value'] == 1 and other.get('a') == 1
+    assert [m for _, m in seen['events']] == ['hello'] == [m for _, m in other.poll('a', 0)]
+    other.close()
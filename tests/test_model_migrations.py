@@ -0,0 +1,212 @@
+""" tests of the schema migrations, see model_migrations """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import sqlite3
+import pytest
+from sqlalchemy import inspect, text
+import model
+import model_migrations
+import model_stats
+from tests.conftest import clear_caches
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# schema of the first release, before the ALTER TABLEs which became migrations 1 and 2
+BASELINE_SCHEMA = """
+CREATE TABLE users (user_id INTEGER PRIMARY KEY, auth_username VARCHAR, auth_method VARCHAR);
+CREATE TABLE user_props (user_prop_id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (user_id), key VARCHAR, value VARCHAR);
+CREATE TABLE quiz (quiz_id INTEGER PRIMARY KEY, owner_user_id INTEGER REFERENCES users (user_id), data VARCHAR, name VARCHAR);
+CREATE TABLE quiz_stats (quiz_stat_id INTEGER PRIMARY KEY, quiz_id INTEGER REFERENCES quiz (quiz_id), user_id INTEGER REFERENCES users (user_id),
+                         time_created DATETIME DEFAULT (CURRENT_TIMESTAMP), time_updated DATETIME, stat_type VARCHAR, key VARCHAR, value VARCHAR);
+CREATE TABLE quiz_activity (quiz_activity_id INTEGER PRIMARY KEY, quiz_id INTEGER REFERENCES quiz (quiz_id), user_id INTEGER REFERENCES users (user_id),
+                            quiz_uid INTEGER, time_created DATETIME DEFAULT (CURRENT_TIMESTAMP), time_updated DATETIME, stat_type VARCHAR,
+                            key VARCHAR, value VARCHAR);
+INSERT INTO users VALUES (1, 'user@example.com', 'DevAuth');
+INSERT INTO user_props VALUES (1, 1, 'display_name', 'User');
+INSERT INTO quiz VALUES (1, 1, 'red|rot
+blue|blau
+green|gruen', 'Colors');
+INSERT INTO quiz_stats (quiz_id, user_id, time_created, stat_type, key, value) VALUES
+    (1, 1, '2024-01-01 10:00:00', 'QUIZ_QUESTION', 'red', '1'),
+    (1, 1, '2024-01-01 10:00:05', 'QUIZ_QUESTION', 'red', '0'),
+    (1, 1, '2024-01-01 10:00:10', 'QUIZ_QUESTION', 'blue', '1'),
+    (1, 1, '2024-01-01 10:01:00', 'QUIZ_SCORE', '', '2/3 60'),
+    (1, 1, '2024-01-01 10:02:00', 'QUIZ_SCORE', 'Mini', 'not a score');
+INSERT INTO quiz_activity (quiz_id, user_id, quiz_uid, time_created, stat_type, key, value) VALUES
+    (1, 1, 7, '2024-01-01 10:00:00', 'QUIZ_START', '', '0'),
+    (1, 1, 7, '2024-01-01 10:00:00', 'QUIZ_QUESTION_CORRECT', 'red', '0'),
+    (1, 1, 7, '2024-01-01 10:00:05', 'QUIZ_QUESTION_INCORRECT', 'red', '0'),
+    (1, 1, 7, '2024-01-01 10:00:10', 'QUIZ_QUESTION_CORRECT', 'blue', '0');
+"""
+# values of the first release which are not 0 or 1, and a score without an elapsed time
+LEGACY_VALUES = """
+INSERT INTO quiz_stats (quiz_id, user_id, time_created, stat_type, key, value) VALUES
+    (1, 1, '2024-01-02 10:00:00', 'QUIZ_QUESTION', 'green', 'True'),
+    (1, 1, '2024-01-02 10:00:05', 'QUIZ_QUESTION', 'green', NULL),
+    (1, 1, '2024-01-02 10:01:00', 'QUIZ_SCORE', 'Mini', '1/2'),
+    (1, 1, '2024-01-02 10:02:00', 'QUIZ_SCORE', '', '3/x 60');
+"""
+LATEST_VERSION = model_migrations.MIGRATIONS[-1][0]
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def baseline_db(tmp_path):
+    """ database of the first release with some history, migrated to the current schema """
+    yield from migrated_db(tmp_path, BASELINE_SCHEMA)
+
+
+@pytest.fixture
+def legacy_values_db(tmp_path):
+    """ baseline database with the legacy values of LEGACY_VALUES, migrated to the current schema """
+    yield from migrated_db(tmp_path, BASELINE_SCHEMA + LEGACY_VALUES)
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def migrated_db(tmp_path, script):
+    """ create a database from an sqlite script, yield its engine after migrating it and close it afterwards
+
+        Args:
+            tmp_path - directory of the database file
+            script - sql script which creates the database
+    """
+    path = str(tmp_path / 'baseline.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(script)
+    conn.close()
+
+    clear_caches()
+    engine = model.init_db(path=path)
+    yield engine
+    model_stats.stats_writer.flush()
+    model.Session.remove()
+    clear_caches()
+    engine.dispose()
+
+
+def columns(engine, table_name):
+    return [c['name'] for c in inspect(engine).get_columns(table_name)]
+
+
+def scalar(engine, sql):
+    with engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_new_database_is_created_at_the_latest_version(db):
+    with db.connect() as conn:
+        assert model_migrations.get_schema_version(conn) == LATEST_VERSION
+    assert model_migrations.run_migrations() == LATEST_VERSION
+    assert scalar(db, 'SELECT COUNT(*) FROM schema_version') == len(model_migrations.MIGRATIONS)
+
+
+def test_baseline_database_is_upgraded(baseline_db):
+    assert model_migrations.run_migrations() == LATEST_VERSION
+
+    assert {'flags', 'version'} <= set(columns(baseline_db, 'quiz'))
+    assert {'quiz_flipped', 'item_id', 'correct'} <= set(columns(baseline_db, 'quiz_stats'))
+    assert {'quiz_flipped', 'item_id'} <= set(columns(baseline_db, 'quiz_activity'))
+    with baseline_db.connect() as conn:
+        for index_name in ('ix_users_auth', 'ix_quiz_stats_item', 'ix_quiz_lower_name'):
+            assert model_migrations._index_exists(conn, None, index_name)
+        for index_name in ('ix_quiz_activity_user_time', 'ix_quiz_activity_time'):
+            assert not model_migrations._index_exists(conn, None, index_name)
+
+    # the guest user the stats of guests refer to
+    assert scalar(baseline_db, f'SELECT auth_method FROM users WHERE user_id = {model.GUEST_USER_ID}') == 'Guest'
+
+    # the quiz items and the item ids of the stats
+    quiz = model.get_parsed_quiz(1)
+    assert quiz.questions == (('red', 'rot'), ('blue', 'blau'), ('green', 'gruen'))
+    assert scalar(baseline_db, "SELECT COUNT(*) FROM quiz_stats WHERE item_id IS NULL") == 0
+    assert scalar(baseline_db, "SELECT COUNT(*) FROM quiz_activity WHERE item_id IS NULL AND key != ''") == 0
+
+
+def test_baseline_stats_keep_their_meaning(baseline_db):
+    model_migrations.run_migrations()
+
+    # the string values became booleans and the summaries were rebuilt from them
+    assert scalar(baseline_db, "SELECT COUNT(*) FROM quiz_stats WHERE stat_type = 'QUIZ_QUESTION' AND correct") == 2
+    stats = {s['question']: (s['correct'], s['total']) for s in model_stats.get_quiz_question_stats(1, 1, False)}
+    assert stats == {'red': (1, 2), 'blue': (1, 1)}
+
+    # the scores moved to quiz_scores, the one which can not be parsed is dropped
+    assert scalar(baseline_db, "SELECT COUNT(*) FROM quiz_stats WHERE stat_type = 'QUIZ_SCORE'") == 0
+    scores = model_stats.get_quiz_scores(1)
+    assert [(s['name'], s['quiz_type'], s['correct'], s['total']) for s in scores] == [('Colors', '', 2, 3)]
+
+    # the activity rollups and the review schedules
+    assert scalar(baseline_db, 'SELECT SUM(answers) FROM quiz_activity_minutes') == 3
+    assert scalar(baseline_db, 'SELECT COUNT(*) FROM item_schedules') == 2
+
+
+def test_released_migration_creates_the_indexes_a_later_one_drops(db):
+    # migration 3 is left as released, so every database creates the quiz_activity indexes before migration 13 drops them
+    migrate = next(m for version, _, m, _ in model_migrations.MIGRATIONS if version == 3)
+    with db.begin() as conn:
+        migrate(conn)
+        assert all(model_migrations._index_exists(conn, None, name) for name in model_migrations.RETIRED_INDEXES)
+        migrate(conn)
+        next(m for version, _, m, _ in model_migrations.MIGRATIONS if version == 13)(conn)
+        assert not any(model_migrations._index_exists(conn, None, name) for name in model_migrations.RETIRED_INDEXES)
+
+
+def test_migrations_run_once(baseline_db):
+    model_migrations.run_migrations()
+    before = scalar(baseline_db, 'SELECT COUNT(*) FROM quiz_items'), scalar(baseline_db, 'SELECT COUNT(*) FROM quiz_scores')
+
+    assert model_migrations.run_migrations() == LATEST_VERSION
+
+    after = scalar(baseline_db, 'SELECT COUNT(*) FROM quiz_items'), scalar(baseline_db, 'SELECT COUNT(*) FROM quiz_scores')
+    assert after == before == (3, 1)
+    assert scalar(baseline_db, 'SELECT COUNT(*) FROM schema_version') == len(model_migrations.MIGRATIONS)
+
+
+def test_quiz_activity_indexes_are_dropped(db):
+    # a database at version 12 still has the indexes created by migration 3
+    with db.begin() as conn:
+        conn.execute(text('CREATE INDEX ix_quiz_activity_user_time ON quiz_activity (user_id, time_created)'))
+        conn.execute(text('CREATE INDEX ix_quiz_activity_time ON quiz_activity (time_created)'))
+        conn.execute(text('DELETE FROM schema_version WHERE version > 12'))
+
+    assert model_migrations.run_migrations() == LATEST_VERSION
+
+    with db.connect() as conn:
+        assert not model_migrations._index_exists(conn, 'quiz_activity', 'ix_quiz_activity_user_time')
+        assert not model_migrations._index_exists(conn, 'quiz_activity', 'ix_quiz_activity_time')
+
+
+def test_question_values_become_correct(legacy_values_db):
+    model_migrations.run_migrations()
+
+    assert 'value' not in columns(legacy_values_db, 'quiz_stats')
+    with legacy_values_db.connect() as conn:
+        rows = conn.execute(text("SELECT key, time_created, correct FROM quiz_stats WHERE stat_type = 'QUIZ_QUESTION' "
+                                 "ORDER BY time_created")).fetchall()
+
+    # only '1' was a correct answer
+    assert [(r.key, bool(r.correct)) for r in rows] == [('red', True), ('red', False), ('blue', True), ('green', False), ('green', False)]
+
+
+def test_score_values_become_quiz_scores(legacy_values_db):
+    model_migrations.run_migrations()
+
+    assert scalar(legacy_values_db, "SELECT COUNT(*) FROM quiz_stats WHERE stat_type = 'QUIZ_SCORE'") == 0
+    with legacy_values_db.connect() as conn:
+        rows = conn.execute(text('SELECT quiz_id, user_id, quiz_type, quiz_flipped, correct, total, elapsed_time, time_created '
+                                 'FROM quiz_scores ORDER BY time_created')).fetchall()
+
+    # '3/x 60' and 'not a score' can not be parsed and are dropped
+    assert [tuple(r) for r in rows] == [(1, 1, '', 0, 2, 3, 60, '2024-01-01 10:01:00.000000'),
+                                        (1, 1, 'Mini', 0, 1, 2, None, '2024-01-02 10:01:00.000000')]
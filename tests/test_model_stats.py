@@ -0,0 +1,544 @@
+""" tests of the stats, see model_stats """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import datetime
+import random
+import threading
+import time
+import types
+import pytest
+from sqlalchemy import event, text
+import model
+import model_stats
+from cache import LRUCache
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def quiz(db):
+    """ (quiz_id, user_id) of a quiz owned by a new user """
+    user_id = model.create_user('User', 'user@example.com', 'DevAuth')
+    return model.set_quiz(None, user_id, 'Colors', 'red|rot\nblue|blau', 0), user_id
+
+
+@pytest.fixture
+def letters(db):
+    """ (quiz_id, user_id) of a quiz of the questions a, b, c and d owned by a new user """
+    user_id = model.create_user('User', 'user@example.com', 'DevAuth')
+    return model.set_quiz(None, user_id, 'Letters', 'a|1\nb|2\nc|3\nd|4', 0), user_id
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def activity_row(quiz, key):
+    quiz_id, user_id = quiz
+    return dict(quiz_id=quiz_id, user_id=user_id, quiz_uid=1, item_id=None, key=key, value=0,
+                stat_type=model_stats.ActivityId.QUIZ_QUESTION_CORRECT.value, quiz_flipped=False, time_created=model_stats._utcnow())
+
+
+def written_keys():
+    keys = sorted(r.key for r in model.Session().query(model_stats.QuizActivity.key).filter(model_stats.QuizActivity.quiz_uid == 1))
+    model.Session.remove()
+    return keys
+
+
+def item_ids(quiz):
+    """ return the QuizItem id of each question of a quiz by question """
+    parsed_quiz = model.get_parsed_quiz(quiz[0])
+    return {q: item_id for (q, a), item_id in zip(parsed_quiz.questions, parsed_quiz.item_ids)}
+
+
+def answer_at(quiz, question, correct, time_created, quiz_flipped=False):
+    """ queue the result of a question answered at time_created """
+    quiz_id, user_id = quiz
+    model_stats.add_quiz_question_stat(quiz_id, user_id, question, correct, quiz_flipped, item_ids(quiz)[question], time_created=time_created)
+
+
+def answer(quiz, question, correct, seconds, quiz_flipped=False):
+    """ queue the result of a question answered seconds after 2024-01-01 10:00 """
+    answer_at(quiz, question, correct, datetime.datetime(2024, 1, 1, 10) + datetime.timedelta(seconds=seconds), quiz_flipped)
+
+
+def summaries():
+    """ return the QuizQuestionSummary rows as tuples, ordered by item """
+    rows = model.Session().query(model_stats.QuizQuestionSummary).order_by(model_stats.QuizQuestionSummary.item_id,
+                                                                          model_stats.QuizQuestionSummary.quiz_flipped)
+    retval = [(s.item_id, bool(s.quiz_flipped), s.recent_results, s.recent_count, s.correct_count, s.total_count, s.time_last_seen) for s in rows]
+    model.Session.remove()
+    return retval
+
+
+def activity(quiz, quiz_uid, activity_id, time_created, user_id=None):
+    """ queue an activity row of a quiz session """
+    quiz_id, owner_user_id = quiz
+    model_stats.add_quiz_activity_stat(quiz_id, owner_user_id if user_id is None else user_id, quiz_uid, '', activity_id, False,
+                                       time_created=time_created)
+
+
+def rollups():
+    """ return the QuizActivityMinute and QuizActivitySession rows as sorted tuples """
+    session = model.Session()
+    minutes = sorted((m.user_id, m.minute, m.answers) for m in session.query(model_stats.QuizActivityMinute))
+    sessions = sorted((s.quiz_uid, s.user_id, s.quiz_id, bool(s.is_mini), s.time_start, s.time_end, s.time_gap)
+                      for s in session.query(model_stats.QuizActivitySession))
+    model.Session.remove()
+    return minutes, sessions
+
+
+def fail_on_key(monkeypatch, bad_key, failures=None):
+    """ make writing a batch with a row of bad_key fail, every time or the first failures times """
+    update_activity_rollups = model_stats._update_activity_rollups
+    calls = {'failed': 0}
+
+    def failing(session, rows):
+        if any(r['key'] == bad_key for r in rows) and (failures is None or calls['failed'] < failures):
+            calls['failed'] = calls['failed'] + 1
+            raise RuntimeError('write failed')
+        return update_activity_rollups(session, rows)
+    monkeypatch.setattr(model_stats, '_update_activity_rollups', failing)
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_flush_writes_the_queued_rows(quiz):
+    writer = model_stats.StatsWriter(100, 60)
+    writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'a'))
+    writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'b'))
+    generation = writer.generation
+
+    writer.flush()
+
+    assert written_keys() == ['a', 'b']
+    assert len(writer) == 0
+    assert writer.generation == generation + 2
+
+
+def test_failed_flush_requeues_the_batch(quiz, monkeypatch):
+    fail_on_key(monkeypatch, 'a', failures=1)
+    writer = model_stats.StatsWriter(100, 60)
+    writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'a'))
+
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert written_keys() == []
+    assert [r.key for r in writer.snapshot(model_stats.QuizActivity)[1]] == ['a']
+
+    writer.flush()
+    assert written_keys() == ['a']
+    assert writer.dropped == 0
+
+
+def test_batch_failing_max_attempts_times_drops_only_the_bad_rows(quiz, monkeypatch):
+    fail_on_key(monkeypatch, 'bad')
+    writer = model_stats.StatsWriter(100, 60, max_attempts=2)
+    for key in ('a', 'bad', 'b'):
+        writer.enqueue(model_stats.QuizActivity, activity_row(quiz, key))
+
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    writer.flush()
+
+    assert written_keys() == ['a', 'b']
+    assert writer.dropped == 1
+    assert writer.snapshot(model_stats.QuizActivity)[1] == []
+
+
+def test_full_queue_is_written_by_the_caller(quiz):
+    writer = model_stats.StatsWriter(100, 60, max_queue=2)
+    assert writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'a'))
+    assert writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'b'))
+
+    # no writer thread runs, the row which finds the queue full writes it
+    assert writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'c'))
+
+    assert written_keys() == ['a', 'b']
+    assert [r.key for r in writer.snapshot(model_stats.QuizActivity)[1]] == ['c']
+    assert (writer.overflows, writer.dropped) == (1, 0)
+
+
+def test_full_queue_which_can_not_be_written_drops_the_row(quiz, monkeypatch):
+    fail_on_key(monkeypatch, 'a')
+    writer = model_stats.StatsWriter(100, 60, max_queue=2)
+    writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'a'))
+    writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'b'))
+
+    start = time.monotonic()
+    assert not writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'c'))
+
+    # the queued rows are kept for the next write, only the new row is dropped
+    assert time.monotonic() - start < 1
+    assert [r.key for r in writer.snapshot(model_stats.QuizActivity)[1]] == ['a', 'b']
+    assert (writer.overflows, writer.dropped) == (1, 1)
+
+
+def test_read_during_a_flush_counts_the_batch_once(quiz, monkeypatch):
+    writer = model_stats.StatsWriter(100, 60)
+    monkeypatch.setattr(model_stats, 'stats_writer', writer)
+    writer.enqueue(model_stats.QuizActivity, activity_row(quiz, 'a'))
+
+    # hold the flush between the commit of the batch and the end of the write
+    write = writer._write
+    committed = threading.Event()
+
+    def slow_write(batch):
+        write(batch)
+        committed.set()
+        time.sleep(0.2)
+    monkeypatch.setattr(writer, '_write', slow_write)
+
+    results = []
+
+    def reader():
+        committed.wait(5)
+        rows, pending = model_stats._read_with_pending(model_stats.QuizActivity, written_keys)
+        results.append(rows + [r.key for r in pending])
+    thread = threading.Thread(target=reader)
+    thread.start()
+    writer.flush()
+    thread.join()
+
+    assert results == [['a']]
+
+
+def test_failed_durable_flush_leaves_the_rows_queued(quiz, monkeypatch):
+    quiz_id, user_id = quiz
+    writer = model_stats.StatsWriter(100, 60)
+    monkeypatch.setattr(model_stats, 'stats_writer', writer)
+    fail_on_key(monkeypatch, '', failures=1)
+
+    model_stats.add_quiz_activity_stat(quiz_id, user_id, 1, '', model_stats.ActivityId.QUIZ_END, False)
+    assert written_keys() == []
+    assert len(writer) == 1
+
+    model_stats.add_quiz_score(quiz_id, user_id, '', 1, 2, 60, False)
+
+    assert written_keys() == ['']
+    assert [s['correct'] for s in model_stats.get_quiz_scores(user_id)] == [1]
+    assert writer.dropped == 0
+
+
+def test_summary_keeps_the_newest_results_in_the_low_bits(quiz):
+    for i, correct in enumerate([True, False, True, True, False, False, True]):
+        answer(quiz, 'red', correct, i)
+    model_stats.stats_writer.flush()
+
+    # the last 5 results, oldest first, are True, True, False, False, True
+    item_id, _, recent_results, recent_count, correct_count, total_count, time_last_seen = summaries()[0]
+    assert (recent_results, recent_count, correct_count, total_count) == (0b11001, 5, 4, 7)
+    assert time_last_seen == datetime.datetime(2024, 1, 1, 10, 0, 6)
+    stats = model_stats.get_quiz_question_stats(quiz[0], quiz[1], False)
+    assert stats == [{'question': 'red', 'item_id': item_id, 'correct': 3, 'total': 5, 'percentage': 60}]
+
+
+def test_queued_results_are_merged_into_the_summary(quiz):
+    answer(quiz, 'blue', False, 0)
+    model_stats.stats_writer.flush()
+    answer(quiz, 'blue', True, 1)
+    answer(quiz, 'red', True, 2)
+
+    stats = {s['question']: (s['correct'], s['total']) for s in model_stats.get_quiz_question_stats(quiz[0], quiz[1], False)}
+
+    assert stats == {'blue': (1, 2), 'red': (1, 1)}
+    assert model_stats.get_quiz_question_stats(quiz[0], quiz[1], True) == []
+
+
+def test_summaries_match_a_rebuild_from_the_stats(quiz):
+    results = [('red', True), ('blue', False), ('red', False), ('red', True), ('blue', True), ('red', True), ('red', True),
+               ('red', False), ('blue', True)]
+    for i, (question, correct) in enumerate(results):
+        answer(quiz, question, correct, i, quiz_flipped=i % 3 == 0)
+        if i % 4 == 0:
+            model_stats.stats_writer.flush()
+    model_stats.stats_writer.flush()
+    incremental = summaries()
+
+    assert model_stats.rebuild_quiz_question_summaries() == len(incremental)
+    assert summaries() == incremental
+
+
+def test_activity_rollups_match_a_rebuild_from_the_activity(quiz):
+    other_user_id = model.create_user('Other', 'other@example.com', 'DevAuth')
+    start = datetime.datetime(2024, 1, 1, 10)
+    ActivityId = model_stats.ActivityId
+    events = [(1, ActivityId.QUIZ_START, 0, None), (1, ActivityId.QUIZ_QUESTION_CORRECT, 10, None),
+              (2, ActivityId.QUIZ_START_MINI, 20, other_user_id), (1, ActivityId.QUIZ_QUESTION_INCORRECT, 50, None),
+              (2, ActivityId.QUIZ_QUESTION_CORRECT, 70, other_user_id), (1, ActivityId.QUIZ_QUESTION_CORRECT, 65, None),
+              (1, ActivityId.QUIZ_QUESTION_CORRECT, 600, None), (1, ActivityId.QUIZ_END, 610, None)]
+    for i, (quiz_uid, activity_id, seconds, user_id) in enumerate(events):
+        activity(quiz, quiz_uid, activity_id, start + datetime.timedelta(seconds=seconds), user_id)
+        if i % 3 == 2:
+            model_stats.stats_writer.flush()
+    model_stats.stats_writer.flush()
+    minutes, sessions = rollups()
+
+    # the long break of session 1 is recorded as its gap
+    quiz_id, user_id = quiz
+    assert minutes == sorted([(user_id, start, 2), (user_id, start + datetime.timedelta(minutes=1), 1),
+                              (user_id, start + datetime.timedelta(minutes=10), 1), (other_user_id, start + datetime.timedelta(minutes=1), 1)])
+    assert sessions == [(1, user_id, quiz_id, False, start, start + datetime.timedelta(minutes=10), start + datetime.timedelta(minutes=1)),
+                        (2, other_user_id, quiz_id, True, start, start + datetime.timedelta(minutes=1), None)]
+
+    assert model_stats.rebuild_activity_rollups() == 2
+    assert rollups() == (minutes, sessions)
+
+
+def test_user_activity_counts_stored_and_queued_answers(quiz):
+    now = model_stats._utcnow()
+    five_minutes_ago = model_stats._truncate_minute(now - datetime.timedelta(minutes=5))
+    activity(quiz, 1, model_stats.ActivityId.QUIZ_QUESTION_CORRECT, now - datetime.timedelta(hours=13))
+    activity(quiz, 2, model_stats.ActivityId.QUIZ_START, five_minutes_ago)
+    activity(quiz, 2, model_stats.ActivityId.QUIZ_QUESTION_CORRECT, five_minutes_ago)
+    model_stats.stats_writer.flush()
+    activity(quiz, 2, model_stats.ActivityId.QUIZ_QUESTION_INCORRECT, five_minutes_ago)
+    activity(quiz, 2, model_stats.ActivityId.QUIZ_QUESTION_CORRECT, five_minutes_ago + model_stats.ONE_MINUTE)
+
+    start, answers, quiz_info = model_stats.get_user_activity(quiz[1])
+
+    # the answer and the session older than the chart are left out
+    assert answers.sum() == 3
+    assert answers[(five_minutes_ago - start) // model_stats.ONE_MINUTE] == 2
+    assert quiz_info == [[five_minutes_ago, five_minutes_ago + model_stats.ONE_MINUTE, 'Colors', 'GOOD']]
+
+
+def test_user_activity_leaves_out_deleted_quizzes(quiz):
+    other = (model.set_quiz(None, quiz[1], 'Other', 'a|1', 0), quiz[1])
+    five_minutes_ago = model_stats._truncate_minute(model_stats._utcnow() - datetime.timedelta(minutes=5))
+    for q, quiz_uid in ((quiz, 1), (other, 2)):
+        activity(q, quiz_uid, model_stats.ActivityId.QUIZ_START, five_minutes_ago)
+        activity(q, quiz_uid, model_stats.ActivityId.QUIZ_QUESTION_CORRECT, five_minutes_ago)
+    model_stats.stats_writer.flush()
+    assert model_stats.get_user_activity(quiz[1])[1].sum() == 2
+
+    model.delete_quiz(other[0])
+
+    start, answers, quiz_info = model_stats.get_user_activity(quiz[1])
+    assert answers.sum() == 1
+    assert answers[(five_minutes_ago - start) // model_stats.ONE_MINUTE] == 1
+    assert [x[2] for x in quiz_info] == ['Colors']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_user_activity_minutes_match_a_count_of_the_raw_activity(quiz, seed):
+    rnd = random.Random(seed)
+    other_user_id = model.create_user('Other', 'other@example.com', 'DevAuth')
+    now = model_stats._utcnow()
+    edge = now - datetime.timedelta(hours=model_stats.ACTIVITY_HOURS)
+    answer_types = (model_stats.ActivityId.QUIZ_QUESTION_CORRECT, model_stats.ActivityId.QUIZ_QUESTION_INCORRECT)
+    rows = []
+    session_ends = {}
+
+    # sessions straddling the start of the chart, sessions inside it and sessions of another user, with several answers in some minutes
+    for quiz_uid in range(1, 13):
+        user_id = other_user_id if quiz_uid % 4 == 0 else quiz[1]
+        t = edge - datetime.timedelta(minutes=rnd.randint(1, 5)) if quiz_uid % 3 == 0 else now - datetime.timedelta(minutes=rnd.randint(10, 700))
+        activity(quiz, quiz_uid, model_stats.ActivityId.QUIZ_START, t, user_id=user_id)
+        rows.append((user_id, t, model_stats.ActivityId.QUIZ_START))
+        for _ in range(rnd.randint(1, 12)):
+            t = min(t + datetime.timedelta(seconds=rnd.choice([0, 5, 20, 61, 400])), now)
+            activity_id = rnd.choice(answer_types)
+            activity(quiz, quiz_uid, activity_id, t, user_id=user_id)
+            rows.append((user_id, t, activity_id))
+        session_ends[quiz_uid] = (user_id, t)
+        if rnd.random() < 0.7:
+            model_stats.stats_writer.flush()
+
+    for user_id in (quiz[1], None):
+        start, answers, quiz_info = model_stats.get_user_activity(user_id)
+
+        expected = [0] * len(answers)
+        for row_user_id, t, activity_id in rows:
+            offset = (model_stats._truncate_minute(t) - start) // model_stats.ONE_MINUTE
+            if activity_id in answer_types and user_id in (None, row_user_id) and 0 <= offset < len(expected):
+                expected[offset] = expected[offset] + 1
+        assert answers.tolist() == expected
+        assert len(answers) == model_stats.ACTIVITY_HOURS * 60 + 1
+
+        # the sessions which end in the chart, those straddling the start of the chart are clipped to it
+        quiz_uids = [uid for uid, (u, t) in session_ends.items() if user_id in (None, u) and model_stats._truncate_minute(t) >= start]
+        assert len([x for x in quiz_info if x[3] == 'GOOD']) == len(quiz_uids)
+        assert all(x[0] >= start for x in quiz_info)
+
+
+def test_schedule_follows_sm2_with_pass_fail_grades():
+    schedule = model_stats._new_item_schedule(types.SimpleNamespace, 1, 1, False, 1)
+    t = datetime.datetime(2024, 1, 1)
+    day = datetime.timedelta(days=1).total_seconds()
+    steps = []
+    for correct in [True, True, True, False, False, True]:
+        model_stats._apply_schedule_result(schedule, correct, t)
+        steps.append((schedule.repetitions, schedule.interval_seconds, round(schedule.ease, 2), schedule.lapses))
+
+    # only the first miss after a run of correct answers lowers the ease
+    assert steps == [(1, day, 2.5, 0), (2, 6 * day, 2.5, 0), (3, 15 * day, 2.5, 0), (0, 600, 2.3, 1), (0, 600, 2.3, 1), (1, day, 2.3, 1)]
+    assert schedule.time_due == t + datetime.timedelta(days=1)
+
+
+def test_schedule_ease_does_not_drop_below_the_minimum():
+    schedule = model_stats._new_item_schedule(types.SimpleNamespace, 1, 1, False, 1)
+    for _ in range(10):
+        model_stats._apply_schedule_result(schedule, True, datetime.datetime(2024, 1, 1))
+        model_stats._apply_schedule_result(schedule, False, datetime.datetime(2024, 1, 1))
+
+    assert schedule.ease == model_stats.SCHEDULE_MIN_EASE
+    assert schedule.lapses == 10
+
+
+def test_due_items_are_overdue_then_unseen_then_upcoming(letters):
+    now = model_stats._utcnow()
+    ids = item_ids(letters)
+    answer_at(letters, 'a', True, now - datetime.timedelta(days=2))
+    answer_at(letters, 'b', True, now - datetime.timedelta(days=3))
+    model_stats.stats_writer.flush()
+
+    # the queued miss of d brings it back in SCHEDULE_RELEARN_INTERVAL
+    answer_at(letters, 'd', False, now)
+
+    assert model_stats.get_due_items(letters[0], letters[1], False, 4) == [ids['b'], ids['a'], ids['c'], ids['d']]
+    assert model_stats.get_due_items(letters[0], letters[1], False, 2) == [ids['b'], ids['a']]
+    assert model_stats.get_due_items(letters[0], letters[1], True, 4) == [ids['a'], ids['b'], ids['c'], ids['d']]
+
+
+def test_due_items_skip_questions_removed_from_the_quiz(letters):
+    now = model_stats._utcnow()
+    ids = item_ids(letters)
+    answer_at(letters, 'a', True, now - datetime.timedelta(days=2))
+    answer_at(letters, 'b', False, now - datetime.timedelta(days=1))
+    model_stats.stats_writer.flush()
+
+    model.set_quiz(letters[0], None, None, 'b|2\nc|3', None)
+
+    assert model_stats.get_due_items(letters[0], letters[1], False, 4) == [ids['b'], ids['c']]
+
+
+def test_schedules_match_a_rebuild_from_the_stats(letters):
+    start = datetime.datetime(2024, 1, 1)
+    for i, (question, correct) in enumerate([('a', True), ('b', False), ('a', True), ('a', False), ('b', True), ('a', True)]):
+        answer_at(letters, question, correct, start + datetime.timedelta(days=i))
+        if i % 2:
+            model_stats.stats_writer.flush()
+
+    def schedules():
+        rows = sorted((s.item_id, s.ease, s.interval_seconds, s.repetitions, s.lapses, s.time_last_seen, s.time_due)
+                      for s in model.Session().query(model_stats.ItemSchedule))
+        model.Session.remove()
+        return rows
+    incremental = schedules()
+
+    assert model_stats.rebuild_item_schedules() == 2
+    assert schedules() == incremental
+
+
+def test_stats_of_guests_satisfy_the_foreign_keys(quiz):
+    quiz_id, _ = quiz
+    item_id = model.get_parsed_quiz(quiz_id).item_ids[0]
+    with model.engine.connect() as conn:
+        assert conn.execute(text('PRAGMA foreign_keys')).scalar() == 1
+
+    model_stats.add_quiz_activity_stat(quiz_id, None, 1, 'red', model_stats.ActivityId.QUIZ_QUESTION_CORRECT, False, item_id=item_id)
+    model_stats.add_quiz_question_stat(quiz_id, None, 'red', True, False, item_id)
+    model_stats.add_quiz_activity_stat(quiz_id, None, 1, '', model_stats.ActivityId.QUIZ_END, False)
+    model_stats.add_quiz_score(quiz_id, None, '', 1, 1, 30, False)
+
+    assert len(model_stats.stats_writer) == 0
+    assert model_stats.stats_writer.dropped == 0
+    assert [s['correct'] for s in model_stats.get_quiz_scores(None)] == [1]
+    assert [s['total'] for s in model_stats.get_quiz_question_stats(quiz_id, None, False)] == [1]
+    assert model.get_user_id(None, None) is None
+
+
+def test_delete_quiz_deletes_its_stats_and_activity(quiz):
+    quiz_id, user_id = quiz
+    other_quiz_id = model.set_quiz(None, user_id, 'Other', 'a|1', 0)
+    start = datetime.datetime(2024, 1, 1, 10)
+    for q in (quiz_id, other_quiz_id):
+        item_id = model.get_parsed_quiz(q).item_ids[0]
+        model_stats.add_quiz_activity_stat(q, user_id, q, '', model_stats.ActivityId.QUIZ_START, False, time_created=start)
+        model_stats.add_quiz_activity_stat(q, user_id, q, 'x', model_stats.ActivityId.QUIZ_QUESTION_CORRECT, False, item_id=item_id, time_created=start)
+        model_stats.add_quiz_question_stat(q, user_id, 'x', True, False, item_id, time_created=start)
+        model_stats.add_quiz_score(q, user_id, '', 1, 1, 30, False)
+    model_stats.add_quiz_question_stat(quiz_id, user_id, 'red', False, False, model.get_parsed_quiz(quiz_id).item_ids[1], time_created=start)
+    minutes = rollups()[0]
+
+    model.delete_quiz(quiz_id)
+
+    session = model.Session()
+    for orm_class in (model_stats.QuizStat, model_stats.QuizScore, model_stats.QuizQuestionSummary, model_stats.ItemSchedule):
+        assert [r.quiz_id for r in session.query(orm_class)] == [other_quiz_id]
+    assert sorted((r.quiz_uid, r.quiz_id) for r in session.query(model_stats.QuizActivity)) == [(other_quiz_id, other_quiz_id)] * 2
+    assert session.query(model.QuizItem).filter(model.QuizItem.quiz_id == quiz_id).count() == 0
+    model.Session.remove()
+    assert [s['name'] for s in model_stats.get_quiz_scores(user_id)] == ['Other']
+
+    # the activity chart no longer counts the answers of the deleted quiz, the rollups match a rebuild
+    after = rollups()
+    assert minutes == [(user_id, start, 2)]
+    assert after[0] == [(user_id, start, 1)]
+    assert [(s[0], s[2]) for s in after[1]] == [(other_quiz_id, other_quiz_id)]
+    model_stats.rebuild_activity_rollups()
+    assert rollups() == after
+
+
+def test_score_feed_is_cached_until_a_score_is_added(quiz):
+    quiz_id, user_id = quiz
+    model_stats.add_quiz_score(quiz_id, user_id, '', 1, 2, 60, False)
+    assert [s['correct'] for s in model_stats.get_quiz_scores(user_id)] == [1]
+
+    # a score written behind the back of the model is not seen until the feed is invalidated
+    with model.engine.begin() as conn:
+        conn.execute(model_stats.QuizScore.__table__.insert().values(quiz_id=quiz_id, user_id=user_id, quiz_type='', quiz_flipped=False,
+                                                                      correct=0, total=2, time_created=model_stats._utcnow()))
+    assert [s['correct'] for s in model_stats.get_quiz_scores(user_id)] == [1]
+
+    model_stats.add_quiz_score(quiz_id, user_id, 'Mini', 2, 2, 30, True)
+    scores = model_stats.get_quiz_scores(user_id)
+    assert [(s['quiz_type'], s['quiz_flipped'], s['correct'], s['percentage']) for s in scores] == [('Mini', 'Flipped', 2, 100), ('', '', 0, 0),
+                                                                                                    ('', '', 1, 50)]
+    assert scores[0]['elapsed_time'] == '1 min'
+
+
+def test_score_feed_shows_the_current_quiz_names(quiz):
+    quiz_id, user_id = quiz
+    other_quiz_id = model.set_quiz(None, user_id, 'Other', 'a|1', 0)
+    model_stats.add_quiz_score(quiz_id, user_id, '', 1, 2, 60, False)
+    model_stats.add_quiz_score(other_quiz_id, user_id, '', 1, 1, 60, False)
+    model_stats.get_quiz_scores(user_id)
+
+    model.set_quiz(quiz_id, None, 'Farben', None, None)
+    assert [s['name'] for s in model_stats.get_quiz_scores(user_id)] == ['Other', 'Farben']
+
+    model.delete_quiz(other_quiz_id)
+    assert [s['name'] for s in model_stats.get_quiz_scores(user_id)] == ['Farben']
+
+
+def test_score_feed_holds_the_newest_scores(quiz):
+    quiz_id, user_id = quiz
+    for i in range(model_stats.QUIZ_SCORE_FEED_LEN + 2):
+        model_stats.add_quiz_score(quiz_id, user_id, '', i, 20, 60, False)
+
+    scores = model_stats.get_quiz_scores(user_id)
+
+    assert [s['correct'] for s in scores] == list(range(model_stats.QUIZ_SCORE_FEED_LEN + 1, 1, -1))
+
+
+def test_score_feed_read_before_an_invalidation_is_not_cached(quiz):
+    quiz_id, user_id = quiz
+
+    # a score is added while the feed is being read
+    def add_score(conn, cursor, statement, parameters, context, executemany):
+        if 'quiz_scores' in statement:
+            model_stats.invalidate_quiz_scores(user_id)
+    event.listen(model.engine, 'before_cursor_execute', add_score)
+    try:
+        assert model_stats.get_quiz_scores(user_id) == []
+    finally:
+        event.remove(model.engine, 'before_cursor_execute', add_score)
+
+    assert model_stats._quiz_score_cache.get(user_id) is LRUCache.MISSING
+    model_stats.get_quiz_scores(user_id)
+    assert model_stats._quiz_score_cache.get(user_id) == ()
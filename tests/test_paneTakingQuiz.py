@@ -0,0 +1,201 @@
+""" tests of the answers graded in the browser, see paneTakingQuiz.record_answers """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import datetime
+import threading
+import time
+import pytest
+from sqlalchemy import event
+import model
+import model_stats
+import paneTakingQuiz
+from quiz_session import QuizSessionNotFoundException, quiz_sessions
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def quiz_session(db, jsc):
+    """ quiz session of three questions started on jsc """
+    user_id = model.create_user('User', jsc.user_auth_username, jsc.user_auth_method)
+    quiz_id = model.set_quiz(None, user_id, 'Colors', 'red|rot\nblue|blau\ngreen|gruen', 0)
+    session = quiz_sessions.start(model.get_parsed_quiz(quiz_id), user_id, False, '', None, 1)
+    jsc.tag['QUIZ_UID'] = session.quiz_uid
+    yield session
+    quiz_sessions.end(session.quiz_uid)
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def record_answers(jsc, quiz_session, events):
+    """ call the handler with the ui state pushed by the browser """
+    ctx = {'__ctx__': True, 'quiz_id': quiz_session.quiz_id, 'quiz_flipped': False, 'client_grading': True}
+    paneTakingQuiz.record_answers(jsc, ctx, events)
+
+
+def answer_event(quiz_session, seq, correct=True, age_ms=0, position=0):
+    """ return the event the browser sends for answering a remaining question, the current one by default """
+    index = quiz_session.remaining[position]
+    return {'seq': seq, 'index': index, 'answer': quiz_session.question(index)[1] if correct else 'wrong', 'correct': correct,
+            'skip': False, 'age_ms': age_ms}
+
+
+def answer_times(quiz_session):
+    """ return the time_created of the answers recorded for a quiz session, oldest first """
+    model_stats.stats_writer.flush()
+    rows = model.Session().query(model_stats.QuizActivity.time_created).filter(
+        model_stats.QuizActivity.quiz_uid == quiz_session.quiz_uid,
+        model_stats.QuizActivity.stat_type.in_(['QUIZ_QUESTION_CORRECT', 'QUIZ_QUESTION_INCORRECT'])).order_by(
+        model_stats.QuizActivity.time_created).all()
+    model.Session.remove()
+    return [r.time_created for r in rows]
+
+
+def resynchronized(jsc):
+    return any('start_client_quiz(' in x for x in jsc.js)
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_answers_in_sync_are_acknowledged(jsc, quiz_session):
+    events = [answer_event(quiz_session, 1), answer_event(quiz_session, 2, correct=False, position=1)]
+
+    record_answers(jsc, quiz_session, events)
+
+    assert quiz_session.client_seq == 2
+    assert (quiz_session.correct, quiz_session.wrong, len(quiz_session.remaining)) == (1, 1, 2)
+    assert any('client_quiz_ack(2)' in x for x in jsc.js)
+    assert not resynchronized(jsc)
+    assert len(answer_times(quiz_session)) == 2
+
+
+def test_answers_already_applied_are_ignored(jsc, quiz_session):
+    event = answer_event(quiz_session, 1)
+    record_answers(jsc, quiz_session, [event])
+    record_answers(jsc, quiz_session, [event])
+
+    assert quiz_session.correct == 1
+    assert len(answer_times(quiz_session)) == 1
+
+
+def test_grading_mismatch_resynchronizes(jsc, quiz_session):
+    event = answer_event(quiz_session, 1)
+    event['correct'] = False
+
+    record_answers(jsc, quiz_session, [event])
+
+    assert quiz_session.client_seq == 1
+    assert resynchronized(jsc)
+
+
+def test_wrong_question_resynchronizes(jsc, quiz_session):
+    event = answer_event(quiz_session, 1)
+    event['index'] = quiz_session.remaining[1]
+
+    record_answers(jsc, quiz_session, [event])
+
+    assert quiz_session.client_seq == 0
+    assert quiz_session.correct == 0
+    assert resynchronized(jsc)
+
+
+def test_skip_without_skips_left_resynchronizes(jsc, quiz_session):
+    first = quiz_session.remaining[0]
+    skips = [{'seq': 1, 'index': first, 'skip': True}, {'seq': 2, 'index': quiz_session.remaining[1], 'skip': True}]
+
+    record_answers(jsc, quiz_session, skips)
+
+    assert quiz_session.skips_left == 0
+    assert quiz_session.remaining[-1] == first
+    assert quiz_session.client_seq == 1
+    assert resynchronized(jsc)
+
+
+@pytest.mark.parametrize('age_ms', [10 ** 12, 10 ** 30])
+def test_answer_age_is_clamped_to_the_quiz_start(jsc, quiz_session, age_ms):
+    quiz_session.start_time = time.time() - 60
+    earliest = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(seconds=61)
+
+    record_answers(jsc, quiz_session, [answer_event(quiz_session, 1, age_ms=age_ms)])
+
+    times = answer_times(quiz_session)
+    assert len(times) == 1
+    assert times[0] >= earliest
+    assert not resynchronized(jsc)
+
+
+def test_negative_answer_age_is_now(jsc, quiz_session):
+    before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    record_answers(jsc, quiz_session, [answer_event(quiz_session, 1, age_ms=-10 ** 9)])
+
+    assert answer_times(quiz_session)[0] >= before - datetime.timedelta(seconds=1)
+
+
+@pytest.mark.parametrize('age_ms', ['5', 1.5, None, True, float('inf')])
+def test_answer_age_which_is_not_an_integer_is_rejected(jsc, quiz_session, age_ms):
+    record_answers(jsc, quiz_session, [answer_event(quiz_session, 1, age_ms=age_ms)])
+
+    assert quiz_session.client_seq == 0
+    assert quiz_session.correct == 0
+    assert answer_times(quiz_session) == []
+    assert resynchronized(jsc)
+
+
+@pytest.mark.parametrize('field, value', [('seq', None), ('seq', '1'), ('seq', 1.0), ('seq', True), ('index', None), ('index', '0'),
+                                          ('answer', None), ('answer', 5)])
+def test_answer_without_an_integer_seq_and_index_or_an_answer_is_rejected(jsc, quiz_session, field, value):
+    event = answer_event(quiz_session, 1)
+    if value is None:
+        del event[field]
+    else:
+        event[field] = value
+
+    record_answers(jsc, quiz_session, [event])
+
+    assert quiz_session.client_seq == 0
+    assert quiz_session.correct == 0
+    assert answer_times(quiz_session) == []
+    assert resynchronized(jsc)
+
+
+@pytest.mark.parametrize('events', [None, {'seq': 1}, ['not an answer'], [{'seq': 1, 'index': 0, 'skip': 'yes'}]])
+def test_answers_which_are_not_a_list_of_answers_are_rejected(jsc, quiz_session, events):
+    record_answers(jsc, quiz_session, events)
+
+    assert quiz_session.client_seq == 0
+    assert quiz_session.skips_left == 1
+    assert resynchronized(jsc)
+
+
+def test_skip_does_not_need_an_answer(jsc, quiz_session):
+    first = quiz_session.remaining[0]
+
+    record_answers(jsc, quiz_session, [{'seq': 1, 'index': first, 'skip': True}])
+
+    assert quiz_session.remaining[-1] == first
+    assert quiz_session.client_seq == 1
+    assert not resynchronized(jsc)
+
+
+def test_finishing_the_quiz_writes_the_score_on_the_database_workers(db, jsc, quiz_session):
+    events = [answer_event(quiz_session, seq, position=seq - 1) for seq in range(1, 4)]
+    sql_threads = set()
+
+    def record_thread(conn, cursor, statement, parameters, context, executemany):
+        sql_threads.add(threading.current_thread().name)
+    event.listen(db, 'before_cursor_execute', record_thread)
+    try:
+        record_answers(jsc, quiz_session, events)
+    finally:
+        event.remove(db, 'before_cursor_execute', record_thread)
+
+    with pytest.raises(QuizSessionNotFoundException):
+        quiz_sessions.get(quiz_session.quiz_uid)
+    assert [s['correct'] for s in model_stats.get_quiz_scores(quiz_session.user_id)] == [3]
+    assert sql_threads and all(name.startswith('db') for name in sql_threads)
@@ -0,0 +1,163 @@
+""" tests of the quiz state and its checkpoints, see quiz_session """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import pytest
+import kvstore
+import model
+from quiz_session import QuizSession, QuizSessionManager, QuizSessionNotFoundException, QuizSessionStaleException
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture
+def quiz(db):
+    """ ParsedQuiz of three questions owned by a new user """
+    user_id = model.create_user('User', 'user@example.com', 'DevAuth')
+    quiz_id = model.set_quiz(None, user_id, 'Colors', 'red|rot\nblue|blau\ngreen|gruen', 0)
+    return model.get_parsed_quiz(quiz_id)
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = kvstore.SqliteKVStore(str(tmp_path / 'kv.db'))
+    yield s
+    s.close()
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def edit_quiz(quiz):
+    """ change the data of a quiz, which bumps its version """
+    model.set_quiz(quiz.quiz_id, None, None, 'red|rot\nblue|blau', None)
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_answers_move_through_the_questions(quiz):
+    session = QuizSession(1, quiz, 1, False, '', [0, 1, 2], 1)
+    assert session.current() == ('red', 'rot', quiz.item_ids[0])
+
+    assert session.answer(True)
+    assert session.answer(False)
+    assert list(session.remaining) == [2, 1]
+    assert (session.correct, session.wrong, session.remedial) == (1, 1, 2)
+
+    assert session.answer(True)
+    assert not session.answer(True)
+    assert (session.correct, session.wrong, session.remedial) == (2, 1, 1)
+    assert session.finished
+
+
+def test_skip_moves_the_current_question_to_the_end(quiz):
+    session = QuizSession(1, quiz, 1, False, '', [0, 1, 2], 1)
+
+    session.skip()
+
+    assert list(session.remaining) == [1, 2, 0]
+    assert session.skips_left == 0
+
+
+def test_is_correct_honors_the_flags_and_the_direction(quiz):
+    session = QuizSession(1, quiz, 1, True, '', [0], 0)
+    assert session.current()[:2] == ('rot', 'red')
+    assert session.is_correct(' RED ')
+
+    case_sensitive = model.set_quiz(None, 1, 'Case', 'red|rot', model.FLAG_CASE_SENSITIVE)
+    session = QuizSession(2, model.get_parsed_quiz(case_sensitive), 1, True, '', [0], 0)
+    assert not session.is_correct('RED')
+    assert session.is_correct('red ')
+
+
+def test_checkpoint_restores_the_same_state(quiz):
+    session = QuizSession(5, quiz, 1, False, 'Mini', [2, 0, 1], 2)
+    session.answer(False)
+    session.skip()
+    session.client_seq = 4
+
+    restored = QuizSession.restore(session.checkpoint())
+
+    assert restored.checkpoint() == session.checkpoint()
+    assert restored.current() == session.current()
+
+
+def test_checkpoint_of_a_changed_quiz_is_stale(quiz):
+    checkpoint = QuizSession(5, quiz, 1, False, '', [0, 1, 2], 1).checkpoint()
+
+    edit_quiz(quiz)
+
+    with pytest.raises(QuizSessionStaleException):
+        QuizSession.restore(checkpoint)
+
+
+def test_session_started_by_another_process_is_restored_from_the_store(quiz, store):
+    first = QuizSessionManager(60)
+    first.set_store(store)
+    second = QuizSessionManager(60)
+    second.set_store(store)
+    session = first.start(quiz, 1, False, '', None, 1)
+    session.answer(True)
+    first.save(session)
+
+    restored = second.get(session.quiz_uid)
+
+    assert restored is not session
+    assert restored.checkpoint() == session.checkpoint()
+    assert second.get(session.quiz_uid) is restored
+
+    first.end(session.quiz_uid)
+    with pytest.raises(QuizSessionNotFoundException):
+        QuizSessionManager(60).get(session.quiz_uid)
+
+
+def test_stale_session_in_the_store_is_not_found(quiz, store):
+    first = QuizSessionManager(60)
+    first.set_store(store)
+    session = first.start(quiz, 1, False, '', None, 1)
+
+    edit_quiz(quiz)
+
+    second = QuizSessionManager(60)
+    second.set_store(store)
+    with pytest.raises(QuizSessionNotFoundException):
+        second.get(session.quiz_uid)
+
+
+def test_session_without_a_store_is_only_in_this_process(quiz):
+    manager = QuizSessionManager(60)
+    session = manager.start(quiz, 1, False, '', None, 1)
+
+    assert manager.get(session.quiz_uid) is session
+    with pytest.raises(QuizSessionNotFoundException):
+        QuizSessionManager(60).get(session.quiz_uid)
+    with pytest.raises(QuizSessionNotFoundException):
+        manager.get(None)
+
+
+def test_manager_restore_skips_the_stale_sessions(quiz):
+    manager = QuizSessionManager(60)
+    kept = manager.start(quiz, 1, False, '', None, 1)
+    checkpoints = manager.checkpoint()
+    other = dict(checkpoints[0], quiz_uid=kept.quiz_uid + 1, version=checkpoints[0]['version'] + 1)
+
+    restored = QuizSessionManager(60)
+    assert restored.restore(checkpoints + [other]) == 1
+    assert len(restored) == 1
+    assert restored.get(kept.quiz_uid).checkpoint() == kept.checkpoint()
+
+
+def test_idle_sessions_expire(quiz):
+    manager = QuizSessionManager(60)
+    idle = manager.start(quiz, 1, False, '', None, 1)
+    idle.last_access = idle.last_access - 61
+
+    active = manager.start(quiz, 1, False, '', None, 1)
+
+    assert len(manager) == 1
+    assert manager.get(active.quiz_uid) is active
+    with pytest.raises(QuizSessionNotFoundException):
+        manager.get(idle.quiz_uid)
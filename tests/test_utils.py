@@ -0,0 +1,195 @@
+""" tests of the handler decorators and the batching of the DOM changes, see utils """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import datetime
+import numpy as np
+import pytest
+import metrics
+import model
+import model_stats
+import utils
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+CHART_MINUTES = 200
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class Element:
+    def __init__(self, jsc, selector):
+        self._jsc = jsc
+        self._selector = selector
+
+    @property
+    def val(self):
+        self._jsc.js.append(f'read {self._selector}')
+        return 'typed'
+
+
+# --------------------------------------------------
+#    Fixtures
+# --------------------------------------------------
+@pytest.fixture(autouse=True)
+def instrumented(db):
+    """ count the SQL statements of the test database """
+    metrics.instrument_engine(db)
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def handler_metrics(name):
+    """ return the metrics recorded for a handler defined in this module """
+    return metrics.handler_metrics.snapshot()['handlers'][f'{__name__}.{name}']
+
+
+def set_activity(monkeypatch, start, data, quiz_info=()):
+    """ make get_user_activity return a chart of CHART_MINUTES minutes ending with data """
+    data = [0] * (CHART_MINUTES - len(data)) + data
+    monkeypatch.setattr(model_stats, 'get_user_activity', lambda user_id: (start, np.array(data, dtype=np.int64), list(quiz_info)))
+
+
+@utils.db_session
+def display_name_handler(jsc):
+    jsc['#a'].html = 'a'
+    jsc['#b'].css.display = 'none'
+    jsc.eval_js_code('c()')
+    return model.get_user_id(jsc.user_auth_username, jsc.user_auth_method)
+
+
+@utils.db_session
+def reading_handler(jsc):
+    jsc['#a'].html = 'a'
+    value = jsc['#answer'].val
+    jsc['#b'].html = value
+    return value
+
+
+@utils.db_session
+def model_only_handler(user_id):
+    return model.get_user_props(user_id)['display_name']
+
+
+@utils.inject_quiz_id_user_id
+def injected_handler(jsc, quiz_id, user_id):
+    jsc['#a'].html = 'a'
+    return quiz_id, user_id
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_db_session_batches_and_counts_the_messages_of_a_connection_handler(db, jsc):
+    user_id = model.create_user('User', jsc.user_auth_username, jsc.user_auth_method)
+
+    assert display_name_handler(jsc) == user_id
+
+    assert len(jsc.js) == 1
+    assert jsc.js[0].count('try {') == 3
+    recorded = handler_metrics('display_name_handler')
+    assert recorded['ws_messages']['max'] == 1
+    assert recorded['sql_statements']['max'] >= 1
+    assert recorded['wall_ms']['count'] >= 1
+    assert not model.Session.registry.has()
+
+
+def test_reading_back_flushes_first_and_counts_the_round_trip(db, jsc):
+    jsc.__class__.__getitem__ = lambda self, selector: Element(self, selector)
+    try:
+        assert reading_handler(jsc) == 'typed'
+    finally:
+        del jsc.__class__.__getitem__
+
+    assert 'a' in jsc.js[0] and jsc.js[1] == 'read #answer' and 'typed' in jsc.js[2]
+    assert handler_metrics('reading_handler')['ws_messages']['max'] == 3
+
+
+def test_db_session_records_handlers_without_a_connection(db):
+    user_id = model.create_user('User', 'user@example.com', 'DevAuth')
+
+    assert model_only_handler(user_id) == 'User'
+
+    recorded = handler_metrics('model_only_handler')
+    assert recorded['ws_messages']['max'] == 0
+    assert recorded['sql_statements']['max'] >= 1
+    assert not model.Session.registry.has()
+
+
+def test_inject_quiz_id_user_id_uses_the_pushed_ui_state(db, jsc):
+    user_id = model.create_user('User', jsc.user_auth_username, jsc.user_auth_method)
+
+    assert injected_handler(jsc, {'__ctx__': True, 'quiz_id': '7'}) == (7, user_id)
+
+    assert len(jsc.js) == 1
+    assert handler_metrics('injected_handler')['ws_messages']['max'] == 1
+
+
+def test_first_activity_chart_refresh_sends_the_full_chart(jsc, monkeypatch):
+    set_activity(monkeypatch, datetime.datetime(2024, 1, 1, 10), [0, 1, 2])
+
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+
+    assert len(jsc.js) == 1
+    assert jsc.js[0].startswith("update_chart('chart', ")
+    assert '"data": [0, 0, 0' in jsc.js[0] and '0, 1, 2], "borderColor"' in jsc.js[0]
+
+
+def test_activity_chart_refresh_shifts_and_appends_the_new_minutes(jsc, monkeypatch):
+    start = datetime.datetime(2024, 1, 1, 10)
+    set_activity(monkeypatch, start, [0, 1, 2, 3, 0])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+    jsc.js.clear()
+
+    # two minutes later, the last minute of the previous chart got another answer
+    set_activity(monkeypatch, start + datetime.timedelta(minutes=2), [0, 1, 2, 3, 1, 4, 0])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+
+    assert jsc.js == ["append_chart_point('chart', '2024-01-01 13:20:00', 4);"
+                      "append_chart_point('chart', '2024-01-01 13:21:00', 0);"
+                      f"update_chart_point('chart', {CHART_MINUTES - 3}, 1);"
+                      "refresh_chart('chart');"]
+
+
+def test_unchanged_activity_chart_sends_nothing(jsc, monkeypatch):
+    set_activity(monkeypatch, datetime.datetime(2024, 1, 1, 10), [0, 1, 2])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+    jsc.js.clear()
+
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+
+    assert jsc.js == []
+
+
+def test_activity_chart_annotations_are_updated_and_removed(jsc, monkeypatch):
+    start = datetime.datetime(2024, 1, 1, 10)
+    minute = datetime.timedelta(minutes=1)
+    set_activity(monkeypatch, start, [0, 1, 2], [[start, start + minute, 'Colors', 'GOOD'], [start + minute, start + 2 * minute, '', 'BAD']])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+    jsc.js.clear()
+
+    set_activity(monkeypatch, start, [0, 1, 2], [[start, start + 2 * minute, 'Colors', 'GOOD']])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+
+    assert len(jsc.js) == 1
+    assert jsc.js[0].startswith("update_annotation('chart', 'box0', ")
+    assert '"xMax": "2024-01-01 10:02:00"' in jsc.js[0]
+    assert jsc.js[0].endswith("remove_annotation('chart', 'box1');refresh_chart('chart');")
+
+
+@pytest.mark.parametrize('shift_minutes', [-1, CHART_MINUTES, 1000])
+def test_activity_chart_which_can_not_be_shifted_is_sent_again(jsc, monkeypatch, shift_minutes):
+    start = datetime.datetime(2024, 1, 1, 10)
+    set_activity(monkeypatch, start, [0, 1, 2])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+
+    set_activity(monkeypatch, start + datetime.timedelta(minutes=shift_minutes), [0, 1, 2])
+    utils.refresh_activity_chart(jsc, 'chart', 1)
+
+    assert len(jsc.js) == 2
+    assert jsc.js[1].startswith("update_chart('chart', ")
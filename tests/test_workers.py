@@ -0,0 +1,135 @@
+""" tests of the sticky balancer of the multi-process mode, see workers.StickyBalancer """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import asyncio
+import socket
+import workers
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+async def start_backend(name, closed):
+    """ start an HTTP backend which answers every request with its name
+
+        Args:
+            name - name returned in the body of the responses
+            closed - list the name is appended to when a connection to the backend is closed
+    """
+    async def handle(reader, writer):
+        while (await workers._read_head(reader)).endswith(b'\r\n\r\n'):
+            writer.write(f'HTTP/1.1 200 OK\r\nContent-Length: {len(name)}\r\n\r\n{name}'.encode('ascii'))
+            await writer.drain()
+        closed.append(name)
+        writer.close()
+    return await asyncio.start_server(handle, 'localhost', 0)
+
+
+async def request(port, cookie=None):
+    """ send a request through the balancer and return the head and body of the response """
+    reader, writer = await asyncio.open_connection('localhost', port)
+    writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n' + (f'Cookie: a=b; vt_worker={cookie}\r\n'.encode('ascii') if cookie is not None else b'') + b'\r\n')
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = int([x for x in head.split(b'\r\n') if x.lower().startswith(b'content-length')][0].split(b':')[1])
+    body = await reader.readexactly(length)
+    writer.close()
+    return head.decode('ascii'), body.decode('ascii')
+
+
+def run_balanced(backend_count, scenario, dead=()):
+    """ run a scenario against a balancer in front of backend_count backends
+
+        Args:
+            backend_count - number of backends, backend i answers with f'b{i}'
+            scenario - async function called with (balancer, balancer port, list of closed backend connections)
+            dead - indexes of the backends which are not running
+    """
+    async def main():
+        closed = []
+        backends = [await start_backend(f'b{i}', closed) for i in range(backend_count)]
+        ports = [b.sockets[0].getsockname()[1] for b in backends]
+        for i in dead:
+            backends[i].close()
+            await backends[i].wait_closed()
+        balancer = workers.StickyBalancer(None, ports)
+        server = await asyncio.start_server(balancer._handle, 'localhost', 0)
+        try:
+            await scenario(balancer, server.sockets[0].getsockname()[1], closed)
+        finally:
+            server.close()
+            for b in backends:
+                b.close()
+    asyncio.run(main())
+
+
+# --------------------------------------------------
+#    Tests
+# --------------------------------------------------
+def test_pick_prefers_the_cookie_then_the_least_connections():
+    balancer = workers.StickyBalancer(None, [8400, 8401, 8402])
+    balancer._connections.update({8400: 3, 8401: 1, 8402: 2})
+
+    assert balancer.pick(None) == [8401, 8402, 8400]
+    assert balancer.pick(0) == [8400, 8401, 8402]
+    assert balancer.pick(7) == [8401, 8402, 8400]
+
+
+def test_cookie_backend():
+    assert workers._cookie_backend(b'GET / HTTP/1.1\r\nCookie: x=1; vt_worker=2\r\n\r\n') == 2
+    assert workers._cookie_backend(b'GET / HTTP/1.1\r\ncookie: vt_worker=12\r\n\r\n') == 12
+    assert workers._cookie_backend(b'GET / HTTP/1.1\r\nCookie: vt_worker=x\r\n\r\n') is None
+    assert workers._cookie_backend(b'GET / HTTP/1.1\r\nX-Cookie: vt_worker=1\r\n\r\n') is None
+
+
+def test_browsers_without_the_cookie_are_spread_and_get_one():
+    async def scenario(balancer, port, closed):
+        # hold a connection to the first backend, so the next browser goes to the other one
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(b'GET / HTTP/1.1\r\nCookie: vt_worker=0\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+
+        head, body = await request(port)
+        assert body == 'b1'
+        assert 'Set-Cookie: vt_worker=1;' in head
+        writer.close()
+    run_balanced(2, scenario)
+
+
+def test_browser_with_the_cookie_sticks_to_its_backend():
+    async def scenario(balancer, port, closed):
+        for _ in range(3):
+            head, body = await request(port, cookie=1)
+            assert body == 'b1'
+            assert 'Set-Cookie' not in head
+    run_balanced(3, scenario)
+
+
+def test_browser_whose_backend_is_down_moves_and_gets_a_new_cookie():
+    async def scenario(balancer, port, closed):
+        head, body = await request(port, cookie=0)
+        assert body == 'b1'
+        assert 'Set-Cookie: vt_worker=1;' in head
+    run_balanced(2, scenario, dead=[0])
+
+
+def test_backend_connection_is_closed_when_the_client_goes_away():
+    async def scenario(balancer, port, closed):
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(b'GET / HTTP/1.1\r\nCookie: vt_worker=0\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+        writer.transport.abort()
+        for _ in range(100):
+            if closed:
+                break
+            await asyncio.sleep(0.01)
+        assert closed == ['b0']
+        assert balancer._connections == {p: 0 for p in balancer._connections}
+    run_balanced(1, scenario)
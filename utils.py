@@ -1,76 +1,352 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import contextlib
+import datetime
+import json
+import threading
+import executor
+import metrics
 import model
 import model_stats
 
 
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+# ui state of the handler running on this thread, see inject_quiz_id_user_id
+_handler_ctx = threading.local()
+
+# number of handlers running on this thread which use the database session, see db_session
+_db_session_depth = threading.local()
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class _BatchedProperties:
+    """ jsc[selector].css / jsc[selector].prop of a BatchedJsc """
+    def __init__(self, batch, selector, kind):
+        object.__setattr__(self, '_batch', batch)
+        object.__setattr__(self, '_selector', selector)
+        object.__setattr__(self, '_kind', kind)
+
+    def __getattr__(self, name):
+        self._batch.round_trip()
+        return getattr(getattr(self._batch.jsc[self._selector], self._kind), name)
+
+    def __setattr__(self, name, value):
+        self._batch.add_js(f'$({json.dumps(self._selector)}).{self._kind}({json.dumps(name)}, {json.dumps(value)})')
+
+
+class _BatchedElement:
+    """ jsc[selector] of a BatchedJsc """
+    def __init__(self, batch, selector):
+        object.__setattr__(self, '_batch', batch)
+        object.__setattr__(self, '_selector', selector)
+
+    def __getattr__(self, name):
+        if name in ('css', 'prop'):
+            return _BatchedProperties(self._batch, self._selector, name)
+        self._batch.round_trip()
+        return getattr(self._batch.jsc[self._selector], name)
+
+    def __setattr__(self, name, value):
+        self._batch.add_js(f'$({json.dumps(self._selector)}).{name}({json.dumps(value)})')
+
+
+class BatchedJsc:
+    """ wrapper around a connection which collects the DOM changes and sends them as one message
+
+        jsc[selector].html / .val / .text, jsc[selector].css.x, jsc[selector].prop.x assignments and
+        eval_js_code calls are queued as javascript.  Anything else, i.e. reading a value back from
+        the browser or show_pane, first flushes the queue so the browser sees the changes in order.
+    """
+    # attributes which do not touch the browser and do not need a flush
+    LOCAL_ATTRIBUTES = ('tag', 'user_auth_username', 'user_auth_method')
+
+    def __init__(self, jsc):
+        """ init
+
+            Args:
+                jsc - connection to wrap
+        """
+        object.__setattr__(self, 'jsc', jsc)
+        object.__setattr__(self, '_pending', [])
+
+    def __getitem__(self, selector):
+        return _BatchedElement(self, selector)
+
+    def __getattr__(self, name):
+        if name not in self.LOCAL_ATTRIBUTES:
+            self.round_trip()
+        return getattr(self.jsc, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.jsc, name, value)
+
+    def add_js(self, js_code):
+        """ queue javascript to run in the browser
+
+            Args:
+                js_code - javascript statement
+        """
+        self._pending.append(js_code)
+
+    def eval_js_code(self, js_code):
+        """ queue javascript to run in the browser, the result is not returned """
+        self.add_js(js_code)
+
+    def flush(self):
+        """ send the queued javascript to the browser in a single message """
+        if not self._pending:
+            return
+        pending = self._pending
+        object.__setattr__(self, '_pending', [])
+        metrics.count_ws_message()
+        # each statement is isolated so one failing statement does not stop the rest
+        self.jsc.eval_js_code('\n'.join(f'try {{ {x}; }} catch (e) {{ console.error(e); }}' for x in pending))
+
+    def round_trip(self):
+        """ prepare for a call which goes to the browser right away, i.e. reading a value back
+
+            The queue is flushed so the browser sees the changes in order, and the database session
+            of the handler is released, see _release_db_session, so waiting on the browser does not
+            hold a database connection
+        """
+        self.flush()
+        metrics.count_ws_message()
+        _release_db_session()
+
+
 # --------------------------------------------------
 #    Functions
 # --------------------------------------------------
+def _is_connection(x):
+    """ return True if a handler argument is a connection """
+    return isinstance(x, BatchedJsc) or hasattr(x, 'eval_js_code')
+
+
+def _connection_of(jsc):
+    """ return the connection wrapped by a BatchedJsc, or the connection itself """
+    return jsc.jsc if isinstance(jsc, BatchedJsc) else jsc
+
+
+def get_user_id(jsc):
+    """ return the user id of the user logged in on a connection
+
+        The user id is cached on the connection and only looked up again if the user id cache
+        in the model has been invalidated since
+
+        Args:
+            jsc - connection of the user
+
+        Returns:
+            user id, or None for a guest or a user that does not exist yet
+    """
+    identity = (jsc.user_auth_username, jsc.user_auth_method)
+    cached = jsc.tag.get('USER_IDENTITY', None)
+    if cached is not None and cached[0] == identity and cached[1] == model.user_id_cache_generation:
+        return cached[2]
+
+    generation = model.user_id_cache_generation
+    user_id = executor.run_db(model.get_user_id, *identity)
+    jsc.tag['USER_IDENTITY'] = (identity, generation, user_id)
+    return user_id
+
+
+@contextlib.contextmanager
+def _use_handler_ctx(ctx):
+    """ make the ui state sent with a call_py available to the handler and the handlers it calls
+
+        Args:
+            ctx - ui state pushed by the browser, None to keep the ui state of an enclosing handler
+    """
+    previous = getattr(_handler_ctx, 'ctx', None)
+    if ctx is None:
+        ctx = {} if previous is None else previous
+    _handler_ctx.ctx = ctx
+    try:
+        yield ctx
+    finally:
+        _handler_ctx.ctx = previous
+
+
+def _get_ctx_value(jsc, key, read_func):
+    """ return a ui value from the handler context, or read it from the browser if it was not pushed
+
+        Args:
+            jsc - connection of the user
+            key - key of the value in the handler context
+            read_func - function which reads the value from the browser, called with jsc
+
+        Returns:
+            ui value
+    """
+    ctx = getattr(_handler_ctx, 'ctx', None)
+    if ctx is not None and key in ctx:
+        return ctx[key]
+    value = read_func(jsc)
+    if ctx is not None:
+        ctx[key] = value
+    return value
+
+
+def _read_selected_quiz_id(jsc):
+    try:
+        return jsc.select_get_selected_options('#select_quizzes_available')[0][0]
+    except:
+        return None
+
+
+def get_selected_quiz_id(jsc):
+    """ return the id of the quiz selected in the quiz list box
+
+        Args:
+            jsc - connection of the user
+
+        Returns:
+            quiz id, or None if no quiz is selected
+    """
+    quiz_id = _get_ctx_value(jsc, 'quiz_id', _read_selected_quiz_id)
+    return None if quiz_id in (None, '') else int(quiz_id)
+
+
+def set_selected_quiz_id(jsc, quiz_id):
+    """ select a quiz in the quiz list box
+
+        Args:
+            jsc - connection of the user
+            quiz_id - id of the quiz to select, None to clear the selection
+    """
+    jsc.eval_js_code("""$("#select_quizzes_available").val([]);""")
+    if quiz_id is not None:
+        jsc.select_set_selected_options('#select_quizzes_available', quiz_id)
+    ctx = getattr(_handler_ctx, 'ctx', None)
+    if ctx is not None:
+        ctx['quiz_id'] = quiz_id
+
+
+def get_quiz_flipped(jsc):
+    """ return True if the flip quiz checkbox is checked """
+    return bool(_get_ctx_value(jsc, 'quiz_flipped', lambda jsc: jsc['#chkFlipQuiz'].prop.checked))
+
+
+def get_client_grading(jsc):
+    """ return True if the check answers in the browser checkbox is checked """
+    return bool(_get_ctx_value(jsc, 'client_grading', lambda jsc: jsc['#chkClientGrading'].prop.checked))
+
+
+def get_answer(jsc):
+    """ return the text typed in the answer box """
+    return _get_ctx_value(jsc, 'answer', lambda jsc: jsc['#answer'].val)
+
+
+def _release_db_session():
+    """ release the database session of this thread unless it has unsaved changes
+
+        The model functions commit their changes before they return, so a session without new,
+        changed or deleted objects only holds a read transaction and its pooled connection.
+    """
+    if model.Session.registry.has():
+        session = model.Session()
+        if not (session.new or session.dirty or session.deleted):
+            model.Session.remove()
+
+
+@contextlib.contextmanager
+def _use_db_session():
+    """ release the database session of this thread when the outermost handler returns
+
+        The handler threads are reused, so without this each thread would keep its session, and
+        the pooled connection and transaction of the session, open until the next handler runs.
+    """
+    depth = getattr(_db_session_depth, 'depth', 0)
+    _db_session_depth.depth = depth + 1
+    try:
+        yield
+    finally:
+        _db_session_depth.depth = depth
+        if depth == 0:
+            model.Session.remove()
+
+
+def db_session(func):
+    """ decorator for handlers which use the database without inject_quiz_id_user_id, releases the
+        database session when the handler returns and records the handler metrics, see metrics.record_handler
+
+        A handler called with a connection as its first argument also runs in order with the other
+        handlers of the connection and has its DOM changes batched, like inject_quiz_id_user_id, so
+        its messages to the browser are counted the same way.
+    """
+    name = f'{func.__module__}.{func.__name__}'
+
+    def wrapper(*args, **kwargs):
+        if not (args and _is_connection(args[0])):
+            with metrics.record_handler(name), _use_db_session():
+                return func(*args, **kwargs)
+        with executor.ordered(_connection_of(args[0])), metrics.record_handler(name), _use_db_session(), batched(args[0]) as jsc:
+            return func(jsc, *args[1:], **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def batched(jsc):
+    """ collect the DOM changes made in a with block and send them as one message at the end
+
+        Args:
+            jsc - connection of the user, an already batched connection is reused
+
+        Returns:
+            BatchedJsc to use instead of jsc inside the with block
+    """
+    if isinstance(jsc, BatchedJsc):
+        yield jsc
+        return
+    batch = BatchedJsc(jsc)
+    try:
+        yield batch
+    finally:
+        batch.flush()
+
+
 def inject_quiz_id_user_id(func):
-    """ decorator to inject quiz_id and user_id parameters """
+    """ decorator to inject quiz_id and user_id parameters
+
+        If the browser calls the handler with call_py('handler', ui_ctx()) the ui state in the
+        first argument is used instead of reading it back from the browser, so the click costs a
+        single round trip.  Handlers called from the handler share the same ui state.
+
+        The handler runs in order with the other handlers of the same connection, see
+        executor.ordered, and hands its heavy database work to the database executor, see
+        executor.run_db.  The DOM changes made by the handler are batched, see BatchedJsc, the
+        database session is released when the handler returns, see db_session, and the wall time,
+        SQL statements and messages sent to the browser are recorded, see metrics.record_handler.
+    """
+    name = f'{func.__module__}.{func.__name__}'
+
     def wrapper(jsc, *args, **kwargs):
-        user_id = model.get_user_id(jsc.user_auth_username, jsc.user_auth_method)
-        try:
-            quiz_id = jsc.select_get_selected_options('#select_quizzes_available')[0][0]
-        except:
-            quiz_id = None
-        return func(jsc, quiz_id, user_id, *args, **kwargs)
+        ctx = None
+        if args and isinstance(args[0], dict) and args[0].get('__ctx__', False):
+            ctx = args[0]
+            args = args[1:]
+
+        with executor.ordered(_connection_of(jsc)), metrics.record_handler(name), _use_db_session(), _use_handler_ctx(ctx), batched(jsc) as jsc:
+            user_id = get_user_id(jsc)
+            quiz_id = get_selected_quiz_id(jsc)
+            return func(jsc, quiz_id, user_id, *args, **kwargs)
     return wrapper
 
 
-def refresh_activity_chart(jsc, chart_name, user_id):
+def _activity_chart_annotations(quiz_info):
+    """ build the Chart.js box annotations for the quiz sessions
 
-    activity, quiz_info = model_stats.get_user_activity(user_id)
-
-    options = {'type': 'line',
-               'data': {
-                   'labels': list(activity.index.strftime('%Y-%m-%d %H:%M:%S')),
-                   'datasets': [{
-                       'label': 'Answers / Min',
-                       'data': list(activity),
-                       'borderColor': '#55bae7',
-                       'backgroundColor': '#55bae7',
-                       'pointBackgroundColor': "#55bae7",
-                       'pointBorderColor': "#55bae7",
-                       'pointHoverBackgroundColor': "#55bae7",
-                       'pointHoverBorderColor': "#55bae7",
-                       'pointRadius': 4,
-                       'borderWidth': 2}]},
-               'options': {
-                   'animation': {'duration': 0},
-                   'scales': {
-                       'xAxis': {'type': 'time',
-                                 'time': {
-                                     'tooltipFormat': 'YYYY-MM-DD HH:mm',
-                                     'displayFormats': {'minute': 'HH:mm', 'second': 'HH:mm'}},
-                                 'min': list(activity.index.strftime('%Y-%m-%d %H:%M:%S'))[-120],
-                                 'grid': {'display': 1,
-                                          'color': 'rgba(230, 230, 230, 0.5)'},
-                                 'ticks': {
-                                     'autoSkip': 1,
-                                     'maxTicksLimit': 12}},
-                       'yAxis': {'min': 0,
-                                 'grid': {'display': 1,
-                                          'color': 'rgba(230, 230, 230, 0.5)'},
-                                 'ticks': {'reverse': 0,
-                                           'beginAtZero': 1,
-                                           'stepSize': 1}}
-                       },
-                   'plugins': {
-                       'autocolors': 0,
-                       'annotation': {},
-                    'zoom': {
-                        'limits': {'x': {'min': list(activity.index.strftime('%Y-%m-%d %H:%M:%S'))[0],
-                                         'max': list(activity.index.strftime('%Y-%m-%d %H:%M:%S'))[-1]}},
-                        'pan': {'mode': 'x', 'enabled': 1},
-                        'zoom': {'mode': 'x', 'wheel': {'enabled': 1,}},
-                        }
-                    }
-                   }
-               }
+        Args:
+            quiz_info - quiz sessions returned by model_stats.get_user_activity
 
+        Returns:
+            dictionary of annotation name to annotation options
+    """
     annotations = {}
     for i, qi in enumerate(quiz_info):
         if qi[3] == 'GOOD':
@@ -95,7 +371,116 @@ def refresh_activity_chart(jsc, chart_name, user_id):
                                       'yMax': 1,
                                       'backgroundColor': 'rgba(255, 0, 0, 0.25)',
                                       'borderWidth': 0}
+    return annotations
+
+
+def _activity_chart_options(labels, data, annotations):
+    """ build the full Chart.js options for the activity chart
+
+        Args:
+            labels - list of minute labels, formatted as %Y-%m-%d %H:%M:%S in utc
+            data - list of answers for each minute
+            annotations - annotations returned by _activity_chart_annotations
+
+        Returns:
+            dictionary of Chart.js options
+    """
+    return {'type': 'line',
+            'data': {
+                'labels': labels,
+                'datasets': [{
+                    'label': 'Answers / Min',
+                    'data': data,
+                    'borderColor': '#55bae7',
+                    'backgroundColor': '#55bae7',
+                    'pointBackgroundColor': "#55bae7",
+                    'pointBorderColor': "#55bae7",
+                    'pointHoverBackgroundColor': "#55bae7",
+                    'pointHoverBorderColor': "#55bae7",
+                    'pointRadius': 4,
+                    'borderWidth': 2}]},
+            'options': {
+                'animation': {'duration': 0},
+                'scales': {
+                    'xAxis': {'type': 'time',
+                              'time': {
+                                  'tooltipFormat': 'YYYY-MM-DD HH:mm',
+                                  'displayFormats': {'minute': 'HH:mm', 'second': 'HH:mm'}},
+                              'min': labels[-120],
+                              'grid': {'display': 1,
+                                       'color': 'rgba(230, 230, 230, 0.5)'},
+                              'ticks': {
+                                  'autoSkip': 1,
+                                  'maxTicksLimit': 12}},
+                    'yAxis': {'min': 0,
+                              'grid': {'display': 1,
+                                       'color': 'rgba(230, 230, 230, 0.5)'},
+                              'ticks': {'reverse': 0,
+                                        'beginAtZero': 1,
+                                        'stepSize': 1}}
+                    },
+                'plugins': {
+                    'autocolors': 0,
+                    'annotation': {'annotations': annotations},
+                    'zoom': {
+                        'limits': {'x': {'min': labels[0],
+                                         'max': labels[-1]}},
+                        'pan': {'mode': 'x', 'enabled': 1},
+                        'zoom': {'mode': 'x', 'wheel': {'enabled': 1,}},
+                        }
+                    }
+                }
+            }
+
+
+def refresh_activity_chart(jsc, chart_name, user_id):
+    """ refresh the activity chart on a connection
+
+        The first refresh of a chart on a connection sends the full chart.  Later refreshes only send
+        the minutes and annotations which changed since the last refresh, using the chart delta
+        functions in vocabTrainer_main.html
+
+        Args:
+            jsc - connection to refresh the chart on
+            chart_name - id of the canvas of the chart
+            user_id - id of the user to show activity for, None for all users
+    """
+    start, activity, quiz_info = executor.run_db(model_stats.get_user_activity, user_id)
+    data = activity.tolist()
+    annotations = _activity_chart_annotations(quiz_info)
+
+    # find what the connection already has
+    charts = jsc.tag.setdefault('ACTIVITY_CHARTS', {})
+    sent = charts.get(chart_name, None)
+    shift = None
+    if sent is not None and len(sent['data']) == len(data):
+        shift = int((start - sent['start']).total_seconds() // 60)
+        if shift < 0 or shift >= len(data):
+            shift = None
+    charts[chart_name] = {'start': start, 'data': data, 'annotations': annotations}
+
+    # send the full chart if the connection does not have a usable copy
+    if shift is None:
+        labels = [(start + datetime.timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S') for i in range(len(data))]
+        jsc.eval_js_code(f"""update_chart('{chart_name}', {json.dumps(_activity_chart_options(labels, data, annotations))});""")
+        return
+
+    # minutes which scrolled into the chart, then minutes whose count changed
+    js = []
+    for i in range(len(data) - shift, len(data)):
+        js.append(f"""append_chart_point('{chart_name}', '{(start + datetime.timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')}', {data[i]});""")
+    for i, (old, new) in enumerate(zip(sent['data'][shift:], data)):
+        if old != new:
+            js.append(f"""update_chart_point('{chart_name}', {i}, {new});""")
 
-    options['options']['plugins']['annotation']['annotations'] = annotations
+    # annotations which changed or went away
+    for k, v in annotations.items():
+        if sent['annotations'].get(k, None) != v:
+            js.append(f"""update_annotation('{chart_name}', '{k}', {json.dumps(v)});""")
+    for k in sent['annotations']:
+        if k not in annotations:
+            js.append(f"""remove_annotation('{chart_name}', '{k}');""")
 
-    jsc.eval_js_code(f"""update_chart('{chart_name}', {options});""")
+    if js:
+        js.append(f"""refresh_chart('{chart_name}');""")
+        jsc.eval_js_code(''.join(js))
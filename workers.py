@@ -0,0 +1,337 @@
+""" multi-process deployment, several app processes behind a sticky TCP balancer
+
+    The parent process listens on the app port and forwards each TCP connection to one of the
+    worker processes, each of which runs the whole app on its own port.  Connections are routed by
+    a cookie the balancer sets on the first response to a browser, so the page, the websocket and
+    any reconnects of a browser land on the same worker while it is up, and a browser without the
+    cookie, or whose worker is down, goes to the worker with the fewest open connections.
+
+    The state the workers have to agree on lives in a SqliteKVStore next to the database: the quiz
+    sessions are checkpointed to it, see QuizSessionManager.set_store, and the in-process caches
+    tell each other about invalidations through its event log, see CacheSync.
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import cache
+import model
+import model_stats
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+# worker i listens on WORKER_BASE_PORT + i
+WORKER_BASE_PORT = 8400
+# seconds between polls of the cache invalidations published by the other workers
+CACHE_SYNC_INTERVAL = 0.5
+# channel of the cache invalidations in the event log
+CACHE_SYNC_CHANNEL = 'cache_invalidation'
+# seconds the expired keys and old events are kept in the store
+KV_EVENT_MAX_AGE = 60 * 60
+# seconds between checks for worker processes which have died
+WORKER_CHECK_INTERVAL = 1.0
+# bytes read from a socket at a time by the balancer
+BALANCER_CHUNK_SIZE = 65536
+# cookie holding the index of the worker of a browser
+BALANCER_COOKIE = 'vt_worker'
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class CacheSync:
+    """ pass the invalidations of the named caches of this process to the other worker processes and apply theirs
+
+        Invalidations are published to the event log of the store as they happen and the log is
+        polled every interval seconds, so another worker sees a change to a quiz, a user or a
+        score feed within about interval seconds.
+    """
+    def __init__(self, store, interval=CACHE_SYNC_INTERVAL):
+        """ init
+
+            Args:
+                store - SqliteKVStore shared by the workers
+                interval - seconds between polls of the event log
+        """
+        self._store = store
+        self._interval = interval
+        self._handlers = {'user_id': lambda key: model.invalidate_user_id(*key),
+                          'parsed_quiz': model.refresh_quiz,
+                          'quiz_scores': model_stats.invalidate_quiz_scores}
+        self._applying = threading.local()
+        self._last_event_id = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _publish(self, name, key):
+        """ invalidation listener, publishes the invalidations made by this process """
+        if name in self._handlers and not getattr(self._applying, 'active', False):
+            self._store.publish(CACHE_SYNC_CHANNEL, {'pid': os.getpid(), 'cache': name, 'key': key})
+
+    def apply_pending(self):
+        """ apply the invalidations published by the other processes since the last call
+
+            Returns:
+                number of invalidations applied
+        """
+        count = 0
+        self._applying.active = True
+        try:
+            for event_id, message in self._store.poll(CACHE_SYNC_CHANNEL, self._last_event_id):
+                self._last_event_id = event_id
+                if message['pid'] == os.getpid():
+                    continue
+                key = tuple(message['key']) if isinstance(message['key'], list) else message['key']
+                self._handlers[message['cache']](key)
+                count = count + 1
+        finally:
+            self._applying.active = False
+            model.Session.remove()
+        return count
+
+    def start(self):
+        """ start publishing the invalidations of this process and applying the others on a background thread """
+        self._last_event_id = self._store.last_event_id()
+        cache.add_invalidation_listener(self._publish)
+        self._thread = threading.Thread(target=self._run, name='CacheSync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ stop the background thread and stop publishing """
+        cache.remove_invalidation_listener(self._publish)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        """ background thread """
+        last_purge = time.monotonic()
+        while not self._stop.wait(self._interval):
+            try:
+                self.apply_pending()
+                if time.monotonic() - last_purge > KV_EVENT_MAX_AGE / 10:
+                    self._store.purge(KV_EVENT_MAX_AGE)
+                    last_purge = time.monotonic()
+            except Exception:
+                logging.exception('Cache sync failed')
+
+
+class StickyBalancer:
+    """ TCP proxy which sends all the connections of a browser to the same backend
+
+        The head of the first HTTP request of a connection is read to find the backend in the
+        BALANCER_COOKIE cookie.  A connection without a usable cookie goes to the backend with the
+        fewest open connections, and the cookie is added to the first response, so browsers which
+        share an address, i.e. a classroom behind a NAT, are still spread over the backends.
+    """
+    def __init__(self, port, backend_ports, backend_host='localhost', host=None):
+        """ init
+
+            Args:
+                port - port to listen on
+                backend_ports - ports of the worker processes
+                backend_host - host the worker processes listen on
+                host - address to listen on, None for all interfaces
+        """
+        self._port = port
+        self._backend_ports = list(backend_ports)
+        self._backend_host = backend_host
+        self._host = host
+        self._connections = {p: 0 for p in self._backend_ports}
+
+    def pick(self, backend_index):
+        """ return the backend ports to try, the preferred backend first
+
+            Args:
+                backend_index - index of the backend in the cookie of the browser, None if there is no cookie
+
+            Returns:
+                the backend of the cookie if it is valid, then the backends by number of open connections
+        """
+        ports = sorted(self._backend_ports, key=lambda p: self._connections[p])
+        if backend_index is not None and 0 <= backend_index < len(self._backend_ports):
+            preferred = self._backend_ports[backend_index]
+            ports = [preferred] + [p for p in ports if p != preferred]
+        return ports
+
+    async def _pipe(self, reader, writer, set_cookie=None):
+        """ copy bytes from a reader to a writer until the reader is closed
+
+            Args:
+                reader - stream to read from
+                writer - stream to write to, closed when the reader is closed
+                set_cookie - backend index to set the cookie to in the head of the first response,
+                             None to copy the bytes unchanged
+        """
+        try:
+            if set_cookie is not None:
+                writer.write(_add_cookie(await _read_head(reader), set_cookie))
+            while True:
+                data = await reader.read(BALANCER_CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, client_reader, client_writer):
+        """ connect a client to its backend and copy the bytes both ways """
+        backend_writer = None
+        try:
+            head = await _read_head(client_reader)
+            cookie_index = _cookie_backend(head)
+            for port in self.pick(cookie_index):
+                try:
+                    backend_reader, backend_writer = await asyncio.open_connection(self._backend_host, port)
+                    break
+                except OSError:
+                    continue
+            else:
+                logging.error(f'No worker available for {client_writer.get_extra_info("peername")}')
+                return
+
+            index = self._backend_ports.index(port)
+            self._connections[port] = self._connections[port] + 1
+            try:
+                backend_writer.write(head)
+                await asyncio.gather(self._pipe(client_reader, backend_writer),
+                                     self._pipe(backend_reader, client_writer, None if index == cookie_index else index))
+            finally:
+                self._connections[port] = self._connections[port] - 1
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            client_writer.close()
+            if backend_writer is not None:
+                backend_writer.close()
+
+    async def serve(self):
+        """ accept connections until cancelled """
+        server = await asyncio.start_server(self._handle, host=self._host, port=self._port)
+        async with server:
+            await server.serve_forever()
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+async def _read_head(reader):
+    """ read the head of an HTTP message, up to and including the blank line
+
+        Args:
+            reader - stream to read from
+
+        Returns:
+            bytes read, less than a full head if the stream ended first, empty if the head is too long
+    """
+    try:
+        return await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError:
+        # the head stays in the buffer and is copied as it is
+        return b''
+
+
+def _cookie_backend(head):
+    """ return the backend index in the cookie of a request head, None if there is no valid cookie
+
+        Args:
+            head - head of the HTTP request
+    """
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() != b'cookie':
+            continue
+        for cookie in value.split(b';'):
+            k, _, v = cookie.strip().partition(b'=')
+            if k == BALANCER_COOKIE.encode('ascii') and v.isdigit():
+                return int(v)
+    return None
+
+
+def _add_cookie(head, backend_index):
+    """ return a response head with the cookie of a backend added, a partial head is returned unchanged
+
+        Args:
+            head - head of the HTTP response
+            backend_index - index of the backend
+    """
+    if not head.endswith(b'\r\n\r\n'):
+        return head
+    status_line, _, rest = head.partition(b'\r\n')
+    cookie = f'Set-Cookie: {BALANCER_COOKIE}={backend_index}; Path=/; HttpOnly; SameSite=Lax\r\n'.encode('ascii')
+    return status_line + b'\r\n' + cookie + rest
+
+
+def kv_path_for(db_path):
+    """ return the default path of the store shared by the workers, next to the sqlite database
+
+        Args:
+            db_path - path of the sqlite database
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'VocabTrainer_kv.db')
+
+
+def _supervise(processes, start_worker, stop):
+    """ restart the worker processes which die, runs on a background thread
+
+        Args:
+            processes - list of the worker processes, replaced in place
+            start_worker - function which starts worker i and returns its process
+            stop - threading.Event set when the app is shutting down
+    """
+    while not stop.wait(WORKER_CHECK_INTERVAL):
+        for i, p in enumerate(processes):
+            if not p.is_alive():
+                logging.warning(f'Worker {i} exited with code {p.exitcode}, restarting it')
+                processes[i] = start_worker(i)
+
+
+def run_workers(workers, port, worker_main, args, host=None):
+    """ run worker processes behind a sticky balancer until interrupted
+
+        Args:
+            workers - number of worker processes
+            port - port the balancer listens on
+            worker_main - function run in each worker process, called with (args, worker index, worker port),
+                          must be defined at module level so it can be started in a new process
+            args - arguments passed to worker_main
+            host - address the balancer listens on, None for all interfaces
+    """
+    ctx = multiprocessing.get_context('spawn')
+
+    def start_worker(i):
+        p = ctx.Process(target=worker_main, args=(args, i, WORKER_BASE_PORT + i), name=f'worker{i}', daemon=True)
+        p.start()
+        return p
+
+    processes = [start_worker(i) for i in range(workers)]
+    stop = threading.Event()
+    supervisor = threading.Thread(target=_supervise, args=(processes, start_worker, stop), name='supervisor', daemon=True)
+    supervisor.start()
+
+    balancer = StickyBalancer(port, [WORKER_BASE_PORT + i for i in range(workers)], host=host)
+    logging.info(f'Balancing {host or "*"}:{port} over {workers} workers on ports {WORKER_BASE_PORT} to {WORKER_BASE_PORT + workers - 1}')
+    try:
+        asyncio.run(balancer.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        supervisor.join()
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()